@@ -0,0 +1,202 @@
+"""An in-memory structured mesh whose divisions and tags are NumPy arrays.
+
+ArrayScdMesh mirrors the parts of the ScdMesh interface that do not need an
+iMesh instance: dims, divisions, volumes, iteration order semantics, point
+location and tag arrays.  Hexes are identified by their integer index in
+canonical ('zyx') order instead of by iBase.Entity handles, and tag data is
+held in the `tags` dictionary as arrays indexed by these integers.
+
+Conversion to and from a real ScdMesh, or an .h5m file, happens only through
+fromScdMesh(), toScdMesh(), fromFile() and save(), so that stages that only
+do arithmetic on tags can run without MOAB in between.  itaps is only
+imported by these methods, so that ArrayScdMesh can be used without it.
+"""
+
+import numpy as np
+
+from r2s.scdgrid import ScdMeshError, ScdGridMixin, _scdIterSetup, \
+        _scdIndices, _dimConvert, _canonicalToOrder, _orderToCanonical, \
+        _sampleAt
+
+
+class ArrayScdMesh(ScdGridMixin, object):
+    """A structured mesh held entirely in NumPy arrays.
+
+    Public member variables::
+
+        self.dims -- A namedtuple indicating the minimum and maximum
+                     (i,j,k) coordinates of this structured mesh, as for
+                     ScdMesh.
+        self.vdims -- The same for the vertices of the mesh.
+        self.tags -- A dictionary mapping tag names to arrays of shape (N,)
+                     or (N,G), listing values in canonical ('zyx') hex order.
+    """
+
+    def __init__(self, x_points, y_points, z_points, tags=None,
+                 ijk_min=(0, 0, 0)):
+        """Construct an ArrayScdMesh from given x, y, and z coordinates.
+
+        Parameters
+        ----------
+        x_points, y_points, z_points : list of floats
+            List of points.
+        tags : dict, optional
+            Initial contents of self.tags; arrays in canonical hex order.
+        ijk_min : tuple of 3 ints, optional
+            The lowest (i,j,k) coordinates of the mesh.  Default is (0,0,0),
+            as for a ScdMesh created from coordinates.
+        """
+        self._divs = []
+        for points in (x_points, y_points, z_points):
+            divs = np.array(points, dtype=np.float64)
+            divs.flags.writeable = False
+            self._divs.append(divs)
+        extents = list(ijk_min)
+        extents.extend([ijk_min[x] + len(self._divs[x]) - 1 for x in range(3)])
+        self.dims = self.extents_tuple(*extents)
+        vdims_incr = list(self.dims[0:3]) + [x + 1 for x in self.dims[3:6]]
+        self.vdims = self.extents_tuple(*vdims_incr)
+        self.tags = {}
+        for name, values in (tags or {}).iteritems():
+            self._checkTagShape(name, values)
+            self.tags[name] = values
+
+    @classmethod
+    def fromScdMesh(cls, sm, tagnames=None):
+        """Copy the divisions and hex tags of a ScdMesh
+
+        Parameters
+        ----------
+        sm : ScdMesh object
+            Mesh to copy.
+        tagnames : list of strings, optional
+            Names of the tags to copy.  By default all integer and double
+            tags found on the first hex of the mesh are copied.
+        """
+        if tagnames is None:
+            tagnames = [tag.name for tag in sm.imesh.getAllTags(
+                        sm.getHex(*sm.dims[0:3])) if tag.type in 'id']
+        divs = [sm.get_division_array(dim) for dim in 'xyz']
+        m = cls(*divs, ijk_min=sm.dims[0:3])
+        hexes = sm._hexHandles()
+        for name in tagnames:
+            tag = sm.imesh.getTagHandle(name)
+            dtype = np.int32 if tag.type == 'i' else np.float64
+            m.tags[name] = np.asarray(tag[hexes], dtype=dtype)
+        return m
+
+    @classmethod
+    def fromFile(cls, filename, tagnames=None):
+        """Load a structured mesh and its hex tags from a file
+
+        The file must contain exactly one structured mesh.  See
+        fromScdMesh() for the tagnames argument.
+        """
+        from r2s.scdmesh import ScdMesh
+        sm = ScdMesh.fromFile(filename)
+        if isinstance(sm, list):
+            raise ScdMeshError('Found more than one structured mesh in file '
+                               + filename)
+        return cls.fromScdMesh(sm, tagnames)
+
+    def toScdMesh(self, imesh=None):
+        """Create a ScdMesh with the divisions and tags of this mesh
+
+        Parameters
+        ----------
+        imesh : iMesh.Mesh object, optional
+            iMesh instance in which to create the mesh; if None, a new
+            instance is created.
+        """
+        from itaps import iBase, iMesh
+        from r2s.scdmesh import ScdMesh
+        if not imesh:
+            imesh = iMesh.Mesh()
+        scdset = imesh.createStructuredMesh(list(self.dims),
+                i=self._divs[0], j=self._divs[1], k=self._divs[2],
+                create_set=True)
+        sm = ScdMesh.fromEntSet(imesh, scdset)
+        for name, values in self.tags.iteritems():
+            size = values.shape[1] if values.ndim == 2 else 1
+            try:
+                tag = imesh.createTag(name, size, values.dtype)
+            except iBase.TagAlreadyExistsError:
+                tag = imesh.getTagHandle(name)
+            tag[sm._hexHandles()] = values
+        return sm
+
+    def save(self, filename):
+        """Write this mesh and its tags to a file, e.g. an .h5m file"""
+        self.toScdMesh().imesh.save(filename)
+
+    def _checkTagShape(self, name, values):
+        n = len(self)
+        if not (isinstance(values, np.ndarray) and values.ndim in (1, 2)
+                and values.shape[0] == n):
+            raise ScdMeshError('Tag {0} must be an array with {1} rows'
+                               .format(name, n))
+
+    def __len__(self):
+        """Return the number of hexes in the mesh"""
+        return ((self.dims[3] - self.dims[0]) * (self.dims[4] - self.dims[1])
+                * (self.dims[5] - self.dims[2]))
+
+    def getHex(self, i, j, k):
+        """Return the index of the (i,j,k)'th hexahedron in the mesh"""
+        return _dimConvert(self.dims, (i, j, k))
+
+    def getHexVolume(self, i, j, k):
+        """Return the volume of the (i,j,k)'th hexahedron in the mesh"""
+        _dimConvert(self.dims, (i, j, k))
+        dx, dy, dz = [self._divs[x][n - self.dims[x] + 1] -
+                      self._divs[x][n - self.dims[x]]
+                      for x, n in enumerate((i, j, k))]
+        return dx * dy * dz
+
+    def iterateHex(self, order='zyx', **kw):
+        """Get an iterator over the hexahedra of the mesh
+
+        Yields the integer index of each hex.  See ScdMesh.iterateHex() for
+        an explanation of the order argument and the available keyword
+        arguments.
+        """
+        if order == 'zyx' and not kw:
+            return iter(xrange(len(self)))
+        indices, ordmap = _scdIterSetup(self.dims, order, **kw)
+        return iter(_scdIndices(indices, ordmap, self.dims))
+
+    def get_division_array(self, dim):
+        """Get the mesh divisions on a given dimension as a read-only ndarray
+        """
+        if not (len(dim) == 1 and dim in 'xyz'):
+            raise ScdMeshError('Invalid dimension: '+str(dim))
+        return self._divs['xyz'.find(dim)]
+
+    def sample_tag_at(self, points, tagname, fill=np.nan):
+        """Return the values of a tag at a set of points
+
+        See ScdMesh.sample_tag_at().
+        """
+        values = self.tags[tagname]
+        _, flat, outside = self.locate(points)
+        size = values.shape[1] if values.ndim == 2 else 1
+        return _sampleAt(flat, outside, size, fill, values.__getitem__)
+
+    def get_tag_array(self, name, order='xyz', dtype=np.float64,
+                      group_axis=-1):
+        """Return a tag as an ndarray of shape (nx, ny, nz), permuted by order
+
+        See ScdMesh.get_tag_array().  The returned array is a copy.
+        """
+        values = np.array(self.tags[name], dtype=dtype, copy=True)
+        return _canonicalToOrder(values, self.dims, order, group_axis)
+
+    def set_tag_array(self, name, array, order='xyz', dtype=np.float64,
+                      group_axis=-1):
+        """Store an ndarray of values as a tag
+
+        See ScdMesh.set_tag_array().
+        """
+        values = _orderToCanonical(np.asarray(array, dtype=dtype), self.dims,
+                                   order, group_axis)
+        self.tags[name] = values.copy()
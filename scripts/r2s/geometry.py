@@ -0,0 +1,433 @@
+"""Geometry providers for mmgrid.
+
+mmgrid queries its geometry through a GeometryProvider, whose methods work
+on arrays of points and of rays rather than one at a time:
+
+* find_volumes() returns the volume holding each of an array of points.
+* trace_rays() follows an array of rays through the geometry, and returns
+  the segments of each ray within each volume as a RaySegments object.
+* get_volume_list(), volume_metadata() and get_material_set() describe the
+  volumes and their materials, like the pydagmc functions of the same names.
+* volume_boundary() and graveyard_inner_box() return bounding boxes.
+
+Two providers are available:
+
+* DagmcGeometry: the geometry loaded in DagMC, through pydagmc.
+* CSGGeometry: an analytic geometry of boxes, spheres and cylinders, in
+  pure NumPy, to test and benchmark mmgrid without DagMC.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    from pydagmc import dagmc
+    from pydagmc import util as dagutil
+except ImportError:
+    dagmc = dagutil = None
+
+
+class GeometryError(Exception):
+    pass
+
+
+# File loaded into DagMC by this process, see DagmcGeometry.load()
+_loaded_file = None
+
+
+class RaySegments(namedtuple('RaySegments',
+                             ('rays', 'vols', 'starts', 'ends'))):
+    """Segments of rays within volumes, as returned by trace_rays()
+
+    Fields::
+
+        rays -- index of the ray of each segment
+        vols -- volume ID of each segment
+        starts, ends -- distances from the ray origin to the ends of each
+                        segment
+
+    Segments are sorted by ray, then distance.  The segments of a ray are
+    contiguous, from its origin until it reaches its length or enters the
+    graveyard; the graveyard has no segments.
+    """
+    __slots__ = ()
+
+
+class GeometryProvider(object):
+    """Interface of the geometry used by mmgrid
+
+    Subclasses must implement get_volume_list(), volume_metadata(),
+    find_volumes() and trace_rays(), and volume_boundary() and
+    graveyard_inner_box() to be used with find_homogeneous() and
+    mmGrid.fromDagGeom().  load() and get_material_set() have defaults.
+    Providers given to mmgrid's worker processes must be picklable.
+    Unimplemented methods raise GeometryError.
+    """
+
+    def _missing(self, method):
+        raise GeometryError('{0} does not implement {1}()'.format(
+                type(self).__name__, method))
+
+    def load(self):
+        """Make the geometry ready to use in this process, e.g. in a worker
+        process that was given a pickled copy of it.  Nothing to do by
+        default.
+        """
+        pass
+
+    def get_volume_list(self):
+        """Return the list of the IDs of all volumes, including the
+        graveyard.  IDs are positive integers; mmgrid indexes arrays with
+        them, so they should be small.
+        """
+        self._missing('get_volume_list')
+
+    def volume_metadata(self, vol):
+        """Return a dictionary with the 'material' number and the 'rho'
+        density of volume vol.  Raises GeometryError for an unknown vol.
+        """
+        self._missing('volume_metadata')
+
+    def get_material_set(self):
+        """Return the set of (material, rho) pairs of all volumes"""
+        materials = set()
+        for vol in self.get_volume_list():
+            meta = self.volume_metadata(vol)
+            materials.add( (meta['material'], meta['rho']) )
+        return materials
+
+    def find_volumes(self, points):
+        """Return an array of the volume ID holding each of an (n, 3) array
+        of points.  Providers may assume that consecutive points are near
+        each other.
+        """
+        self._missing('find_volumes')
+
+    def trace_rays(self, origins, uvw, length):
+        """Follow rays through the geometry
+
+        Parameters
+        ----------
+        origins : array_like
+            (n, 3) array of the starting points of the rays.
+        uvw : array_like
+            Unit direction of all rays, of shape (3,).
+        length : float
+            Distance along the rays after which segments are not needed.
+            The last segment of a ray may extend past it.
+
+        Returns
+        -------
+        segments : RaySegments object
+            The segments of each ray, sorted as described by RaySegments.
+        """
+        self._missing('trace_rays')
+
+    def volume_boundary(self, vol):
+        """Return the (low corner, high corner) of a box holding all of
+        volume vol.  It need not be the smallest such box, but the tighter
+        it is, the more blocks find_homogeneous() can prove homogeneous.
+        """
+        self._missing('volume_boundary')
+
+    def graveyard_inner_box(self):
+        """Return the (low corner, high corner) of the box inside the
+        graveyard, which holds the whole problem
+        """
+        self._missing('graveyard_inner_box')
+
+
+class DagmcGeometry(GeometryProvider):
+    """The geometry loaded in DagMC, through pydagmc
+
+    DagMC can load only one geometry per process, so all instances share
+    it.  If a filename is given, the file is loaded unless this process has
+    already loaded it; otherwise the geometry must have been loaded by
+    other means, e.g. pydagmc.dagmc.load().
+    """
+
+    def __init__(self, filename=None):
+        if dagmc is None:
+            raise GeometryError('DagmcGeometry needs pydagmc')
+        self.filename = filename
+        # volume of the last ray origin, tried first for the next ray
+        self.first_vol = None
+        self.load()
+
+    def load(self):
+        """Load the geometry file into DagMC, once per process"""
+        global _loaded_file
+        if self.filename is not None and _loaded_file != self.filename:
+            dagmc.load(self.filename)
+            _loaded_file = self.filename
+
+    def get_volume_list(self):
+        return dagmc.get_volume_list()
+
+    def volume_metadata(self, vol):
+        return dagmc.volume_metadata(vol)
+
+    def get_material_set(self):
+        return dagutil.get_material_set(with_rho=True)
+
+    def find_volumes(self, points):
+        # Nearby points are often in the same volume, and testing one volume
+        # is cheaper than finding the volume among all
+        vols = np.empty(len(points), dtype=int)
+        vol = None
+        for n, xyz in enumerate(points):
+            if vol is None or not dagmc.point_in_volume(vol, xyz):
+                vol = dagmc.find_volume(xyz)
+            vols[n] = vol
+        return vols
+
+    def trace_rays(self, origins, uvw, length):
+        rays, vols, starts, ends = [], [], [], []
+        for ray, xyz in enumerate(origins):
+            first_vol = self.first_vol
+            if not first_vol or not dagmc.point_in_volume(first_vol, xyz,
+                                                          uvw):
+                first_vol = dagmc.find_volume(xyz, uvw)
+            vol = first_vol
+            loc = 0.0
+            for nxtvol, raydist, _ in dagmc.ray_iterator(vol, xyz, uvw):
+                rays.append(ray)
+                vols.append(vol)
+                starts.append(loc)
+                loc += raydist
+                ends.append(loc)
+                vol = nxtvol
+                if loc >= length:
+                    break
+            # Save the first detected volume to speed future queries
+            self.first_vol = first_vol
+        return RaySegments(np.array(rays, dtype=int),
+                           np.array(vols, dtype=int),
+                           np.array(starts, dtype=np.float64),
+                           np.array(ends, dtype=np.float64))
+
+    def volume_boundary(self, vol):
+        return dagmc.volume_boundary(vol)
+
+    def graveyard_inner_box(self):
+        return dagutil.find_graveyard_inner_box()
+
+
+class Box(namedtuple('Box', ('lo', 'hi'))):
+    """Axis-aligned box from corner lo to corner hi, like MCNP's RPP"""
+    __slots__ = ()
+
+    def __new__(cls, lo, hi):
+        return super(Box, cls).__new__(cls,
+                np.asarray(lo, dtype=np.float64),
+                np.asarray(hi, dtype=np.float64))
+
+    def contains(self, points):
+        """Return whether each of an (n, 3) array of points is inside"""
+        return ((points >= self.lo) & (points < self.hi)).all(axis=-1)
+
+    def intersect(self, origins, uvw):
+        """Return arrays of the distances along each ray at which it enters
+        and leaves the box; they are equal (both inf) for rays missing it
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t1 = (self.lo - origins) / uvw
+            t2 = (self.hi - origins) / uvw
+        parallel = np.broadcast_to(uvw == 0, origins.shape)
+        inside = (origins >= self.lo) & (origins < self.hi)
+        near = np.where(parallel, np.where(inside, -np.inf, np.inf),
+                        np.minimum(t1, t2)).max(axis=-1)
+        far = np.where(parallel, np.where(inside, np.inf, -np.inf),
+                       np.maximum(t1, t2)).min(axis=-1)
+        return _interval(near, far)
+
+    def bounds(self):
+        """Return the (low corner, high corner) of the bounding box"""
+        return self.lo, self.hi
+
+
+class Sphere(namedtuple('Sphere', ('center', 'radius'))):
+    """Sphere of the given center and radius, like MCNP's SPH"""
+    __slots__ = ()
+
+    def __new__(cls, center, radius):
+        return super(Sphere, cls).__new__(cls,
+                np.asarray(center, dtype=np.float64), float(radius))
+
+    def contains(self, points):
+        """Return whether each of an (n, 3) array of points is inside"""
+        return ((points - self.center)**2).sum(axis=-1) < self.radius**2
+
+    def intersect(self, origins, uvw):
+        """See Box.intersect()"""
+        m = origins - self.center
+        b = np.dot(m, uvw)
+        disc = b**2 - ((m**2).sum(axis=-1) - self.radius**2)
+        root = np.sqrt(np.maximum(disc, 0))
+        return _interval(np.where(disc > 0, -b - root, np.inf),
+                         np.where(disc > 0, -b + root, -np.inf))
+
+    def bounds(self):
+        """Return the (low corner, high corner) of the bounding box"""
+        return self.center - self.radius, self.center + self.radius
+
+
+class Cylinder(namedtuple('Cylinder', ('base', 'height', 'radius'))):
+    """Right circular cylinder, like MCNP's RCC: the center of its base,
+    the vector from there to the center of its top, and its radius
+    """
+    __slots__ = ()
+
+    def __new__(cls, base, height, radius):
+        return super(Cylinder, cls).__new__(cls,
+                np.asarray(base, dtype=np.float64),
+                np.asarray(height, dtype=np.float64), float(radius))
+
+    def _axial(self, vectors):
+        """Split vectors into their lengths along the axis, relative to the
+        height, and their components perpendicular to it
+        """
+        h2 = np.dot(self.height, self.height)
+        along = np.dot(vectors, self.height) / h2
+        return along, vectors - along[..., np.newaxis] * self.height
+
+    def contains(self, points):
+        """Return whether each of an (n, 3) array of points is inside"""
+        along, perp = self._axial(points - self.base)
+        return (along >= 0) & (along < 1) & \
+               ((perp**2).sum(axis=-1) < self.radius**2)
+
+    def intersect(self, origins, uvw):
+        """See Box.intersect()"""
+        along, m = self._axial(origins - self.base)
+        d_along, d = self._axial(np.asarray(uvw, dtype=np.float64))
+        # side: |m + t d|^2 = r^2
+        a = np.dot(d, d)
+        b = np.dot(m, d)
+        c = (m**2).sum(axis=-1) - self.radius**2
+        if a > 0:
+            disc = b**2 - a * c
+            root = np.sqrt(np.maximum(disc, 0))
+            near = np.where(disc > 0, (-b - root) / a, np.inf)
+            far = np.where(disc > 0, (-b + root) / a, -np.inf)
+        else:
+            # parallel to the axis
+            near = np.where(c < 0, -np.inf, np.inf)
+            far = np.where(c < 0, np.inf, -np.inf)
+        # caps: 0 <= along + t d_along <= 1
+        if d_along != 0:
+            t1 = -along / d_along
+            t2 = (1 - along) / d_along
+            near = np.maximum(near, np.minimum(t1, t2))
+            far = np.minimum(far, np.maximum(t1, t2))
+        else:
+            between = (along >= 0) & (along < 1)
+            near = np.where(between, near, np.inf)
+            far = np.where(between, far, -np.inf)
+        return _interval(near, far)
+
+    def bounds(self):
+        """Return the (low corner, high corner) of the bounding box"""
+        axis = self.height / np.sqrt(np.dot(self.height, self.height))
+        extent = self.radius * np.sqrt(np.maximum(1 - axis**2, 0))
+        ends = np.array([self.base, self.base + self.height])
+        return ends.min(axis=0) - extent, ends.max(axis=0) + extent
+
+
+def _interval(near, far):
+    """Return (near, far) with empty intervals as (inf, inf)"""
+    empty = near >= far
+    return np.where(empty, np.inf, near), np.where(empty, np.inf, far)
+
+
+class CSGGeometry(GeometryProvider):
+    """Analytic geometry of boxes, spheres and cylinders
+
+    Volumes are given in order of precedence: where shapes overlap, a point
+    belongs to the first volume listed, as if later shapes were cut by the
+    earlier ones.  Inside the world box, points in no shape belong to a void
+    volume; the graveyard surrounds the world box.
+
+    Volume IDs are 1 to n for the n shapes given, n+1 for the void and n+2
+    for the graveyard.
+
+    Parameters
+    ----------
+    world : Box object
+        Box holding the problem.
+    volumes : list of (shape, material, rho)
+        Box, Sphere or Cylinder objects with the MCNP material number and
+        density of each volume.
+    """
+
+    def __init__(self, world, volumes):
+        self.world = world
+        self.shapes = [shape for shape, _, _ in volumes]
+        self.metadata = [{'material': mat, 'rho': rho}
+                         for _, mat, rho in volumes]
+        self.void = len(volumes) + 1
+        self.graveyard = len(volumes) + 2
+        self.metadata += [{'material': 0, 'rho': 0.0}] * 2
+
+    def get_volume_list(self):
+        return range(1, self.graveyard + 1)
+
+    def volume_metadata(self, vol):
+        if vol < 1 or vol > self.graveyard:
+            raise GeometryError('No volume {0}'.format(vol))
+        return self.metadata[vol - 1]
+
+    def find_volumes(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        vols = np.empty(points.shape[:-1], dtype=int)
+        vols.fill(self.graveyard)
+        found = ~self.world.contains(points)
+        for vol, shape in enumerate(self.shapes, 1):
+            inside = ~found & shape.contains(points)
+            vols[inside] = vol
+            found |= inside
+        vols[~found] = self.void
+        return vols
+
+    def trace_rays(self, origins, uvw, length):
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        uvw = np.asarray(uvw, dtype=np.float64)
+        n = len(origins)
+
+        # Every surface crossing, within [0, length] along each ray
+        crossings = [np.zeros(n), np.empty(n)]
+        crossings[1].fill(length)
+        for shape in self.shapes + [self.world]:
+            crossings.extend(shape.intersect(origins, uvw))
+        crossings = np.sort(np.clip(np.column_stack(crossings), 0, length),
+                            axis=1)
+        starts = crossings[:, :-1]
+        ends = crossings[:, 1:]
+
+        # The volume of each piece between crossings, at its middle
+        mids = origins[:, np.newaxis, :] + \
+               ((starts + ends) / 2)[..., np.newaxis] * uvw
+        vols = self.find_volumes(mids)
+        rays = np.repeat(np.arange(n), starts.shape[1]).reshape(starts.shape)
+
+        # drop empty pieces and those from the graveyard on, and merge
+        # pieces in the same volume
+        keep = ends > starts
+        keep &= np.cumsum(keep & (vols == self.graveyard), axis=1) == 0
+        rays, vols, starts, ends = rays[keep], vols[keep], starts[keep], \
+                                   ends[keep]
+        if not len(rays):
+            return RaySegments(rays, vols, starts, ends)
+        new = np.ones(len(rays), dtype=bool)
+        new[1:] = (rays[1:] != rays[:-1]) | (vols[1:] != vols[:-1])
+        last = np.append(np.flatnonzero(new)[1:], len(rays)) - 1
+        return RaySegments(rays[new], vols[new], starts[new], ends[last])
+
+    def volume_boundary(self, vol):
+        if vol <= len(self.shapes):
+            return self.shapes[vol - 1].bounds()
+        return self.world.bounds()
+
+    def graveyard_inner_box(self):
+        return self.world.bounds()
@@ -0,0 +1,192 @@
+"""Read and write multigroup data stored on mesh tags.
+
+Multigroup quantities, such as neutron fluxes and photon source strengths, can
+be stored on a mesh in one of two layouts:
+
+* per-group: one scalar tag per energy group, e.g. 'n_group_001' through
+  'n_group_175', with 'n_group_001_error' etc. for the relative errors, or
+  'phtn_src_group_001' etc. for photon source strengths.
+* vector: a single tag of length G per quantity, e.g. 'n_flux', 'n_flux_err'
+  or 'phtn_src'.
+
+The vector layout needs only one tag handle lookup per quantity, and a whole
+spectrum is read or written with a single bulk tag access.  The functions
+here accept either layout when reading, so that client code does not need to
+know which layout a mesh was tagged with.
+"""
+
+import numpy as np
+
+from itaps import iBase
+
+
+# Maps the name of each vector tag to the format string of the names of the
+# equivalent per-group tags.
+GROUP_TAG_FORMATS = {
+        'n_flux': 'n_group_{0:03d}',
+        'n_flux_err': 'n_group_{0:03d}_error',
+        'p_flux': 'p_group_{0:03d}',
+        'p_flux_err': 'p_group_{0:03d}_error',
+        'phtn_src': 'phtn_src_group_{0:03d}',
+        }
+
+
+def _find_group_tags(imesh, name, num_groups=None):
+    """Return the list of per-group tag handles for the vector tag name
+
+    If num_groups is not given, tags are looked up until one is missing (up
+    to 1000 groups).  Raises iBase.TagNotFoundError if the first group's tag
+    does not exist.
+    """
+    fmt = GROUP_TAG_FORMATS[name]
+    tags = [imesh.getTagHandle(fmt.format(1))]
+    for grp in xrange(2, (num_groups or 1000) + 1):
+        try:
+            tags.append(imesh.getTagHandle(fmt.format(grp)))
+        except iBase.TagNotFoundError:
+            if num_groups:
+                raise
+            break
+    return tags
+
+
+def count_groups(imesh, name):
+    """Return the number of energy groups of a multigroup quantity
+
+    Parameters
+    ----------
+    imesh : iMesh.Mesh object
+        Mesh on which the tags are stored.
+    name : string
+        Name of the vector tag, e.g. 'n_flux' or 'phtn_src'.  If no tag of
+        this name exists, the equivalent per-group tags are counted instead.
+
+    Returns
+    -------
+    num_groups : int
+        Number of energy groups; 0 if the quantity is not found in either
+        layout.
+    """
+    try:
+        return imesh.getTagHandle(name).sizeValues
+    except iBase.TagNotFoundError:
+        pass
+    try:
+        return len(_find_group_tags(imesh, name))
+    except iBase.TagNotFoundError:
+        return 0
+
+
+def read_group_data(imesh, voxels, name, num_groups=None):
+    """Read a multigroup quantity from a list of voxels
+
+    Parameters
+    ----------
+    imesh : iMesh.Mesh object
+        Mesh on which the tags are stored.
+    voxels : list or array of iBase.Entity handles
+        Voxels to read values from.
+    name : string
+        Name of the vector tag, e.g. 'n_flux' or 'phtn_src'.  If no tag of
+        this name exists, the equivalent per-group tags are read instead.
+    num_groups : int (optional)
+        Number of per-group tags to read.  By default all groups found are
+        read.  Ignored for the vector layout.
+
+    Returns
+    -------
+    data : 2D ndarray
+        Array of shape (len(voxels), G).
+
+    Notes
+    -----
+    Raises iBase.TagNotFoundError if the quantity is missing from the mesh,
+    or from some of the voxels.
+    """
+    try:
+        tag = imesh.getTagHandle(name)
+    except iBase.TagNotFoundError:
+        tags = _find_group_tags(imesh, name, num_groups)
+        data = np.empty((len(voxels), len(tags)), dtype=np.float64)
+        for grp, tag in enumerate(tags):
+            data[:, grp] = tag[voxels]
+        return data
+
+    data = np.asarray(tag[voxels], dtype=np.float64)
+    return data.reshape(len(voxels), tag.sizeValues)
+
+
+def write_group_data(imesh, voxels, name, data, vector=True):
+    """Write a multigroup quantity to a list of voxels
+
+    Tags are created as needed.  An existing vector tag with a different
+    number of groups is replaced.
+
+    Parameters
+    ----------
+    imesh : iMesh.Mesh object
+        Mesh on which to store the tags.
+    voxels : list or array of iBase.Entity handles
+        Voxels to write values to.
+    name : string
+        Name of the vector tag, e.g. 'n_flux' or 'phtn_src'.
+    data : array_like
+        Array of shape (len(voxels), G).
+    vector : boolean (optional)
+        If True (default), write a single vector tag called name.  Otherwise
+        write one scalar tag per group, named as in GROUP_TAG_FORMATS.
+    """
+    data = np.asarray(data, dtype=np.float64).reshape(len(voxels), -1)
+    num_groups = data.shape[1]
+
+    if vector:
+        try:
+            tag = imesh.createTag(name, num_groups, np.float64)
+        except iBase.TagAlreadyExistsError:
+            tag = imesh.getTagHandle(name)
+            if tag.sizeValues != num_groups:
+                imesh.destroyTag(tag, force=True)
+                tag = imesh.createTag(name, num_groups, np.float64)
+        if num_groups == 1:
+            tag[voxels] = data[:, 0]
+        else:
+            tag[voxels] = data
+        return
+
+    fmt = GROUP_TAG_FORMATS[name]
+    for grp in xrange(num_groups):
+        try:
+            tag = imesh.createTag(fmt.format(grp + 1), 1, np.float64)
+        except iBase.TagAlreadyExistsError:
+            tag = imesh.getTagHandle(fmt.format(grp + 1))
+        tag[voxels] = data[:, grp]
+
+
+def destroy_group_tags(imesh, name, vector=True, first_group=1):
+    """Destroy the tags of a multigroup quantity in one storage layout
+
+    Parameters
+    ----------
+    imesh : iMesh.Mesh object
+        Mesh on which the tags are stored.
+    name : string
+        Name of the vector tag, e.g. 'n_flux' or 'phtn_src'.
+    vector : boolean (optional)
+        If True (default), destroy the vector tag called name, if it exists.
+        Otherwise destroy the equivalent per-group tags.
+    first_group : int (optional)
+        Number of the first per-group tag to destroy; tags of lower groups
+        are kept.  Ignored if vector is True.
+    """
+    if vector:
+        names = [name]
+    else:
+        fmt = GROUP_TAG_FORMATS[name]
+        names = (fmt.format(grp) for grp in xrange(first_group, 1000))
+
+    for tagname in names:
+        try:
+            tag = imesh.getTagHandle(tagname)
+        except iBase.TagNotFoundError:
+            break
+        imesh.destroyTag(tag, force=True)
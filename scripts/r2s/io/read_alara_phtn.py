@@ -6,12 +6,14 @@ information to a mesh.
 """
 
 from optparse import OptionParser
+import numpy
 from itaps import iBase,iMesh
 from r2s.scdmesh import ScdMesh, ScdMeshError
+from r2s import grouptags
 
 
 def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
-                retag=False, totals=False):
+                retag=False, totals=False, vector_tags=False):
     """Read in a phtn_src file and tag the contents to a mesh.
     
     Method reads in a phtn_src file line by line, looking for
@@ -33,6 +35,9 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
         Whether to retag existing tags in mesh
     totals : boolean
         Whether to tag the total photon source strength for each voxel
+    vector_tags : boolean
+        Whether to store the photon source strengths in a single vector tag
+        'phtn_src', instead of one 'phtn_src_group_###' tag per energy group
     """
     
     fr = open(inputfile, 'r')
@@ -66,27 +71,26 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
         mesh = meshobj
         voxels = list(mesh.iterate(iBase.Type.region, iMesh.Topology.all))
 
-    # We create a list of tag objects ('tagList') to use while parsing phtn_src
-    tagList = []
-    for grp in xrange(numergbins): # group tags = parts in the line - 2
+    # We check whether the tags for the photon source already exist
+    if vector_tags:
+        tagnames = ["phtn_src"]
+    else:
+        tagnames = ["phtn_src_group_{0:03d}".format(grp+1) \
+                for grp in xrange(numergbins)]
+    for tagname in tagnames:
         try:
-            # If tags are new to file... create tag
-            tagList.append(mesh.createTag( \
-                    "phtn_src_group_{0:03d}".format(grp+1), 1, float))
-        except iBase.TagAlreadyExistsError:
-            # Else if the tags already exist...
-            if retag:
-                # Get existing tag
-                # We will overwrite tag values that already exist
-                tagList.append(mesh.getTagHandle( \
-                        "phtn_src_group_{0:03d}".format(grp+1)))
-            else:
-                # Or print error if retagging was not specified.
-                print "ERROR: The tag phtn_src_group_{0:03d} already exists " \
-                        "on the mesh." \
-                        "\nUse -r option to overwrite tags." \
-                        "".format(grp+1)
-                return 0
+            mesh.getTagHandle(tagname)
+        except iBase.TagNotFoundError:
+            continue
+        # We will overwrite tag values that already exist if retagging,
+        # or print error if retagging was not specified.
+        if not retag:
+            print "ERROR: The tag {0} already exists on the mesh." \
+                    "\nUse -r option to overwrite tags.".format(tagname)
+            return 0
+
+    # Source strengths for each voxel (rows) and energy group (columns)
+    srcdata = numpy.zeros((len(voxels), numergbins))
 
     voxelcnt = 0
 
@@ -111,8 +115,7 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
 
         if lineparts[0].strip(' ') == isotope and \
                 lineparts[1].strip(' ') == coolingstep:
-            for grp, val, in enumerate(lineparts[2:]):
-                 (tagList[grp])[voxels[voxelcnt]] = float(val)
+            srcdata[voxelcnt] = [float(val) for val in lineparts[2:]]
             foundIsoCool = True
             if specialIsotope: 
                 writeZeros = False # Ignores TOTAL line in this voxel
@@ -123,8 +126,7 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
         elif lineparts[0] == 'TOTAL' and \
                 lineparts[1].strip(' ') == coolingstep:
             if writeZeros:
-                for grp, val, in enumerate(lineparts[2:]):
-                     (tagList[grp])[voxels[voxelcnt]] = 0.0
+                srcdata[voxelcnt] = 0.0
             voxelcnt += 1
             writeZeros = True # Reset to true at end of voxel's entry
 
@@ -136,18 +138,18 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
                 "{2}.".format(coolingstep, isotope, inputfile)
         return 0
 
-    # We get rid of tags corresponding with higher energy groups
+    grouptags.write_group_data(mesh, voxels[:voxelcnt], "phtn_src", \
+            srcdata[:voxelcnt], vector=vector_tags)
+
+    # We get rid of tags corresponding with higher energy groups, and of
+    #  tags from the other storage layout, which would be read instead.
     if retag:
-        grp = len(lineparts) - 2
-        while grp:
-            try:
-                tag = mesh.getTagHandle( \
-                        "phtn_src_group_"+"{0:03d}".format(grp+1))
-                # Normally an exception is thrown by above line
-                mesh.destroyTag(tag,force=True)
-                grp += 1
-            except iBase.TagNotFoundError:
-                grp = 0 # breaks the while loop
+        if vector_tags:
+            grouptags.destroy_group_tags(mesh, "phtn_src", vector=False)
+        else:
+            grouptags.destroy_group_tags(mesh, "phtn_src", vector=False, \
+                    first_group=numergbins + 1)
+            grouptags.destroy_group_tags(mesh, "phtn_src", vector=True)
 
     if totals:
         if not tag_phtn_src_totals(mesh, voxels, numergbins, retag):
@@ -236,7 +238,8 @@ def tag_phtn_src_totals(mesh, voxels, numergbins=-1, retag=False):
     voxels : list of iMesh.Entity handles
         List of voxel entity handles (iBase.Type.Region)
     numergbins : int (optional)
-        Number of energy group tags to read
+        Number of energy group tags to read; by default all groups found are
+        read.  Ignored if the source is stored in the 'phtn_src' vector tag.
     retag : boolean
         Whether to overwrite existing 'phtn_src_total' tag. (Default: False)
     """
@@ -255,39 +258,30 @@ def tag_phtn_src_totals(mesh, voxels, numergbins=-1, retag=False):
         else:
             totalPhtnSrcTag = mesh.getTagHandle("phtn_src_total")
  
-    # If not supplied, se try/except to find number of energy bins
-    if not numergbins:
-        for i in xrange(1,1000): #~ Arbitrary: we look for up to 1000 groups
-            try:
-                mesh.getTagHandle("phtn_src_group_{0:03d}".format(i))
-            except iBase.TagNotFoundError: 
-                numergbins = i - 1
-                break
-
-    # We go voxel by voxel, calculating total photon source, and then adding
-    #  these tags.
-    for cnt, vox in enumerate(voxels):
-        totstrength = 0.0
-
-        # get total for the voxel
-        for i in xrange(1,numergbins + 1):
-            grouptag = mesh.getTagHandle("phtn_src_group_{0:03d}".format(i))
-            try:
-                totstrength += float(grouptag[vox])
-            except iBase.TagNotFoundError:
-                if cnt == 0:
-                    print "ERROR: phtn_src_group_# tags not found on first " \
-                            "voxel. Tags are probably missing."
-                else:
-                    print "ERROR: phtn_src_group_# tags not found on a non-" \
-                            "first voxel. phtn_src file used to create tags " \
-                            "probably did not include enough voxels. This is " \
-                            "a problem with ALARA and voids. Replace void " \
-                            "with any zero density material to fix this."
-                return 0
-
-        # Add the total as a tag
-        totalPhtnSrcTag[vox] = float(totstrength)
+    # If not supplied, all energy groups found on the mesh are read
+    if numergbins < 1:
+        numergbins = None
+
+    # We sum the photon source of all energy groups over all voxels at once,
+    #  and then add these tags.
+    try:
+        totstrengths = grouptags.read_group_data(mesh, voxels, "phtn_src", \
+                numergbins).sum(axis=1)
+    except iBase.TagNotFoundError:
+        try:
+            grouptags.read_group_data(mesh, voxels[:1], "phtn_src", numergbins)
+            print "ERROR: phtn_src_group_# tags not found on a non-" \
+                    "first voxel. phtn_src file used to create tags " \
+                    "probably did not include enough voxels. This is " \
+                    "a problem with ALARA and voids. Replace void " \
+                    "with any zero density material to fix this."
+        except iBase.TagNotFoundError:
+            print "ERROR: phtn_src_group_# tags not found on first " \
+                    "voxel. Tags are probably missing."
+        return 0
+
+    # Add the totals as a tag
+    totalPhtnSrcTag[voxels] = totstrengths
 
     return 1
 
@@ -326,6 +320,10 @@ def main():
             default=False,help="Option enables adding the total photon " \
             "source strength for all energy groups as a tag for each voxel. " \
             "Default: %default")
+    parser.add_option("-v","--vector",action="store_true",dest="vector", \
+            default=False,help="Option stores the photon source strengths " \
+            "of all energy groups in the single vector tag 'phtn_src'. " \
+            "Default: %default")
 
     (options, args) = parser.parse_args()
 
@@ -338,7 +336,8 @@ def main():
 
     read_to_h5m( \
                 options.phtnsrcfile, mesh, options.isotope, \
-                options.coolingstep, options.retag, options.totals)
+                options.coolingstep, options.retag, options.totals, \
+                options.vector)
 
     if isinstance(mesh, ScdMesh):
         mesh.imesh.save(options.meshfile)
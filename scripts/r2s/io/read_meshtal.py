@@ -16,7 +16,9 @@ from itaps import iMesh, iBase
 from optparse import OptionParser
 import linecache
 import sys
+import numpy
 from r2s.scdmesh import ScdMesh, ScdMeshError
+from r2s import grouptags
 
 ################################################################################
 
@@ -173,7 +175,7 @@ def find_mesh_bounds(meshtal,tally_line) :
 ###############################################################################
 
 def tag_fluxes(meshtal, meshtal_type, m, spatial_points, \
-               e_bins, sm, norm) :
+               e_bins, sm, norm, vector_tags=False) :
     """Tags the fluxes from a meshtally to a structured mesh.
 
     Parameters
@@ -192,6 +194,10 @@ def tag_fluxes(meshtal, meshtal_type, m, spatial_points, \
         Structured mesh to tag fluxes to
     norm : float, optional
        Normalization factor to multiply into each flux value. 
+    vector_tags : boolean, optional
+       If True, the group fluxes and errors are stored in the two vector tags
+       X_flux and X_flux_err, instead of one X_group_YYY and X_group_YYY_error
+       tag per energy group (X is the particle, n or p).
 
     Returns
     -------
@@ -199,15 +205,32 @@ def tag_fluxes(meshtal, meshtal_type, m, spatial_points, \
     """
     
     voxels = list(sm.iterateHex('xyz'))
-    
+
+    #Create arrays of data from meshtal file for all energy groups
+    flux_data = numpy.empty((spatial_points, e_bins))
+    error_data = numpy.empty((spatial_points, e_bins))
     for e_group in range(1, e_bins +1) : 
-        # Create tags if they do not already exist
-        if e_group != e_bins or e_bins == 1: # tag name for each E bin
-            flux_str = '{0}_group_{1:03d}'.format(meshtal_type, e_group)
-            error_str = '{0}_group_{1:03d}_error'.format(meshtal_type, e_group)
-        elif e_group == e_bins : # tag name for totals group
-            flux_str = meshtal_type + '_group_total'
-            error_str = meshtal_type + '_group_total_error'
+        for point in range(0, spatial_points) :
+            line = linecache.getline( meshtal,m+point+\
+                               (e_group-1)*spatial_points ).split()
+            flux_data[point, e_group-1] = float(line[-2])*norm
+            error_data[point, e_group-1] = float(line[-1])
+
+    # The last bin is the totals group, unless there is only one energy bin
+    if e_bins == 1:
+        num_groups = 1
+    else:
+        num_groups = e_bins - 1
+
+    #Tag data for all energy groups onto all voxels
+    grouptags.write_group_data(sm.imesh, voxels, meshtal_type + '_flux',
+            flux_data[:, :num_groups], vector=vector_tags)
+    grouptags.write_group_data(sm.imesh, voxels, meshtal_type + '_flux_err',
+            error_data[:, :num_groups], vector=vector_tags)
+
+    if num_groups != e_bins : # tag name for totals group
+        flux_str = meshtal_type + '_group_total'
+        error_str = meshtal_type + '_group_total_error'
 
         try:
             tag_flux = sm.imesh.createTag(flux_str, 1, float)
@@ -218,18 +241,8 @@ def tag_fluxes(meshtal, meshtal_type, m, spatial_points, \
         except iBase.TagAlreadyExistsError:
             tag_error = sm.imesh.getTagHandle(error_str)
 
-        #Create lists of data from meshtal file for energy group 'e_group'
-        flux_data = list()
-        error_data = list()
-        for point in range(0, spatial_points) :
-            flux_data.append( float(linecache.getline( meshtal,m+point+\
-                               (e_group-1)*spatial_points ).split()[-2])*norm)
-            error_data.append(float(linecache.getline( meshtal,m+point+\
-                               (e_group-1)*spatial_points ).split()[-1]))
-
-        #Tag data for energy group 'e_group' onto all voxels
-        tag_flux[voxels] = flux_data
-        tag_error[voxels] = error_data
+        tag_flux[voxels] = flux_data[:, -1]
+        tag_error[voxels] = error_data[:, -1]
     print "\tFluxes multiplied by source normalization of {0}".format(norm)
 
 
@@ -251,6 +264,8 @@ def read_meshtal( filename, tally_line, norm=1.0, **kw ):
     Keyword arguments:
         smesh: An existing scdmesh on which to tag the fluxes.  
                A ScdMeshError is raised if this mesh has incompatible ijk dims
+        vector_tags: If True, store group fluxes and errors in single vector
+               tags; see tag_fluxes().  Default is False.
 
     Returns
     -------
@@ -295,7 +310,7 @@ def read_meshtal( filename, tally_line, norm=1.0, **kw ):
 
     # Tagging structured mesh
     tag_fluxes(filename, meshtal_type, m, spatial_points,
-               e_bins, sm, norm)
+               e_bins, sm, norm, kw.get('vector_tags', False))
 
     return sm
 
@@ -322,6 +337,11 @@ def main( arguments = None ) :
                             not spaces (eg. -n 1.1,2.2,3.3) ')
     parser.add_option('-m', dest='smesh_filename', default=None,
                       help='Preexisting mesh on which to tag fluxes')
+    parser.add_option('-v', '--vector', dest='vector_tags', default=False,
+                      action='store_true',
+                      help='Store group fluxes and errors in single vector\
+                            tags (X_flux and X_flux_err) instead of one tag\
+                            per energy group')
                          
 
     (opts, args) = parser.parse_args(arguments)
@@ -354,9 +374,11 @@ def main( arguments = None ) :
         print "\nNow parsing tally number {0}".format(tally_numbers[n])
         if opts.smesh_filename:
             alt_sm = ScdMesh.fromFile(opts.smesh_filename)
-            sm = read_meshtal(args[1], tally_lines[n], float(norm[n]), smesh=alt_sm)
+            sm = read_meshtal(args[1], tally_lines[n], float(norm[n]),
+                              smesh=alt_sm, vector_tags=opts.vector_tags)
         else:
-            sm = read_meshtal(args[1], tally_lines[n],float(norm[n]))
+            sm = read_meshtal(args[1], tally_lines[n],float(norm[n]),
+                              vector_tags=opts.vector_tags)
         sm.scdset.save(mesh_output[n])
 
         print "\tSaved tally {0} as {1}".format(tally_numbers[n], mesh_output[n])
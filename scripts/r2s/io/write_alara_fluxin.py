@@ -3,12 +3,15 @@
 """
 `write_alara_fluxin.py` is used to create a fluxin file for ALARA. Fluxes are
 taken from a MOAB mesh, with tag names of the form 'n_group_###' where ### is
-a 3 digit number with leading zeros as needed (e.g. 001).
+a 3 digit number with leading zeros as needed (e.g. 001), or from a single
+vector tag named 'n_flux'.
 """
 
 from optparse import OptionParser
 import sys
+import numpy as np
 from itaps import iMesh, iBase
+from r2s import grouptags
 from r2s.scdmesh import ScdMesh
 
 
@@ -61,24 +64,16 @@ def find_num_e_groups(sm):
     Parameters
     ----------
     sm - Scdmesh.scmesh object
-        Structured mesh object containing tags of the form 'n_group_###'.
+        Structured mesh object containing an 'n_flux' vector tag, or tags of
+        the form 'n_group_###'.
 
     Returns
     -------
     num_e_groups - int
         Number of energy groups
     """    
-    num_e_groups = 0
-    for e_group in range(1,1000): #search for up to 1000 e_groups
-        
-        #Look for tags in the form n_group_'e_group'
-        try:
-            sm.imesh.getTagHandle('n_group_{0:03d}'.format(e_group))
-            num_e_groups += 1 #increment if tag is found
-
-       # Stop iterating once a tag is not found
-        except iBase.TagNotFoundError:
-            break
+    # Look for an 'n_flux' vector tag, or tags of the form n_group_XXX
+    num_e_groups = grouptags.count_groups(sm.imesh, 'n_flux')
 
     if num_e_groups != 0:
         print 'Energy groups found: {0}'.format(num_e_groups)
@@ -112,43 +107,36 @@ def print_fluxes(mesh, num_e_groups, backward_bool, fluxin_name, tags=None):
 
     output = open(fluxin_name, 'w')
 
-    # Get list of voxels, and set meshtype
+    # Get list of voxels, and read the fluxes of all voxels at once
     if isinstance(mesh, ScdMesh):
-        voxels = mesh.iterateHex('xyz')
-        meshtype = 'scd'
+        voxels = list(mesh.iterateHex('xyz'))
+        imesh = mesh.imesh
     else:
         voxels = list(mesh.iterate(iBase.Type.region, iMesh.Topology.all))
-        meshtype = 'gen'
+        imesh = mesh
         print "Got {0} voxels from mesh.".format(len(voxels))
 
     try:
+        if tags: # general mesh with given tags
+            fluxes = np.empty((len(voxels), num_e_groups), dtype=np.float64)
+            for e_group in xrange(num_e_groups):
+                fluxes[:, e_group] = tags[e_group][voxels]
+        else: # mesh with assumed 'n_flux' or 'n_group_###' tags
+            fluxes = grouptags.read_group_data(imesh, voxels, 'n_flux', \
+                    num_e_groups)[:, :num_e_groups]
+
+        #Establish for loop bounds based on if forward or backward printing
+        #is requested
+        if backward_bool == True:
+            fluxes = fluxes[:, ::-1]
+
         #Print fluxes for each voxel in xyz order (z changing fastest)
-        for voxel in voxels:
-            
-            #Establish for loop bounds based on if forward or backward printing
-            #is requested
-            if backward_bool == False:
-                min = 0
-                max = num_e_groups
-                direction = 1
-            else:
-                min = num_e_groups -1
-                max = -1
-                direction = -1
-            
+        for voxelfluxes in fluxes:
             #Print flux data to file
             count=0
-            for e_group in range(min,max,direction):
-                #TODO: use try/except for catching missing tags
-                if tags and meshtype == 'gen': # general mesh with given tags
-                    output.write(str((tags[e_group])[voxel]) + " ")
-                elif meshtype == 'gen': # general mesh with assumed tags
-                    output.write(str(mesh.getTagHandle( \
-                            'n_group_{0:03d}'.format(e_group+1))[voxel]) + " ")
-                else: # structured mesh with assumed tags
-                    output.write(str(mesh.imesh.getTagHandle( \
-                            'n_group_{0:03d}'.format(e_group+1))[voxel]) + " ")
-                
+            for flux in voxelfluxes:
+                output.write(str(float(flux)) + " ")
+
                 #flux.in formatting: create a new line after every 8th entry
                 count += 1
                 if count % 8 == 0:
@@ -161,7 +149,7 @@ def print_fluxes(mesh, num_e_groups, backward_bool, fluxin_name, tags=None):
         if tags:
             print "Missing tag on mesh: {0}".format(tags[e_group].name)
         else:
-            print "Missing tag on mesh: n_group_{0:03d}".format(e_group+1)
+            print "Missing tag on mesh: n_flux or n_group_XXX"
 
     output.close()
 
@@ -4,6 +4,7 @@ import sys
 import re
 import operator
 
+import numpy as np
 from itaps import iBase, iMesh, iMeshExtensions
 from r2s.scdmesh import ScdMesh
 from r2s.volumes import calc_volume
@@ -94,6 +95,64 @@ def create_mixture_definitions(mesh):
     return (unique_mixtures, mat_tags)
 
 
+def create_sparse_mixture_definitions(mesh, fractions):
+    """Return the unique materials of a mesh from sparse material fractions
+
+    Equivalent to create_mixture_definitions() for a structured mesh whose
+    material fractions are given as coordinate lists, as stored by a sparse
+    mmgrid, rather than read from each material tag of each voxel.
+
+    Parameters
+    ----------
+    mesh : ScdMesh object
+        Mesh object with the material tags.
+    fractions : tuple
+        (names, voxels, materials, fracs): the list of material tag names,
+        with 'matVOID' first, and arrays giving for each nonzero fraction
+        its voxel's flat index in 'xyz' order, the index of its material in
+        names, and its value.  Entries must be sorted by voxel.
+
+    Returns
+    -------
+    ... : tuple
+        (unique_mixtures, mat_tags, voxel_mixtures).  unique_mixtures and
+        mat_tags are as returned by create_mixture_definitions(), except that
+        voxels are listed by flat index instead of hex handle.
+        voxel_mixtures is an array of the mixture ID of each voxel in 'xyz'
+        order, or -1 for void voxels.
+    """
+    names, voxels, materials, fracs = fractions
+    mat_tags = [mesh.imesh.getTagHandle(name) for name in names]
+    num_voxels = np.prod([mesh.dims[x+3] - mesh.dims[x] for x in range(3)])
+    bounds = np.searchsorted(voxels, np.arange(num_voxels+1))
+
+    unique_mixtures = dict()
+    keys = dict() # sparse mixture key -> full mixture tuple
+    voxel_mixtures = np.empty(num_voxels, dtype=int)
+    for voxel in xrange(num_voxels):
+        entries = slice(bounds[voxel], bounds[voxel+1])
+        key = tuple( (m, round(x, 6)) for m, x in 
+                    zip(materials[entries], fracs[entries]) if round(x, 6) )
+        if key not in keys:
+            mixture = [0.0] * len(mat_tags)
+            for m, x in key:
+                mixture[m] = x
+            keys[key] = tuple(mixture)
+        mixture = keys[key]
+        if mixture[0] == 1: # a void material
+            voxel_mixtures[voxel] = -1
+            continue
+        if mixture not in unique_mixtures:
+            unique_mixtures[mixture] = [len(unique_mixtures), voxel]
+        else:
+            unique_mixtures[mixture].append(voxel)
+        voxel_mixtures[voxel] = unique_mixtures[mixture][0]
+
+    print "{0} unique mixtures in {1} voxels".format( \
+            len(unique_mixtures), num_voxels)
+    return (unique_mixtures, mat_tags, voxel_mixtures)
+
+
 def write_zones(mesh, output_file):
     """Write the volume and zone lines to the ALARA geometry output
 
@@ -109,7 +168,7 @@ def write_zones(mesh, output_file):
     output_file.write('volume\n')
     
     if isinstance(mesh, ScdMesh):
-        for idx, vol in enumerate(mesh.iterateHexVolumes('xyz')):
+        for idx, vol in enumerate(mesh.hex_volumes('xyz').ravel()):
             output_file.write("\t{0}\tzone_{1}\n".format(vol, idx))
     else:
         for idx, voxel in enumerate( \
@@ -152,7 +211,8 @@ def write_mixtures(mixtures, mat_tags, name_dict, output_file):
             "mixture pseudo_void\n\tmaterial\tpseudo_void\t1\t1\nend\n\n")
 
 
-def write_mat_loading(mesh, mat_tags, mixtures, output_file):
+def write_mat_loading(mesh, mat_tags, mixtures, output_file,
+                      voxel_mixtures=None):
     """Write the mat_loading information to the ALARA geometry output
 
     Parameters
@@ -165,10 +225,23 @@ def write_mat_loading(mesh, mat_tags, mixtures, output_file):
         ...
     output_file : file object
         Opened file for writing contents of ALARA geometry 
+    voxel_mixtures : array of ints (optional)
+        Mixture ID of each voxel, or -1 for void voxels, as returned by
+        create_sparse_mixture_definitions().  If given, material tags are
+        not read.
     """
 
     output_file.write('mat_loading\n')
 
+    if voxel_mixtures is not None:
+        for idx, mix_id in enumerate(voxel_mixtures):
+            if mix_id < 0:
+                output_file.write('\tzone_{0}\tpseudo_void\n'.format(idx))
+            else:
+                output_file.write('\tzone_{0}\tmix_{1}\n'.format(idx,mix_id))
+        output_file.write('end\n\n')
+        return
+
     # Get correct iterator
     if isinstance(mesh, ScdMesh):
         voxels_iterator = mesh.iterateHex('xyz')
@@ -186,7 +259,7 @@ def write_mat_loading(mesh, mat_tags, mixtures, output_file):
     output_file.write('end\n\n')
 
 
-def write_alara_geom(filename, mesh, namedict={}):
+def write_alara_geom(filename, mesh, namedict={}, fractions=None):
     """Given a mesh with mmgrid tags, write an ALARA geometry file
     
     Parameters
@@ -197,13 +270,23 @@ def write_alara_geom(filename, mesh, namedict={}):
         Mesh object containing materials tags
     namedict : dictionary (optional)
         Dictionary of names for material compositions
+    fractions : tuple (optional)
+        Sparse material fractions of a structured mesh, from which mixtures
+        are detected instead of from the material tags.  See
+        create_sparse_mixture_definitions().
     """
-    mixtures, mat_tags = create_mixture_definitions(mesh)
+    voxel_mixtures = None
+    if fractions is None:
+        mixtures, mat_tags = create_mixture_definitions(mesh)
+    else:
+        mixtures, mat_tags, voxel_mixtures = \
+                create_sparse_mixture_definitions(mesh, fractions)
 
     with open(filename,'w') as output_file:
         write_zones(mesh, output_file)
         write_mixtures(mixtures, mat_tags, namedict, output_file)
-        write_mat_loading(mesh, mat_tags, mixtures, output_file)
+        write_mat_loading(mesh, mat_tags, mixtures, output_file,
+                          voxel_mixtures)
 
 
 def main():
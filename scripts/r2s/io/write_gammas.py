@@ -14,54 +14,71 @@
 import os.path
 from datetime import datetime
 from optparse import OptionParser
+import numpy as np
 from itaps import iBase,iMesh,iMeshExtensions
 
+from r2s import grouptags
 from r2s.scdmesh import ScdMesh, ScdMeshError
 from r2s.volumes import calc_volume
 
-def calc_total_source_strength(mesh, voxels, tag_srcsum=False, **kwargs):
-    """
+def calc_total_source_strength(mesh, voxels, tag_srcsum=False, vols=None, \
+        **kwargs):
+    """Sum photon source strengths over all voxels of a mesh
+
+    Parameters
+    ----------
+    mesh : iMesh.Mesh object
+        Mesh with photon source strength tags.
+    voxels : list of iBase.Entity handles
+        Voxels to sum over.
+    tag_srcsum : boolean, optional
+        If true, store the total in the root set tag 'PHTN_SRC_TOTAL'.
+    vols : array_like, optional
+        Volumes of the voxels, e.g. from ScdMesh.hex_volumes().  If not
+        given, they are calculated for each voxel from its vertices.
+    keyword arguments
+        Currently valid: {'isotope', 'coolingstep'}, used to label the
+        'phtn_src_total' file.
+
+    Returns
+    -------
+    sumvoxelsourcestrengths : float
+        Total photon source strength.
+    sourcevolumetotal : float
+        Total volume of voxels with nonzero source strength.
+    numergbins : int
+        Number of photon energy groups.
+    vols : list or ndarray of floats
+        Volumes of the voxels.
     """
 
     try:
-        grouptag = mesh.getTagHandle("phtn_src_group_001")
+        srcdata = grouptags.read_group_data(mesh, voxels, "phtn_src")
     except iBase.TagNotFoundError, e:
-        print "ERROR: The structured mesh does not contain tags of the " \
-                "form 'phtn_src_group_#.'"
+        print "ERROR: The structured mesh does not contain a 'phtn_src' " \
+                "tag or tags of the form 'phtn_src_group_#.'"
         raise e
 
-    # Initialize list to first erg bin source strength value for each voxel
-    meshstrengths = [float(grouptag[x]) for x in voxels]
-
-    numergbins = 0
-
-    # We now go through all photon energy groups and sum the individual bins
-    #  to get the total source strength in each voxel
-    for i in xrange(2,1000): #~ Arbitrary: we look for up to 1000 groups
-        try:
-            grouptag = mesh.getTagHandle("phtn_src_group_{0:03d}".format(i))
-            for cnt, vox in enumerate(voxels):
-                meshstrengths[cnt] += float(grouptag[vox])
-        except iBase.TagNotFoundError: 
-            numergbins = i - 1
-            break
-    
+    numergbins = srcdata.shape[1]
     print "Found tags for {0} photon energy bins.".format(numergbins)
 
-    vols = [calc_volume(mesh, voxel) for voxel in voxels]
+    # Sum the individual bins to get the total source strength in each voxel
+    meshstrengths = srcdata.sum(axis=1)
+
+    if vols is None:
+        vols = [calc_volume(mesh, voxel) for voxel in voxels]
 
     # We calculate the normalization factor as the sum over all voxels of:
     #  voxel volumetric source strength * voxel volume
     # Divided by the volume of all voxels with non-zero source strength.
     # This applies for variable voxel sizes in a structured mesh.
-    numactivatedcells = 0 # number of voxels that have nonzero source strength
-    sumvoxelsourcestrengths = 0 # total photon source strength in entire model
-    sourcevolumetotal = 0 # total activated volume in model
-    for cnt, meshstr in enumerate(meshstrengths):
-        if meshstr > 0:
-            numactivatedcells += 1
-            sumvoxelsourcestrengths += vols[cnt] * meshstr
-            sourcevolumetotal += vols[cnt]
+    activated = meshstrengths > 0 # voxels with nonzero source strength
+    volarray = np.asarray(vols, dtype=np.float64)
+    # total photon source strength in entire model
+    sumvoxelsourcestrengths = float(np.sum(volarray[activated] * \
+            meshstrengths[activated]))
+    # total activated volume in model
+    sourcevolumetotal = float(np.sum(volarray[activated]))
 
     if tag_srcsum:
         _tag_sumvoxelstrengths(mesh, sumvoxelsourcestrengths)
@@ -125,7 +142,8 @@ def gen_gammas_file_from_h5m(sm, outfile="gammas", sampling='v', \
     voxels = list(sm.iterateHex('xyz'))
 
     sumvoxelstrengths, sourcevolumetotal, numergbins, vols = \
-            calc_total_source_strength(sm.imesh, voxels)
+            calc_total_source_strength(sm.imesh, voxels, \
+            vols=sm.hex_volumes('xyz').ravel())
 
     # norm is the average volumetric source strength (phtns/s/cm3)
     try:
@@ -170,33 +188,33 @@ def gen_gammas_file_from_h5m(sm, outfile="gammas", sampling='v', \
     fw = _gen_gammas_header(sm, outfile, sampling, myergbins, have_bias_info, \
             cumulative, resample, uni_resamp_all, **kwargs)
 
+    # Note an important distinction depending on sampling approach:
+    # -We account for voxel volume in voxel sampling
+    # -We do not do this for uniform sampling, because it is already
+    #   accounted for - more particles start in a voxel if it is larger
+    # How to think of this difference: for correct 'normalization' in the 
+    #  sampling process, we want photons/s/voxel for voxel sampling, and 
+    #  photons/s/volume for uniform sampling.
+    srcdata = grouptags.read_group_data(sm.imesh, voxels, "phtn_src")
+    if sampling == 'v':
+        ergprobs = np.asarray(vols)[:, np.newaxis] * srcdata / norm
+    elif sampling == 'u':
+        ergprobs = srcdata / norm
+    sourcetotals = ergprobs.sum(axis=1)
+    if cumulative:
+        ergprobs = np.cumsum(ergprobs, axis=1)
+
+    if have_bias_info:
+        biases = bias_tag[voxels]
+
     for cnt, voxel in enumerate(voxels):
-        sourcetotal = 0
-        ergproblist = list()
-        # We go through each energy group for the voxel and:
-        # -make list of energy bin source strengths & group #s (ergproblist)
-        # -sum up the total source strength (sourcetotal)
-        #
-        # Note an important distinction depending on sampling approach:
-        # -We account for voxel volume in voxel sampling
-        # -We do not do this for uniform sampling, because it is already
-        #   accounted for - more particles start in a voxel if it is larger
-        # How to think of this difference: for correct 'normalization' in the 
-        #  sampling process, we want photons/s/voxel for voxel sampling, and 
-        #  photons/s/volume for uniform sampling.
-        for i in xrange(1, numergbins + 1):
-            if sampling == 'v':
-                ergproblist.append(float(vols[cnt] * sm.imesh.getTagHandle( \
-                        "phtn_src_group_{0:03d}".format(i))[voxel]) / norm)
-            elif sampling == 'u':
-                ergproblist.append(float(sm.imesh.getTagHandle( \
-                        "phtn_src_group_{0:03d}".format(i))[voxel]) / norm)
-
-            sourcetotal += ergproblist[i-1]
-            if cumulative: ergproblist[i-1] = sourcetotal
+        # Each row holds the energy bin source strengths (ergproblist) of
+        #  the voxel, which sum to the voxel's total source strength
+        sourcetotal = sourcetotals[cnt]
+        ergproblist = ergprobs[cnt]
 
         if have_bias_info:
-            bias = str(bias_tag[voxel]) + " "
+            bias = str(float(biases[cnt])) + " "
         else: bias = ""
 
         # Special case if there is no source strength: write line full of 0's
@@ -208,7 +226,7 @@ def gen_gammas_file_from_h5m(sm, outfile="gammas", sampling='v', \
             continue
 
         if have_bias_info:
-            bias = " " + str(bias_tag[voxel])
+            bias = " " + str(float(biases[cnt]))
         else: bias = ""
 
         # Regular case:
@@ -335,34 +353,7 @@ def calc_sm_volumes_list(sm):
          -iterate x
     """
     
-    meshplanes = [ sm.getDivisions('x'),
-                   sm.getDivisions('y'),
-                   sm.getDivisions('z') ]
-
-    oldz = meshplanes[2][0]
-    oldy = meshplanes[1][0]
-    oldx = meshplanes[0][0]
-
-    nxdiv = len(meshplanes[0]) - 1
-    nydiv = len(meshplanes[1]) - 1
-    nzdiv = len(meshplanes[2]) - 1
-
-    # create 1D list
-    vols = [0] * (nxdiv * nydiv * nzdiv)
-
-    for cntx, x in enumerate(meshplanes[0][1:]):
-        oldy = meshplanes[1][0]
-        for cnty, y in enumerate(meshplanes[1][1:]):
-            oldz = meshplanes[2][0]
-            for cntz, z in enumerate(meshplanes[2][1:]):
-                # Calc volume here
-                vols[nydiv*nzdiv*cntx + nzdiv*cnty + cntz] = \
-                        (x - oldx) * (y - oldy) * (z - oldz)
-                oldz = z
-            oldy = y
-        oldx = x
-    
-    return vols
+    return sm.hex_volumes('xyz').ravel().tolist()
 
 
 def _tag_sumvoxelstrengths(mesh, val):
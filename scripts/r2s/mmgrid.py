@@ -1,17 +1,26 @@
 #!/usr/bin/env python
 
 from operator import itemgetter
+from collections import namedtuple
 import itertools
 import numpy as np
 import random
 import sys
+import os
+import time
+import cPickle
+import hashlib
 import optparse
+import multiprocessing
 
-from itaps import iMesh, iBase
-from r2s import scdmesh
-from io.write_alara_geom import write_alara_geom
-from pydagmc import dagmc
-from pydagmc import util as dagutil
+try:
+    from itaps import iMesh, iBase
+    from r2s import scdmesh
+except ImportError:
+    # mmGrid can still run on an ArrayScdMesh, e.g. with a CSGGeometry
+    iMesh = iBase = scdmesh = None
+from r2s.arrayscdmesh import ArrayScdMesh
+from r2s.geometry import DagmcGeometry
 
 
 class mmGridError(Exception):
@@ -20,6 +29,12 @@ class mmGridError(Exception):
 
 _quiet = False
 
+# Geometry used by grids not given another, see load_geom()
+_geometry = None
+
+# mmGrid of a worker process, see _init_worker()
+_worker_grid = None
+
 
 def _msg(msg, newline=True):
     """Print to stdout if the module's _quiet flag is not set.
@@ -34,15 +49,32 @@ def _msg(msg, newline=True):
         sys.stdout.flush()
 
 
-def prepare_materials():
+def _default_geometry():
+    """Return the geometry given to load_geom(), or else the geometry
+    loaded in DagMC by other means
     """
+    global _geometry
+    if _geometry is None:
+        _geometry = DagmcGeometry()
+    return _geometry
+
+
+def prepare_materials(geometry=None):
+    """
+
+    Parameters
+    ----------
+    geometry : GeometryProvider object, optional
+        Geometry to get materials from, by default the DagMC geometry.
 
     Returns
     -------
     names : ?
         ?
     """
-    matset = dagutil.get_material_set(with_rho=True)
+    if geometry is None:
+        geometry = _default_geometry()
+    matset = geometry.get_material_set()
     names = {}
     for idx, (mat, rho) in enumerate(sorted(matset, key=itemgetter(0))):
         if mat == 0:
@@ -53,14 +85,16 @@ def prepare_materials():
     return names
 
 
-def get_mat_id(materials, volume_id):
+def get_mat_id(materials, volume_id, geometry=None):
     """
 
     Returns
     -------
     mat_idx : int?
     """
-    mat = dagmc.volume_metadata(volume_id)
+    if geometry is None:
+        geometry = _default_geometry()
+    mat = geometry.volume_metadata(volume_id)
     matnum = mat['material']
     matrho = mat['rho']
     if matnum == 0.0:
@@ -70,7 +104,10 @@ def get_mat_id(materials, volume_id):
 
 
 def get_vox_centers(mesh, voxels):
-    """Calculate the center point of voxels and return a list of (x,y,z) coords
+    """Calculate the center point of voxels and return an array of coords
+
+    The vertices of all voxels are fetched with one adjacency query and one
+    coordinate query, so voxels of any topology can be mixed.
 
     Parameters
     ----------
@@ -81,30 +118,122 @@ def get_vox_centers(mesh, voxels):
 
     Returns
     -------
-    coords : list of (x, y, z) float triplets
-        Coordinates of voxel centers in mesh's canonical voxel order.
+    coords : numpy array
+        (N, 3) array of the coordinates of voxel centers, in the order of
+        voxels.
     """
-    coords = list()
-    for voxel in voxels:
-        vtxcoords = mesh.getVtxCoords(mesh.getEntAdj(voxel, iBase.Type.vertex))
-        xavg = np.mean([c[0] for c in vtxcoords])
-        yavg = np.mean([c[1] for c in vtxcoords])
-        zavg = np.mean([c[2] for c in vtxcoords])
-        coords.append( [xavg, yavg, zavg] )
+    if len(voxels) == 0:
+        return np.zeros((0, 3), dtype=np.float64)
+    vtxcoords, offsets = _get_vertex_coords(mesh, voxels)
+    coords = np.add.reduceat(vtxcoords, offsets[:-1], axis=0) / \
+             np.diff(offsets)[:, np.newaxis]
 
     print "Got center coords for {0} voxels.".format(len(voxels))
     return coords
 
 
-def get_point_materials(materials, coords):
+def _get_vertex_coords(mesh, voxels):
+    """Return (coords, offsets) of the vertices of voxels: an array of the
+    coordinates of all their vertices, and the offsets into it of each
+    voxel's vertices, from one adjacency query and one coordinate query
+    """
+    adj = mesh.getEntAdj(voxels, iBase.Type.vertex)
+    offsets = np.asarray(adj.offsets)
+    vtxcoords = np.asarray(mesh.getVtxCoords(adj.data), dtype=np.float64)
+    return vtxcoords, offsets
+
+
+def _relative_errs(mats, errs):
+    """Return the errors of material fractions relative to the fractions
+
+    Fractions of zero have no error, and get a relative error of zero.
+    """
+    return errs / np.maximum(mats, np.finfo(np.float64).tiny)
+
+
+def _sample_tets(corners, n, rng=np.random):
+    """Sample points uniformly in tetrahedra
+
+    Points in the unit cube are folded into the reference tetrahedron as
+    described by Rocchini and Cignoni (2001), the fastest method tried in
+    mcnp_source/testing_gammas/test_tet_sampling, and then mapped to each
+    tetrahedron by their barycentric coordinates.
+
+    Parameters
+    ----------
+    corners : numpy array
+        (T, 4, 3) array of the vertices of T tetrahedra.
+    n : int
+        Number of points to sample per tetrahedron.
+    rng : numpy.random.RandomState, optional
+
+    Returns
+    -------
+    points : numpy array
+        (T, n, 3) array of the points in each tetrahedron.
+    """
+    s, t, u = rng.random_sample((3, len(corners), n))
+    # fold the cube into the prism s + t <= 1
+    fold = s + t > 1
+    s = np.where(fold, 1 - s, s)
+    t = np.where(fold, 1 - t, t)
+    # and the prism into the tetrahedron s + t + u <= 1
+    over = s + t + u > 1
+    tu = over & (t + u > 1)
+    st = over & ~tu
+    s, t, u = (np.where(st, 1 - t - u, s),
+               np.where(tu, 1 - u, t),
+               np.where(tu, 1 - s - t, np.where(st, s + t + u - 1, u)))
+
+    origin = corners[:, np.newaxis, 0]
+    edges = corners[:, np.newaxis, 1:] - origin[:, :, np.newaxis]
+    return origin + s[..., np.newaxis] * edges[:, :, 0] + \
+           t[..., np.newaxis] * edges[:, :, 1] + \
+           u[..., np.newaxis] * edges[:, :, 2]
+
+
+def get_volume_materials(materials, geometry=None):
+    """Build a table of the material index of every DagMC volume
+
+    Parameters
+    ----------
+    materials : dictionary
+        Material dictionary from prepare_materials().
+    geometry : GeometryProvider object, optional
+        Geometry of the volumes, by default the DagMC geometry.
+
+    Returns
+    -------
+    vol_mats : numpy array of ints
+        Array indexed by DagMC volume ID, whose entries are the material
+        indices that get_mat_id() returns for each volume, or -1 for IDs that
+        are not volumes.
+    """
+    if geometry is None:
+        geometry = _default_geometry()
+    vols = geometry.get_volume_list()
+    vol_mats = np.empty(max(vols)+1, dtype=int)
+    vol_mats.fill(-1)
+    for vol in vols:
+        vol_mats[vol] = get_mat_id(materials, vol, geometry)
+    return vol_mats
+
+
+def get_point_materials(materials, coords, vol_mats=None, geometry=None):
     """Query DAGMC for materials at a list of points
 
     Parameters
     ----------
     materials : dictionary
         ...
-    coords : list of (x, y, z) float triplets
-        Point coordinates; typically for voxel centers.
+    coords : list of (x, y, z) float triplets, or (N, 3) array
+        Point coordinates; typically for voxel centers.  Nearby points
+        should be consecutive, as the volume of each point is tried first
+        for the next.
+    vol_mats : numpy array of ints, optional
+        Table from get_volume_materials(); built if not given.
+    geometry : GeometryProvider object, optional
+        Geometry to query, by default the DagMC geometry.
     
     Returns
     -------
@@ -113,14 +242,16 @@ def get_point_materials(materials, coords):
 
     Notes
     -----
-    Requires that DagMC geometry has already been loaded via dagmc.load().
+    Requires that DagMC geometry has already been loaded via dagmc.load(),
+    unless another geometry is given.
     """
-    mats = list()
-    for coord in coords:
-        vol_id = dagmc.find_volume(coord)
-        mats.append(get_mat_id(materials, vol_id))
-        
-    return mats
+    if geometry is None:
+        geometry = _default_geometry()
+    if vol_mats is None:
+        vol_mats = get_volume_materials(materials, geometry)
+    vol_ids = geometry.find_volumes(
+            np.asarray(coords, dtype=np.float64).reshape(-1, 3))
+    return vol_mats[vol_ids].tolist()
 
 
 def _linspace_square( n ):
@@ -151,13 +282,15 @@ def _linspace_square( n ):
     return points_inside
 
 
-def _random_square( n ):
+def _random_square( n, rng=random ):
     """Return a callable that creates randomly distributed points in the give quad
     
     Parameters
     ----------
     n : integer
         Number of rays to fire
+    rng : random.Random object, optional
+        Source of random numbers; defaults to the random module.
     
     Returns
     -------
@@ -166,12 +299,133 @@ def _random_square( n ):
     """
     def points_inside(a0, a1, b0, b1):
         for _ in xrange(n):
-            a = random.uniform(a0,a1)
-            b = random.uniform(b0,b1)
+            a = rng.uniform(a0,a1)
+            b = rng.uniform(b0,b1)
             yield a,b
     return points_inside
 
 
+def _jitter_square( n, rng=random ):
+    """Return a callable that creates stratified, jittered points in the given quad
+
+    The quad is divided into n by n equal cells, and one point is chosen at
+    random within each cell.
+    
+    Parameters
+    ----------
+    n : integer
+        Number of rays to fire in each dimension
+    rng : random.Random object, optional
+        Source of random numbers; defaults to the random module.
+    
+    Returns
+    -------
+    points_inside : generator
+        Generator that provides n^2 jittered (a,b) points given (a0, a1, b0, b1)
+    """
+    def points_inside(a0, a1, b0, b1):
+        da = (a1-a0) / float(n)
+        db = (b1-b0) / float(n)
+        for i, j in itertools.product(xrange(n), xrange(n)):
+            yield a0 + (i + rng.random()) * da, b0 + (j + rng.random()) * db
+    return points_inside
+
+
+def _radical_inverse( indices, base ):
+    """Return the radical inverses of an array of non-negative integers"""
+    indices = np.array(indices, dtype=np.int64)
+    inverse = np.zeros(indices.shape, dtype=np.float64)
+    scale = 1.0 / base
+    while indices.any():
+        inverse += (indices % base) * scale
+        indices //= base
+        scale /= base
+    return inverse
+
+
+def _halton_square( n, rng=random ):
+    """Return a callable that creates points of a Halton sequence in the given quad
+
+    Uses the first n points of the 2D Halton sequence in bases 2 and 3.  Each
+    call shifts the sequence by a random offset (modulo the quad), so that
+    points differ between quads and batches.
+    
+    Parameters
+    ----------
+    n : integer
+        Number of rays to fire
+    rng : random.Random object, optional
+        Source of random numbers; defaults to the random module.
+    
+    Returns
+    -------
+    points_inside : generator
+        Generator that provides n quasi-random (a,b) points given (a0, a1, b0, b1)
+    """
+    us = _radical_inverse(np.arange(n), 2)
+    vs = _radical_inverse(np.arange(n), 3)
+    def points_inside(a0, a1, b0, b1):
+        u = (us + rng.random()) % 1.0
+        v = (vs + rng.random()) % 1.0
+        return itertools.izip(a0 + (a1-a0) * u, b0 + (b1-b0) * v)
+    return points_inside
+
+
+# Direction numbers of the first two dimensions of the Sobol sequence, as
+# 32 bit integers
+_SOBOL_BITS = 32
+_sobol_directions = np.zeros((2, _SOBOL_BITS), dtype=np.uint64)
+_sobol_directions[0] = [1 << (_SOBOL_BITS-1-k) for k in range(_SOBOL_BITS)]
+_sobol_directions[1,0] = 1 << (_SOBOL_BITS-1)
+for _k in range(1, _SOBOL_BITS):
+    _sobol_directions[1,_k] = _sobol_directions[1,_k-1] ^ \
+                              (_sobol_directions[1,_k-1] >> np.uint64(1))
+
+
+def _sobol_square( n, rng=random ):
+    """Return a callable that creates points of a Sobol sequence in the given quad
+
+    Uses the first n points of the 2D Sobol sequence.  Each call applies a
+    random digital shift, which preserves the sequence's stratification,
+    so that points differ between quads and batches.  The sequence is best
+    stratified when n is a power of two.
+    
+    Parameters
+    ----------
+    n : integer
+        Number of rays to fire
+    rng : random.Random object, optional
+        Source of random numbers; defaults to the random module.
+    
+    Returns
+    -------
+    points_inside : generator
+        Generator that provides n quasi-random (a,b) points given (a0, a1, b0, b1)
+    """
+    indices = np.arange(n, dtype=np.uint64)
+    ints = np.zeros((2, n), dtype=np.uint64)
+    for k in range(_SOBOL_BITS):
+        bit = (indices >> np.uint64(k)) & np.uint64(1)
+        ints ^= bit * _sobol_directions[:,k:k+1]
+    def points_inside(a0, a1, b0, b1):
+        shift = np.array([rng.getrandbits(_SOBOL_BITS) for _ in range(2)],
+                         dtype=np.uint64)
+        u, v = (ints ^ shift[:,np.newaxis]) / float(2**_SOBOL_BITS)
+        return itertools.izip(a0 + (a1-a0) * u, b0 + (b1-b0) * v)
+    return points_inside
+
+
+# Ray origin sampling methods of mmGrid.generate(): functions of N and a
+# random.Random object, returning a points_inside generator of N^2 points
+RAY_SAMPLING = {
+    'random': lambda N, rng: _random_square(N**2, rng),
+    'grid': lambda N, rng: _linspace_square(N),
+    'jitter': _jitter_square,
+    'halton': lambda N, rng: _halton_square(N**2, rng),
+    'sobol': lambda N, rng: _sobol_square(N**2, rng),
+}
+
+
 def pairwise(l):
     """Generator: given a sequence x, yield (x[0],x[1]), (x[1],x[2]), ..."""
     it = iter(l)
@@ -189,9 +443,14 @@ class MatGrid:
     - generate()
     """
 
-    def __init__(self, mesh):
-        """ """
-        self.materials = prepare_materials()
+    def __init__(self, mesh, geometry=None):
+        """Prepare the materials of geometry, by default the DagMC geometry
+        """
+        if geometry is None:
+            geometry = _default_geometry()
+        self.geometry = geometry
+        self.materials = prepare_materials(geometry)
+        self.vol_mats = get_volume_materials(self.materials, geometry)
 
 
 class SingleMatGrid(MatGrid):
@@ -200,9 +459,11 @@ class SingleMatGrid(MatGrid):
     Each voxel on the grid contains a single material.
     """
 
-    def __init__( self, mesh ):
-        """Create a grid based on a given mesh"""
-        MatGrid.__init__(self, mesh)
+    def __init__( self, mesh, geometry=None ):
+        """Create a grid based on a given mesh, and optionally a
+        GeometryProvider other than the DagMC geometry
+        """
+        MatGrid.__init__(self, mesh, geometry)
         self.mesh = mesh
 
         self.voxels = list(mesh.iterate(iBase.Type.region, iMesh.Topology.all))
@@ -210,8 +471,14 @@ class SingleMatGrid(MatGrid):
 
     def create_tags(self):
         """Tag voxels with each material
+
+        Each material's fraction and error tags are written to all voxels at
+        once.
         """
         mesh = self.mesh
+        voxmats = np.asarray(self.voxmats)
+        # We don't have errors with this method
+        zeros = np.zeros(len(self.voxels), dtype=np.float64)
         # Iterate through each material in the problem
         for idx, ((mat, rho), (matnum,matname)) in enumerate(self.materials.iteritems()):
             # Get tag handle
@@ -224,33 +491,155 @@ class SingleMatGrid(MatGrid):
             except iBase.TagAlreadyExistsError:
                 errtag = mesh.getTagHandle( matname + '_err')
 
-            # Tag each voxel
-            for vox, mat in itertools.izip(self.voxels, self.voxmats):
-
-                if mat == matnum:
-                    # Material matnum is assumed to be 100%  of voxel contents
-                    mattag[vox] = 1.0
-                else:
-                    # matnum is treated as not present in the voxel
-                    mattag[vox] = 0.0
-
-                # We don't have errors with this method
-                errtag[vox] = 0.0
+            # Material matnum is assumed to be 100% of the contents of voxels
+            # where it was found, and not present in the others
+            mattag[self.voxels] = (voxmats == matnum).astype(np.float64)
+            errtag[self.voxels] = zeros
 
 
     def generate(self):
         """Get voxel materials by getting voxel centers and checking with DagMC
         """
         self.coords = get_vox_centers(self.mesh, self.voxels)
-        self.voxmats = get_point_materials(self.materials, self.coords)
+        self.voxmats = get_point_materials(self.materials, self.coords,
+                                           self.vol_mats, self.geometry)
+
+
+class TetMatGrid(MatGrid):
+    """Object representing the material fractions of a tetrahedral mesh
+
+    The volume fraction of each material in each tet is estimated from
+    points sampled uniformly within it.  Regions of the mesh other than
+    tets are ignored.
+
+    Public member variables::
+
+        self.voxels -- List of the tets of the mesh.
+        self.fracs -- Array of shape (number of tets, number of materials)
+                      of the volume fraction of each material in each tet,
+                      after generate().
+        self.errs -- Array of the standard deviations of self.fracs.
+        self.max_err -- The largest standard deviation in self.errs.
+    """
+
+    # Number of points whose volumes are found at once
+    batch_points = 2**16
+
+    def __init__( self, mesh, geometry=None ):
+        """Create a grid based on a given tet mesh, and optionally a
+        GeometryProvider other than the DagMC geometry
+        """
+        MatGrid.__init__(self, mesh, geometry)
+        self.mesh = mesh
+
+        self.voxels = list(mesh.iterate(iBase.Type.region,
+                                        iMesh.Topology.tetrahedron))
+        self.fracs = None
+        self.errs = None
+        self.max_err = None
+
+    def generate(self, N=100, seed=None):
+        """Sample N points in each tet and find the volumes holding them
+
+        The fraction of each material in a tet is the fraction of its points
+        in that material, and its error the standard deviation of the
+        binomial distribution of this fraction.  Tets inside one volume
+        have no error.
+
+        Returns
+        -------
+        errs : numpy array
+            The statistical errors of the material fractions, self.errs.
+            The largest error is also stored as self.max_err.
+        """
+        num_mats = len(self.materials)
+        counts = np.zeros((len(self.voxels), num_mats), dtype=np.float64)
+        if len(self.voxels):
+            vtxcoords, offsets = _get_vertex_coords(self.mesh, self.voxels)
+            if (np.diff(offsets) != 4).any():
+                raise mmGridError('TetMatGrid needs a mesh of tetrahedra')
+            corners = vtxcoords.reshape(-1, 4, 3)
+        rng = np.random.RandomState(seed)
+
+        batch = max(1, self.batch_points // N)
+        for start in xrange(0, len(self.voxels), batch):
+            _msg('\rSampling tets: {0}%'.format(
+                    (100 * start) / len(self.voxels)), False)
+            points = _sample_tets(corners[start:start+batch], N, rng)
+            vols = self.geometry.find_volumes(points.reshape(-1, 3))
+            mats = self.vol_mats[vols].reshape(-1, N)
+            tets = np.repeat(np.arange(len(mats)), N)
+            counts[start:start+len(mats)] = np.bincount(
+                    tets * num_mats + mats.ravel(),
+                    minlength=len(mats) * num_mats).reshape(-1, num_mats)
+        _msg('\rSampling tets: 100%')
+
+        self.fracs = counts / N
+        self.errs = np.sqrt(self.fracs * (1 - self.fracs) / N)
+        self.max_err = self.errs.max() if self.errs.size else 0.0
+        _msg("Maximum error: {0}".format(self.max_err))
+        return self.errs
+
+    def create_tags(self):
+        """Tag tets with the fraction and error of each material"""
+        mesh = self.mesh
+        for (mat, rho), (matnum, matname) in self.materials.iteritems():
+            try:
+                mattag = mesh.createTag( matname, 1, np.float64 )
+            except iBase.TagAlreadyExistsError:
+                mattag = mesh.getTagHandle( matname )
+            try:
+                errtag = mesh.createTag( matname+'_err', 1, np.float64 )
+            except iBase.TagAlreadyExistsError:
+                errtag = mesh.getTagHandle( matname + '_err')
+
+            mattag[self.voxels] = self.fracs[:,matnum]
+            errtag[self.voxels] = self.errs[:,matnum]
+
+
+class SparseFractions(namedtuple('SparseFractions',
+                                 ('voxels', 'materials', 'mats', 'errs'))):
+    """Material fractions of a sparse mmGrid, as coordinate lists
+
+    Fields::
+
+        voxels -- flat index of the voxel of each entry, in 'xyz' order
+        materials -- material index of each entry
+        mats -- volume fraction of the material in the voxel
+        errs -- standard deviation of the fraction
+
+    Entries are sorted by voxel, then material.  Materials absent from a
+    voxel have no entry.
+    """
+    __slots__ = ()
 
 
 class mmGrid(MatGrid):
-    """Object representing a macromaterial grid"""
+    """Object representing a macromaterial grid
+
+    Public member variables::
+
+        self.grid -- Array of shape (nx, ny, nz) in 'xyz' order, with fields
+                     'mats' and 'errs'.  After generate(), these hold the
+                     volume fraction of each material in each voxel and its
+                     standard deviation.
+        self.max_err -- The largest standard deviation in self.grid, set by
+                        generate().
+        self.sparse -- For a sparse grid, a SparseFractions object holding
+                       the nonzero material fractions and their errors after
+                       generate().  self.grid is then None.
+    """
+
+    def __init__( self, scdmesh, sparse=False, geometry=None ):
+        """Create a grid based on a given structured mesh
 
-    def __init__( self, scdmesh ):
-        """Create a grid based on a given structured mesh"""
-        MatGrid.__init__(self, scdmesh.imesh)
+        If sparse is True, the grid stores only the nonzero material
+        fractions of each voxel, so that memory scales with the number of
+        materials per voxel rather than the total number of materials.
+        Rays are traced through geometry, a GeometryProvider, by default
+        the DagMC geometry.
+        """
+        MatGrid.__init__(self, getattr(scdmesh, 'imesh', None), geometry)
         self.scdmesh = scdmesh
 
         idim = scdmesh.dims.imax - scdmesh.dims.imin
@@ -258,32 +647,40 @@ class mmGrid(MatGrid):
         kdim = scdmesh.dims.kmax - scdmesh.dims.kmin
         mat_dim = len( self.materials )
 
+        self.shape = (idim, jdim, kdim)
         self.voxel_dt = np.dtype([('mats',np.float64,mat_dim),
                                   ('errs',np.float64,mat_dim)])
-        self.grid = np.zeros( (idim, jdim, kdim), dtype=self.voxel_dt )
-        self.first_vol = None
+        self.sparse = None
+        if sparse:
+            self.grid = None
+        else:
+            self.grid = np.zeros( self.shape, dtype=self.voxel_dt )
+        self.max_err = None
 
     @classmethod
-    def fromDagGeom( cls, ndiv=10 ):
+    def fromDagGeom( cls, ndiv=10, sparse=False, geometry=None ):
         """Create a grid based on the geometry currently loaded in DagMC
 
         Creates an equally spaced grid with ndiv divisions per side, set
         within the full DagMC geometry.  This constructor requires that
-        DagMC has geometry loaded with a rectangular graveyard volume
+        DagMC has geometry loaded with a rectangular graveyard volume.
+        See __init__() for the sparse and geometry arguments.
         """
-        low_corner, high_corner = dagutil.find_graveyard_inner_box()
+        if geometry is None:
+            geometry = _default_geometry()
+        low_corner, high_corner = geometry.graveyard_inner_box()
         divisions = [0]*3
         for i in range(3):
             divisions[i] = np.linspace(low_corner[i],high_corner[i],ndiv,endpoint=True)
-        return cls( scdmesh.ScdMesh(*divisions) )
+        return cls( scdmesh.ScdMesh(*divisions), sparse, geometry )
 
     def _rayframe_count(self, dim):
 
         sm = self.scdmesh
 
         plane = 'xyz'.replace(dim,'')
-        adivs = sm.getDivisions( plane[0] )
-        bdivs = sm.getDivisions( plane[1] )
+        adivs = sm.get_division_array( plane[0] )
+        bdivs = sm.get_division_array( plane[1] )
 
         return (len(adivs)-1)*(len(bdivs)-1)
 
@@ -313,152 +710,846 @@ class mmGrid(MatGrid):
                 ijk[b_idx] += 1
             ijk[a_idx] += 1
 
-    def _grid_fragments(self, divs, div, startloc, length):
-        """Generator: yield line segments along a ray
+    def _grid_fragments(self, divs, widths, starts, ends):
+        """Split segments of rays into the voxels they cross
 
-        The divs parameter is the divisions of the grid along a ray.  Div is
-        the division index after which the ray starts, and startloc is the
-        starting position.  Length is the length of the ray from startloc.
+        The divs parameter is the divisions of the grid along the rays, and
+        widths the lengths of its voxels.  Segments run from starts to ends,
+        arrays of positions along the rays.  The first and last voxels of
+        each segment are found by bisection.
 
-        Yields a 3-tuple (L, ratio, keepgoing)
-            L: The length of the ray segment in the next grid element
-            ratio: the ratio of L to length of the grid element.
-            keepgoing: true if unassigned length remains after this iteration.
+        Returns (segments, voxels, ratios): arrays with an entry for each
+        voxel crossed by each segment, of the index of the segment, the
+        index of the voxel along the rays, and the length of the segment in
+        the voxel relative to the length of the voxel.
         """
-        L = length
-        loc = startloc
-        for x0, x1 in pairwise(divs[div:]):
-            diff = x1 - loc
-            meshdiff = x1 - x0
-            if diff < L:
-                L -= diff
-                loc += diff
-                yield (diff,diff/meshdiff,True)
-            else:  # diff >= L
-                yield (L,L/meshdiff,False)
-                loc = L
-                break
-
-    def _alloc_one_ray(self, start_ijk, dim, xyz, uvw, divs, samples):
-        """Fire a single ray and store the sampled data to the grid
+        ends = np.minimum(ends, divs[-1])
+        first = divs.searchsorted(starts, 'right') - 1
+        last = divs.searchsorted(ends, 'left') - 1
+        counts = np.where(ends > starts, last - first + 1, 0)
+        segments = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(len(segments)) - \
+                  np.repeat(np.cumsum(counts) - counts, counts)
+        voxels = first[segments] + offsets
+        ratios = (np.minimum(ends[segments], divs[voxels+1]) -
+                  np.maximum(starts[segments], divs[voxels])) / widths[voxels]
+        return segments, voxels, ratios
+
+    def _trace_rays(self, origins, idx, divs, widths, mats, errs):
+        """Fire rays and add their samples to mats and errs
         
-        start_ijk: structured mesh coordinates of the hex from which ray begins
-        dim: 0, 1, or 2 depending on whether whether ray is x, y, or z-directed.
-        xyz: start position of ray
-        uvw: direction of ray
-        divs: The structured grid divisions along this dimension.
-        samples: 2D array of zeros used to store ray info
+        origins: (n, 3) array of the start positions of the rays, on the
+                 first division of the grid along dimension idx
+        idx: index of the dimension along which the rays go
+        divs: The structured grid divisions along this dimension, an array.
+        widths: The lengths of the voxels along this dimension.
+        mats, errs: 2D arrays, indexed by (voxel along the rays, material),
+                    to which the sums and sums of squares of the rays'
+                    normalized track lengths are added
+        """
+        uvw = np.zeros(3, dtype=np.float64)
+        uvw[idx] = 1.0
+        segs = self.geometry.trace_rays(origins, uvw, divs[-1] - divs[0])
+        segments, voxels, ratios = self._grid_fragments(divs, widths,
+                divs[0] + segs.starts, divs[0] + segs.ends)
+
+        # The sample of each ray is the sum of its ratios in each voxel and
+        # material
+        size = mats.size
+        cells = voxels * mats.shape[1] + self.vol_mats[segs.vols[segments]]
+        keys, inverse = np.unique(segs.rays[segments] * size + cells,
+                                  return_inverse=True)
+        samples = np.bincount(inverse, weights=ratios)
+        cells = keys % size
+        mats += np.bincount(cells, samples, size).reshape(mats.shape)
+        errs += np.bincount(cells, samples**2, size).reshape(errs.shape)
+
+    def _ray_chunks(self):
+        """Return the list of ray chunks: one (dim index, a index) pair for
+        each row of squares of each ray frame.
+
+        Chunks are the unit of work for generate(); they do not depend on
+        the number of worker processes, so results do not either.
         """
-        first_vol = self.first_vol
-        if not first_vol or not dagmc.point_in_volume(first_vol,xyz,uvw):
-            first_vol = dagmc.find_volume(xyz,uvw)
-
-        vol = first_vol
-        loc = divs[0]
-        div = 0
-        for nxtvol, raydist, _ in dagmc.ray_iterator( vol, xyz, uvw ):
-            mat_idx = get_mat_id( self.materials, vol )
-            vol = nxtvol
-            for meshdist, meshrat, newloc in self._grid_fragments( divs, div, loc, raydist ):
-                # The ray fills this voxel for a normalized distance of
-                # meshrat = (meshdist / length_of_voxel)
-                samples[div,mat_idx] += meshrat
-                loc += meshdist
-                if(newloc):
-                    div += 1
-
-        # Save the first detected volume to speed future queries
-        self.first_vol = first_vol
-
-        # prepare an indexing object for self.grid to access the appropriate mesh row.
-        # It is important to use a slice object rather than a general sequence
-        # because a general sequence will trigger numpy's advanced iteration,
-        # which returns copies of data instead of views.
-        idx_ijk = start_ijk
-        idx_ijk[dim] = slice(self.scdmesh.dims[dim], self.scdmesh.dims[dim+3])
-        for sample, voxel in itertools.izip_longest( samples, self.grid[idx_ijk]):
-            voxel['mats'] += sample
-            voxel['errs'] += sample**2
-
-    def generate(self, N, use_grid=False ):
+        chunks = []
+        for idx, dim in enumerate('xyz'):
+            plane = 'xyz'.replace(dim,'')
+            na = len(self.scdmesh.get_division_array( plane[0] )) - 1
+            chunks.extend( (idx, a) for a in xrange(na) )
+        return chunks
+
+    def _fire_chunk(self, chunk, N, sampling, seed, sparse=False,
+                    squares=None, batch=0):
+        """Fire the rays of one chunk of a ray frame
+
+        The chunk is a row of squares at a fixed position along the first
+        dimension of the frame (see _rayframe).  Ray origins are chosen by
+        the RAY_SAMPLING method named sampling.  The chunk uses its own
+        random number generator seeded from seed and the chunk, so that its
+        rays do not depend on which process fires them.
+        squares optionally lists the indices of the squares of the row to
+        fire, and batch numbers the successive batches of rays fired in the
+        same squares by adaptive sampling.
+
+        Returns (mats, errs): arrays of shape (number of squares fired,
+        voxels along the ray, materials) with the sums and the sums of
+        squares of the samples of each ray row.  If sparse is True, returns
+        a SparseFractions object holding the nonzero sums and sums of
+        squares instead.
+        """
+        idx, a = chunk
+        dim = 'xyz'[idx]
+        plane = 'xyz'.replace(dim,'')
+        sm = self.scdmesh
+        adivs = sm.get_division_array( plane[0] )
+        bdivs = sm.get_division_array( plane[1] )
+        divs = sm.get_division_array(dim)
+        widths = np.diff(divs)
+
+        rng = random.Random( ((seed * 3 + idx) * 1000003 + a) * 1000003
+                             + batch )
+        rays = RAY_SAMPLING[sampling](N, rng)
+
+        def make_xyz(ab):
+                xyz = np.empty((len(ab), 3), dtype=np.float64)
+                xyz[:,idx] = divs[0]
+                xyz[:,[x for x in range(3) if x != idx]] = ab
+                return xyz
+
+        if squares is None:
+            squares = range(len(bdivs)-1)
+        shape = (len(squares), len(divs)-1, len(self.materials))
+        if sparse:
+            # only one row of squares is held densely at a time
+            mats = np.zeros(shape[1:], dtype=np.float64)
+            errs = np.zeros(shape[1:], dtype=np.float64)
+            pieces = []
+        else:
+            mats = np.zeros(shape, dtype=np.float64)
+            errs = np.zeros(shape, dtype=np.float64)
+
+        a0, a1 = adivs[a], adivs[a+1]
+        for n, b in enumerate(squares):
+            b0, b1 = bdivs[b], bdivs[b+1]
+            rowmats = mats if sparse else mats[n]
+            rowerrs = errs if sparse else errs[n]
+            # Fire the rays that start in this square, each one a sample
+            origins = make_xyz(list(rays(a0, a1, b0, b1)))
+            self._trace_rays( origins, idx, divs, widths, rowmats, rowerrs )
+            if sparse:
+                along, mat_idx = np.nonzero(rowmats)
+                ijk = [None]*3
+                ijk[idx] = along
+                ijk['xyz'.find(plane[0])] = a
+                ijk['xyz'.find(plane[1])] = b
+                voxels = np.ravel_multi_index(ijk, self.shape)
+                pieces.append( (voxels, mat_idx, rowmats[along,mat_idx],
+                                rowerrs[along,mat_idx]) )
+                rowmats[:,:] = 0
+                rowerrs[:,:] = 0
+
+        if sparse:
+            return SparseFractions(*[np.concatenate(x) for x in zip(*pieces)])
+        return mats, errs
+
+    def _add_chunk(self, chunk, mats, errs, squares=None):
+        """Add the results of _fire_chunk to self.grid"""
+        idx, a = chunk
+        plane = 'xyz'.replace('xyz'[idx],'')
+        a_idx = 'xyz'.find(plane[0])
+        b_idx = 'xyz'.find(plane[1])
+        index = [slice(None)]*3
+        index[a_idx] = a
+        if squares is not None:
+            # add each ray row separately
+            for n, b in enumerate(squares):
+                index[b_idx] = b
+                self.grid['mats'][tuple(index)] += mats[n]
+                self.grid['errs'][tuple(index)] += errs[n]
+            return
+        if b_idx > idx:
+            # grid row has the ray dimension before the b dimension
+            mats = mats.swapaxes(0,1)
+            errs = errs.swapaxes(0,1)
+        self.grid['mats'][tuple(index)] += mats
+        self.grid['errs'][tuple(index)] += errs
+
+    def generate(self, N, sampling='random', workers=1, seed=None,
+                 target_err=None, max_rays=None, checkpoint=None,
+                 checkpoint_interval=600, resume=False, homogeneous=False ):
         """Sample the DagMC geometry and store the results on this grid.
 
         N is the number of samples to take per voxel per dimension
+
+        Parameters
+        ----------
+        N : int
+            Number of samples to take per voxel per dimension; N^2 rays are
+            fired per row of voxels.
+        sampling : string, optional
+            How ray starting points are chosen in each square of mesh rows,
+            one of the keys of RAY_SAMPLING:
+
+            * 'random': randomly selected points (default)
+            * 'grid': a regular grid of points
+            * 'jitter': one random point in each cell of a regular grid
+            * 'halton', 'sobol': randomly shifted quasi-random sequences
+
+            The stratified methods ('jitter', 'halton' and 'sobol') reduce
+            errors faster than random points as N grows, but the errors
+            reported for them are those of random points, an overestimate.
+            For backwards compatibility, True and False select 'grid' and
+            'random'.
+        workers : int, optional
+            Number of processes to fire rays in.  Worker processes load the
+            geometry given to load_geom(), unless they inherit it from this
+            process.  Default is 1, firing all rays in this process.
+        seed : int, optional
+            Seed for the random ray starting points.  Results are the same
+            for a given seed regardless of workers.  By default a seed is
+            drawn from the random module.
+        target_err : float, optional
+            Enables adaptive sampling: after the first N^2 rays per row,
+            further batches of N^2 rays are fired only in the rows crossing
+            a voxel where the relative error of some material fraction, its
+            error divided by the fraction, exceeds target_err; rows with the
+            largest relative errors first.  Voxels inside one volume have
+            no error and need no further rays.  Cannot use a grid of rays.
+        max_rays : int, optional
+            Total number of rays that adaptive sampling may fire, including
+            the first batch.  Default is ten times the first batch.  Small
+            fractions have large relative errors, and may use up the budget
+            before they reach target_err.
+        checkpoint : string, optional
+            Name of a file in which to save the progress of ray firing: the
+            accumulated sums, the seed and the chunks done.  The file is not
+            removed when generation is done.
+        checkpoint_interval : float, optional
+            Seconds between saves of the checkpoint file, default 600.
+        resume : boolean, optional
+            If the checkpoint file exists, continue the run saved in it,
+            which must have the same mesh, materials, N, sampling,
+            target_err and max_rays, rather than start anew.  The resumed run fires the same rays as an
+            uninterrupted one, and gives the same results.
+        homogeneous : boolean, optional
+            First find the voxels inside a single volume with
+            find_homogeneous(), which get exact fractions and no error, and
+            fire rays only in the rows crossing other voxels.
+
+        Returns
+        -------
+        errs : numpy array
+            The statistical errors of the material fractions, a view of
+            self.grid['errs'] of shape (nx, ny, nz, number of materials), or
+            self.sparse.errs for a sparse grid.  The largest error is also
+            stored as self.max_err.
         """
-        count = 1
-        if use_grid:
-            rays = _linspace_square(N)
+        if sampling is True or sampling is False:
+            sampling = 'grid' if sampling else 'random'
+        if sampling not in RAY_SAMPLING:
+            raise mmGridError('Unknown ray sampling method: ' + str(sampling))
+        if target_err is not None and sampling == 'grid':
+            raise mmGridError('Adaptive sampling cannot use a grid of rays')
+
+        sparse = self.grid is None
+        # number of rays fired in each square of the ray frame of each dim
+        ray_counts = []
+        for dim in 'xyz':
+            plane = 'xyz'.replace(dim,'')
+            ray_counts.append( np.zeros([len(self.scdmesh.get_division_array(
+                                          x)) - 1 for x in plane], dtype=int) )
+        pieces = []
+        if max_rays is None:
+            max_rays = 10 * N**2 * sum(counts.size for counts in ray_counts)
+
+        state = None
+        if resume and checkpoint and os.path.exists(checkpoint):
+            state = self._load_checkpoint(checkpoint, N, sampling, seed,
+                                          target_err, max_rays)
+        if state:
+            seed = state['seed']
+            batch = state['batch']
+            args = state['args']
+            done = state['done']
+            ray_counts = state['ray_counts']
+            pieces = state['pieces']
+            if state.get('homogeneous', False) != homogeneous:
+                raise mmGridError('Checkpoint file {0} does not match this '
+                                  'mmgrid run'.format(checkpoint))
+            _msg("Resuming from {0}: {1} of {2} chunks of batch {3} "
+                 "done".format(checkpoint, done, len(args), batch))
         else:
-            rays = _random_square(N**2)
-
-        total_ray_count = sum([self._rayframe_count(dim) for dim in 'xyz']) * (N**2)
+            if seed is None:
+                seed = random.randint(0, sys.maxint)
+            batch = 0
+            done = 0
+            args = [(chunk, N, sampling, seed, sparse)
+                    for chunk in self._ray_chunks()]
+            for counts in ray_counts:
+                counts += N**2
+
+        hom = None
+        if homogeneous:
+            hom = self.find_homogeneous()
+            _msg("Homogeneous voxels: {0} of {1}".format(
+                    np.count_nonzero(hom >= 0), hom.size))
+        if hom is not None and not state:
+            # fire only the rows crossing heterogeneous voxels
+            args = []
+            for idx, counts in enumerate(ray_counts):
+                rows = (hom < 0).any(axis=idx)
+                counts[~rows] = 0
+                for a in xrange(rows.shape[0]):
+                    squares = [int(b) for b in np.flatnonzero(rows[a])]
+                    if squares:
+                        args.append( ((idx, a), N, sampling, seed, sparse,
+                                      squares, batch) )
+
+        last_save = [time.time()]
+        def save(done):
+            if checkpoint and time.time() - last_save[0] >= checkpoint_interval:
+                self._save_checkpoint(checkpoint, dict(seed=seed, N=N,
+                    sampling=sampling, target_err=target_err,
+                    max_rays=max_rays, batch=batch, args=args, done=done,
+                    ray_counts=ray_counts, pieces=pieces,
+                    homogeneous=homogeneous))
+                last_save[0] = time.time()
+
+        pool = None
+        if workers > 1:
+            sm = self.scdmesh
+            divisions = [sm.get_division_array(dim) for dim in 'xyz']
+            pool = multiprocessing.Pool(workers, _init_worker,
+                    (self.geometry, divisions, tuple(sm.dims[0:3])))
+
+        while True:
+            self._fire_batch(args, done, pool, pieces, save)
+            if target_err is None:
+                break
+            rows = self._adaptive_rows(ray_counts, pieces, target_err,
+                    (max_rays - sum(c.sum() for c in ray_counts)) // N**2)
+            if not rows:
+                break
+            batch += 1
+            done = 0
+            _msg("Adaptive batch {0}: {1} rows".format(batch, len(rows)))
+            squares = {}
+            for idx, a, b in rows:
+                squares.setdefault( (idx, a), [] ).append(b)
+                ray_counts[idx][a,b] += N**2
+            args = [(chunk, N, sampling, seed, sparse, sorted(squares[chunk]),
+                     batch) for chunk in sorted(squares)]
+
+        if pool:
+            pool.close()
+            pool.join()
+
+        counts = self._voxel_counts(ray_counts)
+        if sparse:
+            self.sparse = self._sum_sparse(pieces)
+            mats = self.sparse.mats
+            errs = self.sparse.errs
+            counts = counts.ravel()[self.sparse.voxels]
+        else:
+            # Field views of the structured grid, normalized in place
+            mats = self.grid['mats']
+            errs = self.grid['errs']
+            counts = counts[...,np.newaxis]
 
-        # iterate over ray-firing directions
-        for idx, dim in enumerate('xyz'):
-            uvw = np.array([0,0,0],dtype=np.float64)
+        _msg("Normalizing...")
+        self._normalize(mats, errs, counts)
+        if hom is not None:
+            errs = self._set_homogeneous(hom)
+        self.max_err = errs.max() if errs.size else 0.0
+        _msg("Maximum error: {0}".format(self.max_err))
+        return errs
+
+    def find_homogeneous(self, probes=2, min_block=1):
+        """Find the voxels that lie inside a single DagMC volume
+
+        Blocks of voxels are tested from the whole mesh down: a block is
+        homogeneous if probe rays along it, in each dimension, start and
+        stay in one volume, and the bounding box of no other volume
+        overlaps the block without enclosing it.  Other blocks are halved
+        along each axis, like an octree, until they are no longer than
+        min_block voxels.
+
+        The probe rays start on a probes x probes grid, including the
+        corners, of each face of the block, slightly inset, so that they
+        run along the edges of the block.  Volumes smaller than a block,
+        such as a pipe or a source cell inside it, are found by their
+        bounding boxes even if the probes miss them.  Volumes whose
+        bounding box encloses the whole block, such as the implicit
+        complement, are only found by the probe rays; use more probes for
+        geometries with small cavities in large volumes.
+
+        Returns
+        -------
+        hom : numpy array
+            Integer array of shape (nx, ny, nz) of the material index of
+            each homogeneous voxel, and -1 for other voxels.
+        """
+        sm = self.scdmesh
+        divs = [sm.get_division_array(dim) for dim in 'xyz']
+        hom = np.empty(self.shape, dtype=int)
+        hom.fill(-1)
+        vols = np.array(self.geometry.get_volume_list())
+        bounds = np.array([self.geometry.volume_boundary(vol)
+                           for vol in vols], dtype=np.float64)
+
+        blocks = [(0, 0, 0) + self.shape]
+        while blocks:
+            box = blocks.pop()
+            vol = self._probe_block(divs, box, probes, vols, bounds)
+            if vol is not None:
+                hom[box[0]:box[3], box[1]:box[4], box[2]:box[5]] = \
+                        self.vol_mats[vol]
+                continue
+            if max(box[x+3] - box[x] for x in range(3)) <= min_block:
+                continue
+            halves = []
+            for x in range(3):
+                mid = (box[x] + box[x+3]) // 2
+                if box[x+3] - box[x] > min_block and mid > box[x]:
+                    halves.append( [(box[x], mid), (mid, box[x+3])] )
+                else:
+                    halves.append( [(box[x], box[x+3])] )
+            for (i0, i1), (j0, j1), (k0, k1) in itertools.product(*halves):
+                blocks.append( (i0, j0, k0, i1, j1, k1) )
+        return hom
+
+    def _probe_block(self, divs, box, probes, vols, bounds):
+        """Return the volume holding the block of voxels box, given by its
+        (imin, jmin, kmin, imax, jmax, kmax) indices into divs, if all the
+        probe rays of find_homogeneous() find it and no smaller volume may
+        lie within it, or else None.  bounds is the array of shape
+        (len(vols), 2, 3) of the bounding boxes of the volumes vols.
+        """
+        lo = np.array([divs[x][box[x]] for x in range(3)], dtype=np.float64)
+        hi = np.array([divs[x][box[x+3]] for x in range(3)], dtype=np.float64)
+        # keep probes off surfaces lying on the faces of the block
+        inset = 1e-6 * (hi - lo)
+        lo += inset
+        hi -= inset
+
+        vol = self.geometry.find_volumes(lo[np.newaxis])[0]
+        if self.vol_mats[vol] < 0:
+            return None
+        overlaps = ((bounds[:,0] < hi) & (bounds[:,1] > lo)).all(axis=1)
+        encloses = ((bounds[:,0] <= lo) & (bounds[:,1] >= hi)).all(axis=1)
+        if (overlaps & ~encloses & (vols != vol)).any():
+            return None
+        for idx in range(3):
+            plane = [x for x in range(3) if x != idx]
+            uvw = np.zeros(3, dtype=np.float64)
             uvw[idx] = 1.0
-            divs = self.scdmesh.getDivisions(dim)
-            samples = np.zeros((len(divs)-1,(len(self.materials))), dtype=np.float64)
-
-
-            def make_xyz(a,b):
-                    xyz = [a,b]
-                    xyz.insert(idx,divs[0])
-                    return xyz
-
-            # iterate over all the scdmesh squares on the plane normal to uvw
-            for ijk, square in self._rayframe(dim):
-                _msg('\rFiring rays: {0}%'.format((100*count)/total_ray_count), False)
-                # For each ray that starts in this square, take a sample
-                for xyz in (make_xyz(a,b) for a,b in rays(*square)):
-                    self._alloc_one_ray( ijk, idx, xyz, uvw, divs, samples )
-                    count += 1
-                    samples[:,:] = 0
+            positions = [np.linspace(lo[x], hi[x], probes) for x in plane]
+            origins = np.empty((probes**2, 3), dtype=np.float64)
+            origins[:,idx] = lo[idx]
+            origins[:,plane] = list(itertools.product(*positions))
+            length = hi[idx] - lo[idx]
+            segs = self.geometry.trace_rays(origins, uvw, length)
+            # each probe must be a single segment in vol, past the block
+            if len(segs.rays) != len(origins) or (segs.vols != vol).any() \
+                    or (segs.ends < length).any():
+                return None
+        return vol
+
+    def _set_homogeneous(self, hom):
+        """Give the homogeneous voxels of hom, as returned by
+        find_homogeneous(), their exact fractions and zero errors.
+        Returns the array of errors of the grid.
+        """
+        if self.grid is None:
+            sp = self.sparse
+            flat = hom.ravel()
+            kept = SparseFractions(*[field[flat[sp.voxels] < 0]
+                                     for field in sp])
+            voxels = np.flatnonzero(flat >= 0)
+            exact = SparseFractions(voxels, flat[voxels],
+                                    np.ones(len(voxels)),
+                                    np.zeros(len(voxels)))
+            self.sparse = self._sum_sparse([kept, exact])
+            return self.sparse.errs
+        mask = hom >= 0
+        self.grid['mats'][mask] = 0.0
+        self.grid['errs'][mask] = 0.0
+        self.grid['mats'][np.nonzero(mask) + (hom[mask],)] = 1.0
+        return self.grid['errs']
+
+    def _fire_batch(self, args, done, pool, pieces, save):
+        """Fire the chunks with the given _fire_chunk arguments, skipping
+        the first done ones, in pool if given, and add the results to
+        self.grid or the pieces list.  save(n) is called after each chunk,
+        with n the number of chunks done.
+        """
+        if pool:
+            results = pool.imap(_fire_chunk_worker, args[done:])
+        else:
+            results = itertools.starmap(self._fire_chunk, args[done:])
+
+        # Chunk results are added in a fixed order, so that the sums do not
+        # depend on the number of workers
+        for count, (arg, result) in \
+                enumerate(itertools.izip(args[done:], results), done):
+            _msg('\rFiring rays: {0}%'.format((100*count)/len(args)), False)
+            if self.grid is None:
+                pieces.append(result)
+            else:
+                squares = arg[5] if len(arg) > 5 else None
+                self._add_chunk(arg[0], result[0], result[1], squares)
+            save(count + 1)
         _msg('\rFiring rays: 100%')
 
-        total_scores_per_vox = N*N*3
-        max_err = 0
-        _msg("Normalizing...")
-        for vox in self.grid.flat:
-            # Note: vox['mats'] = ... does not work as expected, but
-            #       vox['mats'] /= ... does the right thing.
-            # To get the correct assignment behavior, use an extra [:], as below
-            vox['mats'] /= total_scores_per_vox
-            errs = vox['errs'] / total_scores_per_vox
-            sigma = np.sqrt( (errs - (vox['mats']**2)) / total_scores_per_vox )
-            vox['errs'][:] = sigma
-            max_err = max(max_err, max(vox['errs']))
-        _msg("Maximum error: {0}".format(max_err))
+    def _save_checkpoint(self, filename, state):
+        """Save the state of generate() to a checkpoint file
 
+        state is a dictionary of the seed, N, sampling method, adaptive
+        sampling settings, the chunk arguments of the current batch and the
+        number done, the ray counts and the sparse pieces.  The dense grid
+        sums are appended to the file.  The file is replaced atomically, so
+        that an interruption leaves the previous checkpoint intact.
+        """
+        state = dict(state, shape=self.shape, sparse=self.grid is None,
+                     num_mats=len(self.materials))
+        tmpname = filename + '.tmp'
+        with open(tmpname, 'wb') as f:
+            cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+            if self.grid is not None:
+                np.save(f, self.grid)
+        os.rename(tmpname, filename)
+
+    def _load_checkpoint(self, filename, N, sampling, seed, target_err=None,
+                         max_rays=None):
+        """Load a checkpoint file saved by _save_checkpoint()
+
+        Restores the dense grid sums, and returns the state dictionary.
+        Raises mmGridError if the checkpoint is from a different problem.
+        """
+        with open(filename, 'rb') as f:
+            state = cPickle.load(f)
+            if (state['N'], state['sampling'], state['shape'],
+                state['sparse'], state['num_mats'], state['target_err'],
+                state['max_rays']) != \
+               (N, sampling, self.shape, self.grid is None,
+                len(self.materials), target_err, max_rays) or \
+               (seed is not None and seed != state['seed']):
+                raise mmGridError('Checkpoint file {0} does not match this '
+                                  'mmgrid run'.format(filename))
+            if self.grid is not None:
+                self.grid[...] = np.load(f)
+        return state
+
+    def _voxel_counts(self, ray_counts):
+        """Return the number of samples of each voxel: the number of rays
+        fired through it along each dimension.  Voxels without rays count
+        one sample, so that their zero sums normalize to zero.
+        """
+        counts = np.zeros(self.shape, dtype=np.float64)
+        for idx, rays in enumerate(ray_counts):
+            counts += np.expand_dims(rays, idx)
+        return np.maximum(counts, 1)
+
+    def _normalize(self, mats, errs, counts):
+        """Turn sums of samples and of their squares into means and standard
+        deviations of the means, in place.  counts is the number of samples
+        of each entry.
+        """
+        mats /= counts
+        errs /= counts
+        errs -= mats**2
+        # Round-off can leave tiny negative variances where a voxel holds a
+        # single material
+        np.maximum( errs, 0.0, errs )
+        errs /= counts
+        np.sqrt( errs, errs )
+
+    def _adaptive_rows(self, ray_counts, pieces, target_err, max_rows):
+        """Choose the ray rows to fire next in adaptive sampling
+
+        Returns a list of up to max_rows (dim index, a, b) ray rows, those
+        crossing the voxels with relative errors above target_err, largest
+        first.
+        """
+        if max_rows <= 0:
+            return []
+        counts = self._voxel_counts(ray_counts)
+        voxel_errs = np.zeros(self.shape, dtype=np.float64)
+        if self.grid is None:
+            # sum the pieces so far, which also saves memory
+            pieces[:] = [self._sum_sparse(pieces)]
+            sp = pieces[0]
+            flat_counts = counts.ravel()[sp.voxels]
+            mats, errs = sp.mats.copy(), sp.errs.copy()
+            self._normalize(mats, errs, flat_counts)
+            np.maximum.at(voxel_errs.reshape(-1), sp.voxels,
+                          _relative_errs(mats, errs))
+        else:
+            mats = self.grid['mats'].copy()
+            errs = self.grid['errs'].copy()
+            self._normalize(mats, errs, counts[...,np.newaxis])
+            voxel_errs = _relative_errs(mats, errs).max(axis=-1)
+
+        rows = []
+        for idx in range(3):
+            row_errs = voxel_errs.max(axis=idx)
+            for a, b in zip(*np.nonzero(row_errs > target_err)):
+                rows.append( (row_errs[a,b], idx, int(a), int(b)) )
+        rows.sort(reverse=True)
+        return [row[1:] for row in rows[:max_rows]]
+
+    def _sum_sparse(self, pieces):
+        """Sum the SparseFractions of all chunks into one, with one entry
+        per voxel and material
+        """
+        voxels, materials, mats, errs = \
+                [np.concatenate(x) for x in zip(*pieces)]
+        keys = voxels.astype(np.int64) * len(self.materials) + materials
+        keys, inverse = np.unique(keys, return_inverse=True)
+        return SparseFractions(keys // len(self.materials),
+                               keys % len(self.materials),
+                               np.bincount(inverse, weights=mats),
+                               np.bincount(inverse, weights=errs))
+
+    def _sparse_columns(self, field):
+        """Generator: yield (material index, array of shape (nx, ny, nz)) of
+        a field of self.sparse for each material, one material at a time
+        """
+        sp = self.sparse
+        order = np.argsort(sp.materials, kind='mergesort')
+        bounds = np.searchsorted(sp.materials[order],
+                                 np.arange(len(self.materials)+1))
+        values = getattr(sp, field)
+        column = np.zeros(np.prod(self.shape), dtype=np.float64)
+        for matnum in xrange(len(self.materials)):
+            column[:] = 0
+            entries = order[bounds[matnum]:bounds[matnum+1]]
+            column[sp.voxels[entries]] = values[entries]
+            yield matnum, column.reshape(self.shape)
 
     def create_tags(self):
-        """Tags material information to mesh"""
-        mesh = self.scdmesh.imesh
+        """Tags material information to mesh
+
+        Each material's fraction and error are written to all hexes with one
+        bulk tag access per tag.
+        """
+        sm = self.scdmesh
+        names = dict(self.materials.itervalues())
+        if self.grid is None:
+            for matnum, column in self._sparse_columns('mats'):
+                sm.set_tag_array( names[matnum], column )
+            for matnum, column in self._sparse_columns('errs'):
+                sm.set_tag_array( names[matnum]+'_err', column )
+            return
+
         for idx, ((mat, rho), (matnum,matname)) in enumerate(self.materials.iteritems()):
-            # Get tag handle
-            try: 
-                mattag = mesh.createTag( matname, 1, np.float64 )
-            except iBase.TagAlreadyExistsError:
-                mattag = mesh.getTagHandle( matname )
-            try:
-                errtag = mesh.createTag( matname+'_err', 1, np.float64 )
-            except iBase.TagAlreadyExistsError:
-                errtag = mesh.getTagHandle( matname + '_err')
+            sm.set_tag_array( matname, self.grid['mats'][...,matnum] )
+            sm.set_tag_array( matname+'_err', self.grid['errs'][...,matnum] )
 
-            # Tag each hex
-            for ijk, (mat,err) in np.ndenumerate(self.grid):
-                offset_ijk = [x+y for x,y in zip(ijk,self.scdmesh.dims[0:3])]
-                hx = self.scdmesh.getHex(*offset_ijk)
-                mattag[hx] = mat[matnum]
-                errtag[hx] = err[matnum]
 
+    def _material_names(self):
+        """Return the list of material names, by material index"""
+        names = dict(self.materials.itervalues())
+        return [names[x] for x in xrange(len(names))]
+
+    def save_results(self, filename):
+        """Save the material fractions and errors from generate() to a
+        compressed .npz file, from which load_results() can restore them
+        """
+        results = dict(names=self._material_names(), max_err=self.max_err)
+        if self.grid is None:
+            results.update(self.sparse._asdict())
+        else:
+            results.update(mats=self.grid['mats'], errs=self.grid['errs'])
+        np.savez_compressed(filename, **results)
+
+    def load_results(self, filename):
+        """Restore the results saved by save_results() instead of calling
+        generate()
+
+        The file must have been saved from a grid of the same shape,
+        materials and storage (dense or sparse) as this one.
+        """
+        data = np.load(filename)
+        if list(data['names']) != self._material_names() or \
+           ('voxels' in data.files) != (self.grid is None) or \
+           (self.grid is not None and data['mats'].shape[:3] != self.shape):
+            raise mmGridError('mmgrid results in {0} do not match this '
+                              'grid'.format(filename))
+        if self.grid is None:
+            self.sparse = SparseFractions(*[data[field] for field in
+                                            SparseFractions._fields])
+        else:
+            self.grid['mats'] = data['mats']
+            self.grid['errs'] = data['errs']
+        self.max_err = float(data['max_err'])
+
+    def load_tags(self):
+        """Restore the results of a previous run from the material tags
+        written by create_tags() onto this grid's mesh, instead of calling
+        generate()
+        """
+        sm = self.scdmesh
+        names = self._material_names()
+        try:
+            columns = [(sm.get_tag_array(name), sm.get_tag_array(name+'_err'))
+                       for name in names]
+        except iBase.TagNotFoundError:
+            raise mmGridError('Mesh is missing the tags of some of the '
+                              'materials ' + ', '.join(names))
+        if self.grid is None:
+            pieces = []
+            for matnum, (mats, errs) in enumerate(columns):
+                voxels = np.flatnonzero(mats)
+                pieces.append( SparseFractions(voxels,
+                        np.zeros(len(voxels), dtype=int) + matnum,
+                        mats.ravel()[voxels], errs.ravel()[voxels]) )
+            self.sparse = self._sum_sparse(pieces)
+            errs = self.sparse.errs
+        else:
+            for matnum, (mats, errs) in enumerate(columns):
+                self.grid['mats'][...,matnum] = mats
+                self.grid['errs'][...,matnum] = errs
+            errs = self.grid['errs']
+        self.max_err = errs.max() if errs.size else 0.0
+
+    def update(self, N, sampling='random', workers=1, seed=None, box=None,
+               volumes=None):
+        """Resample the voxels of a changed region of the geometry
+
+        Voxels overlapping the changed region get new material fractions,
+        from rays fired across those voxels only.  The fractions of all
+        other voxels are unchanged, since the geometry within them is.  The
+        grid must hold the results of the geometry before the change, e.g.
+        from load_results() or load_tags(), and the geometry after the
+        change must be loaded.  The materials must be the same.
+
+        Parameters
+        ----------
+        N, sampling, workers, seed :
+            As for generate().
+        box : sequence of 6 floats, optional
+            (xmin, ymin, zmin, xmax, ymax, zmax) of the changed region.  It
+            must include both the old and the new places of moved parts.
+        volumes : sequence of ints, optional
+            DagMC IDs of changed volumes; the changed region is then the
+            union of box and the bounding boxes of these volumes.
+
+        Returns
+        -------
+        block : tuple of 3 slices
+            The slices of self.grid (in 'xyz' order) that were updated, or
+            None if the changed region misses the mesh.
+        """
+        sm = self.scdmesh
+        boxes = []
+        if box is not None:
+            boxes.append( (box[0:3], box[3:6]) )
+        for vol in (volumes or []):
+            boxes.append( self.geometry.volume_boundary(vol) )
+        if not boxes:
+            raise mmGridError('update() needs a box or volumes')
+        lo = np.min([b[0] for b in boxes], axis=0)
+        hi = np.max([b[1] for b in boxes], axis=0)
+
+        block = []
+        for x, dim in enumerate('xyz'):
+            divs = sm.get_division_array(dim)
+            first = max(np.searchsorted(divs, lo[x], 'right') - 1, 0)
+            last = min(np.searchsorted(divs, hi[x], 'left'), len(divs) - 1)
+            if first >= last:
+                return None
+            block.append( slice(first, last) )
+        block = tuple(block)
+
+        # A grid on the block alone, sampled like a whole mesh
+        divisions = [sm.get_division_array(dim)[b.start:b.stop+1]
+                     for dim, b in zip('xyz', block)]
+        sub = mmGrid(ArrayScdMesh(*divisions), self.grid is None,
+                     self.geometry)
+        if sub._material_names() != self._material_names():
+            raise mmGridError('The changed geometry has different materials; '
+                              'regenerate the whole grid')
+        _msg("Updating voxels {0}".format(
+                ', '.join('{0}:{1}'.format(b.start, b.stop) for b in block)))
+        sub.generate(N, sampling, workers, seed)
+
+        if self.grid is None:
+            self.sparse = self._splice_sparse(block, sub)
+            errs = self.sparse.errs
+        else:
+            self.grid[block] = sub.grid
+            errs = self.grid['errs']
+        self.max_err = errs.max() if errs.size else 0.0
+        return block
+
+    def _splice_sparse(self, block, sub):
+        """Return self.sparse with the voxels of block replaced by those of
+        the sparse grid sub
+        """
+        sp = self.sparse
+        ijk = np.unravel_index(sp.voxels, self.shape)
+        outside = np.zeros(len(sp.voxels), dtype=bool)
+        for x, b in enumerate(block):
+            outside |= (ijk[x] < b.start) | (ijk[x] >= b.stop)
+        kept = SparseFractions(*[field[outside] for field in sp])
+
+        ijk = np.unravel_index(sub.sparse.voxels, sub.shape)
+        voxels = np.ravel_multi_index(
+                [ijk[x] + b.start for x, b in enumerate(block)], self.shape)
+        new = sub.sparse._replace(voxels=voxels)
+        # entries are disjoint, so summing only sorts them
+        return self._sum_sparse([kept, new])
 
     def writeFile(self, filename, alara_geom_file=None ):
         """Save mesh file, and optionally invoke creation of alara_geom file"""
+        from io.write_alara_geom import write_alara_geom
         mesh = self.scdmesh
         mesh.scdset.save(filename)
         if alara_geom_file:
-            write_alara_geom(alara_geom_file, mesh)
+            fractions = None
+            if self.grid is None:
+                # Detect mixtures from the sparse fractions, not from tags
+                fractions = (self._material_names(), self.sparse.voxels, self.sparse.materials,
+                             self.sparse.mats)
+            write_alara_geom(alara_geom_file, mesh, fractions=fractions)
+
+
+def cache_key(geom_file, scdmesh, N, sampling='random', seed=None,
+              target_err=None, max_rays=None):
+    """Return a key identifying the results of an mmgrid run
+
+    The key is a hash of the contents of the geometry file, the mesh
+    divisions and the arguments of mmGrid.generate() that change its
+    results, for use as the file name of cached results (see
+    mmGrid.save_results()).
+
+    Parameters
+    ----------
+    geom_file : string
+        Filename of the geometry loaded by load_geom().
+    scdmesh : ScdMesh object
+        The mesh of the grid.
+    N, sampling, seed, target_err, max_rays :
+        Arguments of mmGrid.generate().
+
+    Returns
+    -------
+    key : string
+        Hexadecimal SHA-1 digest.
+    """
+    sha = hashlib.sha1()
+    with open(geom_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), ''):
+            sha.update(block)
+    for dim in 'xyz':
+        divs = np.asarray(scdmesh.get_division_array(dim), dtype=np.float64)
+        sha.update(repr(divs.shape))
+        sha.update(divs.tostring())
+    if sampling is True or sampling is False:
+        sampling = 'grid' if sampling else 'random'
+    sha.update(repr((N, sampling, seed, target_err, max_rays)))
+    return sha.hexdigest()
 
 
 def load_geom(filename):
@@ -474,8 +1565,36 @@ def load_geom(filename):
     ----------
     filename : string
         Filename with geometry information. Typically a .sat file.
+
+    Returns
+    -------
+    geometry : DagmcGeometry object
+        The geometry, also used by grids created without one.
     """
-    dagmc.load( filename )
+    global _geometry
+    _geometry = DagmcGeometry( filename )
+    return _geometry
+
+
+def _init_worker(geometry, divisions, ijk_min):
+    """Initialize a worker process of mmGrid.generate()
+
+    Loads the geometry once, unless the process inherited it from its parent
+    (always the case for forked workers), and creates an mmGrid on an
+    ArrayScdMesh with the given divisions, so that the worker needs no iMesh
+    instance.
+    """
+    global _worker_grid, _quiet
+    _quiet = True
+    geometry.load()
+    # The worker grid only fires chunks, so it needs no dense storage
+    _worker_grid = mmGrid(ArrayScdMesh(*divisions, ijk_min=ijk_min),
+                          sparse=True, geometry=geometry)
+
+
+def _fire_chunk_worker(args):
+    """Fire the rays of one chunk in a worker process"""
+    return _worker_grid._fire_chunk(*args)
 
 
 def main( arguments=None ):
@@ -493,7 +1612,11 @@ def main( arguments=None ):
     op.add_option( '-n',  help='Set N. N^2 rays fired per row.  Default N=%default',
                    dest='numrays', default=20, type=int )
     op.add_option( '-g', '--grid', help='Use grid of rays instead of randomly selected starting points',
-                    dest='usegrid', default=False, action='store_true' )
+                    dest='sampling', action='store_const', const='grid' )
+    op.add_option( '-r', '--sampling', help='Ray starting point sampling method: '
+                   + ', '.join(sorted(RAY_SAMPLING)) + '.  Default random',
+                   dest='sampling', default='random', type='choice',
+                   choices=sorted(RAY_SAMPLING) )
     op.add_option( '-o', '--output', help='Output file name, default=%default',
                    dest='output_filename', default='mmgrid_output.h5m' )
     op.add_option( '-q', '--quiet', help='Suppress non-error output from mmgrid',
@@ -502,9 +1625,37 @@ def main( arguments=None ):
                    dest='ndivs', default=10 )
     op.add_option( '-a', '--alara', help='Write alara geom to specified file name',
                    dest='alara_geom_file', default=None, action='store')
+    op.add_option( '-w', '--workers', help='Number of processes firing rays, default=%default',
+                   dest='workers', default=1, type=int )
+    op.add_option( '-t', '--target-err', help='Adaptively fire more rays in rows with material fraction relative errors above this target',
+                   dest='target_err', default=None, type=float )
+    op.add_option( '--max-rays', help='Total ray budget of adaptive sampling, default is ten times the first batch of rays',
+                   dest='max_rays', default=None, type=int )
+    op.add_option( '--checkpoint', help='Save the progress of ray firing to this file, so that an interrupted run can be resumed',
+                   dest='checkpoint', default=None )
+    op.add_option( '--checkpoint-interval', help='Seconds between checkpoints, default=%default',
+                   dest='checkpoint_interval', default=600, type=float )
+    op.add_option( '--resume', help='Resume ray firing from the --checkpoint file of an interrupted run',
+                   dest='resume', default=False, action='store_true' )
+    op.add_option( '--update', help='Update the results tagged on structured_mesh_file, '
+                   'for a geometry changed within --box or --volumes',
+                   dest='update', default=False, action='store_true' )
+    op.add_option( '--box', help='Changed region for --update: xmin,ymin,zmin,xmax,ymax,zmax',
+                   dest='box', default=None )
+    op.add_option( '--volumes', help='Changed DagMC volume IDs for --update, comma separated',
+                   dest='volumes', default=None )
+    op.add_option( '--homogeneous', help='Find the voxels inside a single volume first, '
+                   'and fire rays only in rows crossing other voxels',
+                   dest='homogeneous', default=False, action='store_true' )
+    op.add_option( '--sparse', help='Store only nonzero material fractions, for problems with many materials',
+                   dest='sparse', default=False, action='store_true' )
+    op.add_option( '-s', '--seed', help='Random seed; results for a seed do not depend on the number of workers',
+                   dest='seed', default=None, type=int )
     opts, args = op.parse_args( arguments )
     if len(args) != 1 and len(args) != 2:
         op.error( 'Need one or two arguments' )
+    if opts.resume and not opts.checkpoint:
+        op.error( '--resume needs the --checkpoint file of the interrupted run' )
 
     _quiet = opts.quiet
 
@@ -512,13 +1663,34 @@ def main( arguments=None ):
     sm = None
     if len(args) == 2:
         sm = scdmesh.ScdMesh.fromFile(args[1])
-        grid = mmGrid( sm )
+        grid = mmGrid( sm, opts.sparse )
     else:
-        grid = mmGrid.fromDagGeom(opts.ndivs)
-
-    grid.generate(opts.numrays, opts.usegrid)
-    grid.createTags()
+        grid = mmGrid.fromDagGeom(opts.ndivs, opts.sparse)
+
+    checkpoint = opts.checkpoint
+    if opts.update:
+        if len(args) != 2:
+            op.error( '--update needs the structured mesh file of a '
+                      'previous mmgrid run' )
+        box = volumes = None
+        if opts.box:
+            box = [float(x) for x in opts.box.split(',')]
+            if len(box) != 6:
+                op.error( '--box needs 6 comma separated coordinates' )
+        if opts.volumes:
+            volumes = [int(x) for x in opts.volumes.split(',')]
+        grid.load_tags()
+        grid.update(opts.numrays, opts.sampling, opts.workers, opts.seed,
+                    box, volumes)
+    else:
+        grid.generate(opts.numrays, opts.sampling, opts.workers, opts.seed,
+                      opts.target_err, opts.max_rays, checkpoint,
+                      opts.checkpoint_interval, opts.resume, opts.homogeneous)
+    grid.create_tags()
     grid.writeFile( opts.output_filename, opts.alara_geom_file )
+    # The results are saved, so the checkpoint is no longer needed
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
 
 
 if __name__ == '__main__':
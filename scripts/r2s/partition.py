@@ -0,0 +1,180 @@
+"""Split a structured mesh into blocks for independent processing.
+
+partition() divides a ScdMesh (or an ArrayScdMesh or ScdMeshView) into K
+box-shaped blocks by recursive bisection, balancing either the number of
+voxels per block or a per-voxel cost, such as material heterogeneity or
+source strength.  Each block is described by a MeshBlock: its (i,j,k)
+extents and divisions, which pickle cheaply for sending to worker processes.
+
+Results computed for each block, as arrays in 'xyz' order, are put back
+together with merge_arrays(), or written to a tag on the parent mesh with
+merge_tag().
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from r2s.scdgrid import ScdMeshError
+
+
+class MeshBlock(namedtuple('MeshBlock', ('index', 'dims', 'divisions'))):
+    """Description of one block of a partitioned structured mesh
+
+    Fields::
+
+        index -- number of the block, from 0 to K-1
+        dims -- extents (imin, jmin, kmin, imax, jmax, kmax) of the block,
+                in the (i,j,k) numbering of the parent mesh.  A plain tuple,
+                since ScdMesh.extents_tuple instances cannot be pickled.
+        divisions -- tuple of the x, y and z divisions of the block
+    """
+    __slots__ = ()
+
+    @property
+    def shape(self):
+        """Number of hexes of the block along x, y and z"""
+        return tuple(self.dims[x + 3] - self.dims[x] for x in range(3))
+
+    def view(self, sm):
+        """Return the view of the block on the parent mesh sm"""
+        return sm.view(*[(self.dims[x], self.dims[x + 3]) for x in range(3)])
+
+    def slices(self, parent_dims):
+        """Return the slices that select this block from an 'xyz' array
+        of the whole parent mesh, whose extents are parent_dims
+        """
+        return tuple(slice(self.dims[x] - parent_dims[x],
+                           self.dims[x + 3] - parent_dims[x])
+                     for x in range(3))
+
+
+def partition(sm, num_blocks, cost=None):
+    """Split a structured mesh into balanced blocks
+
+    The mesh is cut recursively by planes of constant i, j or k, along its
+    longest axis (in number of hexes), so that the parts of each cut have
+    costs in proportion to the number of blocks they are further split into.
+
+    Parameters
+    ----------
+    sm : ScdMesh, ScdMeshView or ArrayScdMesh object
+        Mesh to split.
+    num_blocks : int
+        Number of blocks K.
+    cost : string or array_like (optional)
+        Per-voxel cost to balance: the name of a hex tag on sm, or an array
+        of shape (nx, ny, nz) in 'xyz' order.  Costs must be non-negative.
+        By default every voxel has the same cost, balancing voxel counts.
+
+    Returns
+    -------
+    blocks : list of MeshBlock objects
+        The K blocks, which together cover the mesh without overlap.
+    """
+    shape = tuple(sm.dims[x + 3] - sm.dims[x] for x in range(3))
+    if num_blocks < 1 or num_blocks > np.prod(shape):
+        raise ScdMeshError('Cannot split a mesh of {0} voxels into {1} '
+                           'blocks'.format(np.prod(shape), num_blocks))
+
+    if cost is None:
+        cost = np.ones(shape, dtype=np.float64)
+    elif isinstance(cost, basestring):
+        cost = sm.get_tag_array(cost)
+    else:
+        cost = np.asarray(cost, dtype=np.float64)
+    if cost.shape != shape:
+        raise ScdMeshError('Cost array of shape {0} does not match mesh '
+                           'shape {1}'.format(cost.shape, shape))
+    if (cost < 0).any():
+        raise ScdMeshError('Voxel costs must be non-negative')
+
+    boxes = []
+    _bisect(cost, [0, 0, 0] + list(shape), num_blocks, boxes)
+
+    divs = [sm.get_division_array(dim) for dim in 'xyz']
+    blocks = []
+    for idx, box in enumerate(boxes):
+        dims = tuple(box[x] + sm.dims[x % 3] for x in range(6))
+        divisions = tuple(np.array(divs[x][box[x]:box[x + 3] + 1])
+                          for x in range(3))
+        blocks.append(MeshBlock(idx, dims, divisions))
+    return blocks
+
+
+def _bisect(cost, box, num_blocks, boxes):
+    """Recursively split box (zero-based extents into cost) into num_blocks
+    boxes, appending them to the boxes list
+    """
+    if num_blocks == 1:
+        boxes.append(box)
+        return
+
+    lengths = [box[x + 3] - box[x] for x in range(3)]
+    axis = int(np.argmax(lengths))
+    nleft = num_blocks // 2
+
+    # cost of each plane of voxels along axis, and where to cut them
+    sub = cost[box[0]:box[3], box[1]:box[4], box[2]:box[5]]
+    planes = sub.sum(axis=tuple(x for x in range(3) if x != axis))
+    cumulative = np.cumsum(planes)
+    if cumulative[-1] > 0:
+        target = cumulative[-1] * nleft / float(num_blocks)
+        cut = int(np.argmin(np.abs(cumulative - target))) + 1
+    else:
+        cut = int(round(lengths[axis] * nleft / float(num_blocks)))
+
+    # each side needs at least as many voxels as blocks; the cut can always
+    # be kept, and the number of blocks on each side adjusted instead
+    cut = min(max(cut, 1), lengths[axis] - 1)
+    area = np.prod(lengths) // lengths[axis]
+    nleft = min(max(nleft, num_blocks - area * (lengths[axis] - cut)),
+                area * cut)
+
+    left, right = list(box), list(box)
+    left[axis + 3] = right[axis] = box[axis] + cut
+    _bisect(cost, left, nleft, boxes)
+    _bisect(cost, right, num_blocks - nleft, boxes)
+
+
+def merge_arrays(dims, blocks, arrays):
+    """Assemble per-block arrays into an array of the whole mesh
+
+    Parameters
+    ----------
+    dims : ScdMesh.extents_tuple
+        Extents of the partitioned mesh.
+    blocks : list of MeshBlock objects
+        Blocks returned by partition().
+    arrays : list of array_like
+        For each block, an array of shape block.shape in 'xyz' order,
+        optionally with an extra trailing group axis.
+
+    Returns
+    -------
+    merged : ndarray
+        Array of shape (nx, ny, nz[, G]) in 'xyz' order.  Voxels not covered
+        by any of the blocks are zero.
+    """
+    shape = tuple(dims[x + 3] - dims[x] for x in range(3))
+    merged = None
+    for block, arr in zip(blocks, arrays):
+        arr = np.asarray(arr)
+        if arr.shape[:3] != block.shape:
+            raise ScdMeshError('Array of shape {0} does not match block {1} '
+                               'of shape {2}'.format(arr.shape, block.index,
+                                                     block.shape))
+        if merged is None:
+            merged = np.zeros(shape + arr.shape[3:], dtype=arr.dtype)
+        merged[block.slices(dims)] = arr
+    return merged
+
+
+def merge_tag(sm, blocks, arrays, name, dtype=np.float64):
+    """Assemble per-block arrays and write them to a tag on the whole mesh
+
+    See merge_arrays() for the blocks and arrays arguments.  Arrays with a
+    trailing group axis are written to a vector tag.
+    """
+    sm.set_tag_array(name, merge_arrays(sm.dims, blocks, arrays),
+                     dtype=dtype)
@@ -0,0 +1,248 @@
+"""Remap tags of a structured mesh onto a coarser or finer structured mesh.
+
+All remapped tags are treated as volume averages: fluxes, photon source
+densities and material volume fractions.  The value on a new voxel is the
+average of the old voxels weighted by their overlap volumes, so that
+value * volume integrated over the mesh is conserved.  Error tags are
+combined in quadrature with the same weights, treating the old voxels as
+independent.
+
+Error tags are recognized by name:
+
+* 'X_error', 'n_flux_err' and 'p_flux_err' are relative errors of 'X',
+  'n_flux' and 'p_flux', as written by read_meshtal.py.
+* Any other 'X_err' is the absolute standard deviation of 'X', as written by
+  mmgrid.py for material fractions.
+
+remap() works on ScdMesh and ArrayScdMesh objects; coarsen() and refine()
+build the new divisions from integer factors.
+"""
+
+import numpy as np
+
+from r2s.scdgrid import ScdMeshError
+from r2s.arrayscdmesh import ArrayScdMesh
+
+
+# Error tags, other than those ending in '_error', holding relative errors
+RELATIVE_ERROR_TAGS = {'n_flux_err': 'n_flux', 'p_flux_err': 'p_flux'}
+
+
+def overlap_weights(old_divs, new_divs):
+    """Return the 1D remapping weights between two sets of divisions
+
+    Parameters
+    ----------
+    old_divs, new_divs : array_like
+        Increasing divisions of the old and new meshes along one axis.  The
+        new divisions must lie within the range of the old ones.
+
+    Returns
+    -------
+    weights : 2D ndarray
+        Array of shape (len(new_divs)-1, len(old_divs)-1), whose [n, o]
+        entry is the fraction of new interval n that overlaps old interval
+        o.  Each row sums to one.
+    """
+    old = np.asarray(old_divs, dtype=np.float64)
+    new = np.asarray(new_divs, dtype=np.float64)
+    if (np.diff(old) <= 0).any() or (np.diff(new) <= 0).any():
+        raise ScdMeshError('Mesh divisions must be strictly increasing')
+    tol = 1e-9 * (old[-1] - old[0])
+    if new[0] < old[0] - tol or new[-1] > old[-1] + tol:
+        raise ScdMeshError('New divisions [{0}, {1}] exceed the old mesh '
+                           '[{2}, {3}]'.format(new[0], new[-1], old[0],
+                                               old[-1]))
+    lo = np.maximum(new[:-1, np.newaxis], old[np.newaxis, :-1])
+    hi = np.minimum(new[1:, np.newaxis], old[np.newaxis, 1:])
+    overlap = np.maximum(hi - lo, 0)
+    return overlap / np.diff(new)[:, np.newaxis]
+
+
+def _apply(weights, values):
+    """Apply the 1D weights of each axis to an 'xyz' array
+
+    values may have extra trailing axes, e.g. energy groups.
+    """
+    for axis, w in enumerate(weights):
+        values = np.rollaxis(np.tensordot(w, values, axes=([1], [axis])),
+                             0, axis + 1)
+    return values
+
+
+def remap_values(old_divs, new_divs, values):
+    """Volume-average an 'xyz' array of values onto new divisions
+
+    Parameters
+    ----------
+    old_divs, new_divs : sequence of 3 array_like
+        The x, y and z divisions of the old and new meshes.
+    values : array_like
+        Array of shape (nx, ny, nz[, ...]) on the old mesh.
+
+    Returns
+    -------
+    new_values : ndarray
+        Array of shape (nx', ny', nz'[, ...]) on the new mesh.
+    """
+    weights = [overlap_weights(o, n) for o, n in zip(old_divs, new_divs)]
+    return _apply(weights, np.asarray(values, dtype=np.float64))
+
+
+def remap_errors(old_divs, new_divs, values, errors, relative=True):
+    """Combine the errors of an 'xyz' array of values onto new divisions
+
+    Parameters
+    ----------
+    old_divs, new_divs : sequence of 3 array_like
+        The x, y and z divisions of the old and new meshes.
+    values : array_like
+        Array of shape (nx, ny, nz[, ...]) of values on the old mesh.
+    errors : array_like
+        Errors of values, of the same shape.
+    relative : boolean, optional
+        Whether errors are relative (default) or absolute standard
+        deviations.  Returned errors are of the same kind.
+
+    Returns
+    -------
+    new_errors : ndarray
+        Errors of remap_values(old_divs, new_divs, values).  Relative errors
+        of zero values are zero.
+    """
+    weights = [overlap_weights(o, n) for o, n in zip(old_divs, new_divs)]
+    values = np.asarray(values, dtype=np.float64)
+    sigma = np.asarray(errors, dtype=np.float64)
+    if relative:
+        sigma = sigma * values
+    new_sigma = np.sqrt(_apply([w ** 2 for w in weights], sigma ** 2))
+    if not relative:
+        return new_sigma
+    new_values = _apply(weights, values)
+    new_errors = np.zeros_like(new_sigma)
+    nonzero = new_values != 0
+    new_errors[nonzero] = np.abs(new_sigma[nonzero] / new_values[nonzero])
+    return new_errors
+
+
+def error_tag_base(name):
+    """Return (value tag name, relative) for an error tag name, or None"""
+    if name in RELATIVE_ERROR_TAGS:
+        return RELATIVE_ERROR_TAGS[name], True
+    if name.endswith('_error'):
+        return name[:-len('_error')], True
+    if name.endswith('_err'):
+        return name[:-len('_err')], False
+    return None
+
+
+def remap(sm, x_points, y_points, z_points, tagnames=None, imesh=None):
+    """Create a new structured mesh and remap the tags of sm onto it
+
+    Parameters
+    ----------
+    sm : ScdMesh or ArrayScdMesh object
+        Mesh to remap.
+    x_points, y_points, z_points : list of floats
+        Divisions of the new mesh, within the extents of sm.
+    tagnames : list of strings, optional
+        Names of the tags to remap.  By default all double-valued hex tags
+        are remapped.  An error tag needs its value tag in the list too.
+    imesh : iMesh.Mesh object, optional
+        iMesh instance for the new mesh if sm is a ScdMesh.
+
+    Returns
+    -------
+    new_sm : ScdMesh or ArrayScdMesh object
+        The new mesh, of the same class as sm.
+    """
+    if isinstance(sm, ArrayScdMesh):
+        am = sm
+        if tagnames is None:
+            tagnames = [name for name, values in sm.tags.iteritems()
+                        if values.dtype == np.float64]
+    else:
+        if tagnames is None:
+            tagnames = [tag.name for tag in sm.imesh.getAllTags(
+                        sm.getHex(*sm.dims[0:3])) if tag.type == 'd']
+        am = ArrayScdMesh.fromScdMesh(sm, tagnames)
+
+    old_divs = [am.get_division_array(dim) for dim in 'xyz']
+    new_divs = [x_points, y_points, z_points]
+    new_am = ArrayScdMesh(x_points, y_points, z_points)
+
+    for name in tagnames:
+        values = am.get_tag_array(name)
+        base = error_tag_base(name)
+        if base is None:
+            new_am.set_tag_array(name, remap_values(old_divs, new_divs,
+                                                    values))
+            continue
+        basename, relative = base
+        if basename not in tagnames:
+            raise ScdMeshError('Cannot remap error tag {0} without its value '
+                               'tag {1}'.format(name, basename))
+        new_am.set_tag_array(name, remap_errors(old_divs, new_divs,
+                am.get_tag_array(basename), values, relative))
+
+    if isinstance(sm, ArrayScdMesh):
+        return new_am
+    return new_am.toScdMesh(imesh)
+
+
+def coarsen(sm, factors, tagnames=None, imesh=None):
+    """Remap sm onto a mesh with every factor divisions merged
+
+    Parameters
+    ----------
+    sm : ScdMesh or ArrayScdMesh object
+        Mesh to coarsen.
+    factors : int or sequence of 3 ints
+        Number of voxels along x, y and z merged into one.  If the number of
+        voxels along an axis is not a multiple of its factor, the last
+        coarse voxel is smaller.
+
+    See remap() for the other arguments.
+    """
+    factors = _factors(factors)
+    divs = []
+    for dim, f in zip('xyz', factors):
+        old = sm.get_division_array(dim)
+        new = list(old[::f])
+        if (len(old) - 1) % f:
+            new.append(old[-1])
+        divs.append(new)
+    return remap(sm, *divs, tagnames=tagnames, imesh=imesh)
+
+
+def refine(sm, factors, tagnames=None, imesh=None):
+    """Remap sm onto a mesh with every voxel split evenly
+
+    Parameters
+    ----------
+    sm : ScdMesh or ArrayScdMesh object
+        Mesh to refine.
+    factors : int or sequence of 3 ints
+        Number of parts each voxel is split into along x, y and z.
+
+    See remap() for the other arguments.
+    """
+    factors = _factors(factors)
+    divs = []
+    for dim, f in zip('xyz', factors):
+        old = sm.get_division_array(dim)
+        steps = np.arange(f, dtype=np.float64) / f
+        new = (old[:-1, np.newaxis] +
+               np.diff(old)[:, np.newaxis] * steps).ravel()
+        divs.append(np.append(new, old[-1]))
+    return remap(sm, *divs, tagnames=tagnames, imesh=imesh)
+
+
+def _factors(factors):
+    """Return a list of 3 positive ints from an int or sequence of ints"""
+    if isinstance(factors, (int, long)):
+        factors = [factors] * 3
+    factors = [int(f) for f in factors]
+    if len(factors) != 3 or min(factors) < 1:
+        raise ScdMeshError('Invalid remapping factors: ' + str(factors))
+    return factors
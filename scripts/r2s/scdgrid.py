@@ -0,0 +1,280 @@
+"""Parts of the structured mesh interface that need no iMesh instance
+
+The methods of ScdGridMixin and the functions of this module only use the
+dims of a mesh and the arrays of its divisions, so they are shared by
+ScdMesh and ArrayScdMesh without importing itaps.
+"""
+
+from collections import namedtuple, Iterable
+
+import numpy as np
+
+
+class ScdMeshError(Exception):
+    pass
+
+
+class ScdGridMixin:
+    """Methods of a structured mesh that only depend on self.dims and
+    self.get_division_array()
+    """
+
+    # A six-element tuple corresponding to the BOX_DIMS tag on the
+    # structured mesh.  See the MOAB library's metadata-info.doc file.
+    extents_tuple = namedtuple('extents',
+                               ('imin', 'jmin', 'kmin',
+                                'imax', 'jmax', 'kmax'))
+
+    def iterateHexVolumes(self, order='zyx', **kw):
+        """Get an iterator over the volumes of the mesh hexahedra
+
+        See iterateHex() for an explanation of the order argument and the
+        available keyword arguments.
+        """
+
+        indices, ordmap = _scdIterSetup(self.dims, order, **kw)
+        # Volumes are products of the mesh widths along each axis; the
+        # ordmap returned from _scdIterSetup maps each column of indices to
+        # kji/zyx ordering.
+        widths = [None, None, None]
+        for col, axis in enumerate(ordmap):
+            idx = 2 - axis
+            L = 'xyz'[idx]
+            sel = np.asarray(indices[col], dtype=np.intp) - self.dims[idx]
+            widths[idx] = np.diff(self.get_division_array(L))[sel]
+        vols = _outerVolumes(widths, [2 - axis for axis in ordmap])
+        return iter(vols.ravel())
+
+    def hex_volumes(self, order='xyz'):
+        """Return the volumes of all mesh hexahedra as an ndarray
+
+        Volumes are computed analytically as the outer product of the mesh
+        widths along x, y and z, without querying any vertex coordinates
+        beyond the mesh divisions.
+
+        Parameters
+        ----------
+        order : string, optional
+            A permutation of 'xyz' giving the axes of the returned array, as
+            for get_tag_array().  The default 'xyz' returns an array indexed
+            as [i,j,k]; vols.ravel() then lists volumes in the same order as
+            iterateHex('xyz').
+
+        Returns
+        -------
+        vols : ndarray
+            Array of shape (nx, ny, nz), permuted according to order.
+        """
+        _orderAxes(order)
+        widths = [np.diff(self.get_division_array(L)) for L in 'xyz']
+        return _outerVolumes(widths, ['xyz'.find(L) for L in order])
+
+    def getDivisions(self, dim):
+        """Get the mesh divisions on a given dimension
+
+        Given a dimension 'x', 'y', or 'z', return a list of the mesh vertices
+        along that dimension
+        """
+        return list(self.get_division_array(dim))
+
+    def locate(self, points):
+        """Find the hexahedra containing a set of points
+
+        Points are binned along each axis with a binary search of the mesh
+        divisions.  A point on a face between two hexes is located in the
+        hex with the larger index, except on the upper boundary of the mesh,
+        which belongs to the last hex.
+
+        Parameters
+        ----------
+        points : array_like
+            Array of shape (N,3) of x, y, z coordinates.
+
+        Returns
+        -------
+        ijk : ndarray of ints
+            Array of shape (N,3) with the (i,j,k) coordinates of the hex
+            containing each point, as accepted by getHex().
+        flat : ndarray of ints
+            Array of shape (N,) with the index of each hex in canonical
+            ('zyx') order, i.e. in the order of iterateHex().
+        outside : ndarray of bools
+            Array of shape (N,) that is True for points outside of the mesh.
+            The ijk and flat entries of these points are -1.
+        """
+        divs = [self.get_division_array(dim) for dim in 'xyz']
+        return _locatePoints(divs, self.dims, points)
+
+
+def _orderAxes(order):
+    """Return the axes of a canonical (z,y,x) array for a full iteration order
+
+    The order must be a permutation of 'xyz'.
+    """
+    if not (len(order) == 3 and set(order) == set('xyz')):
+        raise ScdMeshError('Invalid array order: ' + str(order))
+    return ['zyx'.find(L) for L in order]
+
+
+def _locatePoints(divs, dims, points):
+    """Locate points in a mesh with the given x, y, z divisions and dims
+
+    See ScdMesh.locate() for the returned values.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    ijk = np.empty(points.shape, dtype=np.intp)
+    outside = np.zeros(len(points), dtype=bool)
+    for idx in range(3):
+        p = points[:, idx]
+        n = np.searchsorted(divs[idx], p, side='right') - 1
+        # points on the upper boundary belong to the last hex
+        n[p == divs[idx][-1]] = len(divs[idx]) - 2
+        outside |= (n < 0) | (n > len(divs[idx]) - 2)
+        ijk[:, idx] = n
+    nx, ny = dims[3] - dims[0], dims[4] - dims[1]
+    flat = ijk[:, 0] + nx * (ijk[:, 1] + ny * ijk[:, 2])
+    ijk += dims[0:3]
+    ijk[outside] = -1
+    flat[outside] = -1
+    return ijk, flat, outside
+
+
+def _sampleAt(flat, outside, size, fill, read):
+    """Gather tag values at located points
+
+    read(idx) must return the tag values of the hexes with the canonical
+    indices idx.  Points outside of the mesh get the value fill.
+    """
+    inside = np.logical_not(outside)
+    shape = (len(flat),) if size == 1 else (len(flat), size)
+    values = np.empty(shape, dtype=np.float64)
+    values.fill(fill)
+    if inside.any():
+        values[inside] = read(flat[inside])
+    return values
+
+
+def _outerVolumes(widths, axes):
+    """Return the outer product of the x, y and z widths, transposed to axes
+
+    The product is always formed as dx * dy * dz, so that volumes do not
+    depend on the requested axis order.
+    """
+    dx, dy, dz = [np.asarray(w, dtype=np.float64) for w in widths]
+    vols = (dx[:, np.newaxis, np.newaxis] * dy[np.newaxis, :, np.newaxis]
+            * dz[np.newaxis, np.newaxis, :])
+    return np.ascontiguousarray(vols.transpose(axes))
+
+
+def _canonicalToOrder(values, dims, order, group_axis=-1):
+    """Reshape values listed in canonical hex order into an array in order
+
+    Values may be 1D, or 2D with the components of a vector tag along the
+    second axis.
+    """
+    shape = [dims[5] - dims[2], dims[4] - dims[1], dims[3] - dims[0]]
+    axes = _orderAxes(order)
+    if values.ndim == 2:
+        shape.append(values.shape[1])
+        axes.append(3)
+    arr = values.reshape(shape).transpose(axes)
+    if values.ndim == 2:
+        arr = np.rollaxis(arr, 3, group_axis % 4)
+    return np.ascontiguousarray(arr)
+
+
+def _orderToCanonical(arr, dims, order, group_axis=-1):
+    """Inverse of _canonicalToOrder: flatten an array in order to hex order
+
+    Returns a 1D array, or a 2D array for arrays with a group axis.
+    """
+    axes = _orderAxes(order)
+    if arr.ndim == 4:
+        arr = np.rollaxis(arr, group_axis % 4, 4)
+    shape = tuple(dims[3 + idx] - dims[idx]
+                  for idx in ('xyz'.find(L) for L in order))
+    if arr.shape[:3] != shape or arr.ndim not in (3, 4):
+        raise ScdMeshError('Array of shape {0} does not match mesh shape '
+                           '{1}'.format(arr.shape, shape))
+    inverse = [axes.index(x) for x in range(3)]
+    if arr.ndim == 4:
+        inverse.append(3)
+    arr = arr.transpose(inverse)
+    return arr.reshape((-1,) + arr.shape[3:])
+
+
+def _dimConvert(dims, ijk):
+    """Helper method fo getVtx and getHex
+
+    For tuple (i,j,k), return the number N in the appropriate iterator.
+    """
+    dim0 = [0] * 3
+    for i in xrange(0, 3):
+        if (dims[i] > ijk[i] or dims[i + 3] <= ijk[i]):
+            raise ScdMeshError(str(ijk) + ' is out of bounds')
+        dim0[i] = ijk[i] - dims[i]
+    i0, j0, k0 = dim0
+    n = (((dims[4] - dims[1]) * (dims[3] - dims[0]) * k0) +
+         ((dims[3] - dims[0]) * j0) +
+         i0)
+    return n
+
+
+def _scdIterSetup(dims, order, **kw):
+    """Setup helper function for ScdMesh iterator functions
+
+    Given dims and the arguments to the iterator function, return
+    a list of three lists, each being a set of desired coordinates,
+    with fastest-changing coordinate in the last column),
+    and the ordmap used by _scdIter to reorder each coodinate to (i,j,k)
+    """
+    # a valid order has the letters 'x', 'y', and 'z'
+    # in any order without duplicates
+    if not (len(order) <= 3 and
+            len(set(order)) == len(order) and
+            all([a in 'xyz' for a in order])):
+        raise ScdMeshError('Invalid iteration order: ' + str(order))
+
+    # process kw for validity
+    spec = {}
+    for idx, d in enumerate('xyz'):
+        if d in kw:
+            spec[d] = kw[d]
+            if not isinstance(spec[d], Iterable):
+                spec[d] = [spec[d]]
+            if not all(x in range(dims[idx], dims[idx + 3])
+                    for x in spec[d]):
+                raise ScdMeshError( \
+                        'Invalid iterator kwarg: {0}={1}'.format(d, spec[d]))
+            if d not in order and len(spec[d]) > 1:
+                raise ScdMeshError('Cannot iterate over' + str(spec[d]) +
+                                   'without a proper iteration order')
+        if d not in order:
+            order = d + order
+            spec[d] = spec.get(d, [dims[idx]])
+
+    # get indices and ordmap
+    indices = []
+    for L in order:
+        idx = 'xyz'.find(L)
+        indices.append(spec.get(L, xrange(dims[idx], dims[idx + 3])))
+
+    ordmap = ['zyx'.find(L) for L in order]
+
+    return indices, ordmap
+
+
+def _scdIndices(indices, ordmap, dims):
+    """Return the canonical (zyx) handle indices selected by _scdIterSetup
+
+    The returned 1D array lists the indices in iteration order.
+    """
+    d = [0, 0, 1]
+    d[1] = (dims[3] - dims[0])
+    d[0] = (dims[4] - dims[1]) * d[1]
+    mins = [dims[2], dims[1], dims[0]]
+    offsets = [(np.asarray(indices[x], dtype=np.intp) - mins[ordmap[x]])
+               * d[ordmap[x]] for x in range(3)]
+    return (offsets[0][:, np.newaxis, np.newaxis] +
+            offsets[1][np.newaxis, :, np.newaxis] +
+            offsets[2][np.newaxis, np.newaxis, :]).ravel()
@@ -1,14 +1,12 @@
-import itertools
-from collections import namedtuple, Iterable
-
+import numpy as np
 from itaps import iBase, iMesh, iMeshExtensions
 
-
-class ScdMeshError(Exception):
-    pass
+from r2s.scdgrid import ScdMeshError, ScdGridMixin, _orderAxes, \
+        _locatePoints, _sampleAt, _canonicalToOrder, _orderToCanonical, \
+        _dimConvert, _scdIterSetup, _scdIndices
 
 
-class ScdMesh:
+class ScdMesh(ScdGridMixin):
     """A structured mesh in the spirit of MOAB's ScdMesh interface.
     
     Public member variables::
@@ -19,13 +17,6 @@ class ScdMesh:
                      (i,j,k) coordinates of this structured mesh.
     """
 
-
-    # A six-element tuple corresponding to the BOX_DIMS tag on the
-    # structured mesh.  See the MOAB library's metadata-info.doc file.
-    extents_tuple = namedtuple('extents',
-                               ('imin', 'jmin', 'kmin',
-                                'imax', 'jmax', 'kmax'))
-
     def __init__(self, x_points, y_points, z_points, imesh=None, **kw):
         """Construct a ScdMesh from given x, y, and z coordinates.
 
@@ -62,11 +53,13 @@ class ScdMesh:
         self.dims = ScdMesh.extents_tuple(*bdtag[self.scdset])
         vdims_incr = list(self.dims[0:3]) + [x + 1 for x in self.dims[3:6]]
         self.vdims = ScdMesh.extents_tuple(*vdims_incr)
-        # access iterators for hexes and vertices; used by getHex()/getVtx()
-        self.hexit = self.scdset.iterate(iBase.Type.region,
-                                         iMesh.Topology.hexahedron)
-        self.vtxit = self.scdset.iterate(iBase.Type.vertex,
-                                         iMesh.Topology.point)
+        # arrays of hex and vertex handles in canonical (zyx) order;
+        # built on first use by _hexHandles() and _vtxHandles()
+        self._hexes = None
+        self._vtxs = None
+        # read-only arrays of the x, y and z divisions; built on first use
+        # by get_division_array()
+        self._divs = None
 
     @classmethod
     def fromFile(cls, filename, imesh=None):
@@ -104,15 +97,33 @@ class ScdMesh:
         m = cls(None, None, None, imesh, _scdset=eset)
         return m
 
+    def _hexHandles(self):
+        """Return an array of all hex handles in canonical (zyx) order
+
+        The array is fetched from the structured mesh set once and cached,
+        so that random access to hexes is simple index arithmetic.
+        """
+        if self._hexes is None:
+            self._hexes = self.scdset.getEntities(iBase.Type.region,
+                                                  iMesh.Topology.hexahedron)
+        return self._hexes
+
+    def _vtxHandles(self):
+        """Return an array of all vertex handles in canonical (zyx) order"""
+        if self._vtxs is None:
+            self._vtxs = self.scdset.getEntities(iBase.Type.vertex,
+                                                 iMesh.Topology.point)
+        return self._vtxs
+
     def getVtx(self, i, j, k):
         """Return the (i,j,k)'th vertex in the mesh"""
         n = _dimConvert(self.vdims, (i, j, k))
-        return _stepIter(self.vtxit, n)
+        return self._vtxHandles()[n]
 
     def getHex(self, i, j, k):
         """Return the (i,j,k)'th hexahedron in the mesh"""
         n = _dimConvert(self.dims, (i, j, k))
-        return _stepIter(self.hexit, n)
+        return self._hexHandles()[n]
 
     def getHexVolume(self, i, j, k):
         """Return the volume of the (i,j,k)'th hexahedron in the mesh"""
@@ -172,7 +183,7 @@ class ScdMesh:
                                        iMesh.Topology.hexahedron)
 
         indices, ordmap = _scdIterSetup(self.dims, order, **kw)
-        return _scdIter(indices, ordmap, self.dims, self.hexit)
+        return _scdIter(indices, ordmap, self.dims, self._hexHandles())
 
     def iterateVtx(self, order='zyx', **kw):
         """Get an iterator over the vertices of the mesh
@@ -186,119 +197,241 @@ class ScdMesh:
             return self.scdset.iterate(iBase.Type.vertex, iMesh.Topology.point)
 
         indices, ordmap = _scdIterSetup(self.vdims, order, **kw)
-        return _scdIter(indices, ordmap, self.vdims, self.vtxit)
+        return _scdIter(indices, ordmap, self.vdims, self._vtxHandles())
 
-    def iterateHexVolumes(self, order='zyx', **kw):
-        """Get an iterator over the volumes of the mesh hexahedra
+    def get_division_array(self, dim):
+        """Get the mesh divisions on a given dimension as a read-only ndarray
 
-        See iterateHex() for an explanation of the order argument and the
-        available keyword arguments.
+        The divisions along all three dimensions are read with a single bulk
+        coordinate query on first use, and cached.  If the coordinates of
+        the mesh vertices are modified through the iMesh instance, call
+        refresh_divisions() to discard the cached values.
         """
+        if not (len(dim) == 1 and dim in 'xyz'):
+            raise ScdMeshError('Invalid dimension: '+str(dim))
+        if self._divs is None:
+            self._divs = _readDivisions(self.imesh, self._vtxHandles(),
+                                        self.vdims)
+        return self._divs['xyz'.find(dim)]
+
+    def refresh_divisions(self):
+        """Discard the cached mesh divisions
 
-        indices, _ = _scdIterSetup(self.dims, order, **kw)
-        # Use an inefficient but simple approach: call getHexVolume()
-        # on each required i,j,k pair.  
-        # A better implementation would only make one call to getVtxCoords.
-        for A in itertools.product(*indices):
-            # the ordmap returned from _scdIterSetup maps to kji/zyx ordering,
-            # but we want ijk/xyz ordering, so create the ordmap differently.
-            ordmap = [order.find(L) for L in 'xyz']
-            ijk = [A[ordmap[x]] for x in range(3)]
-            yield self.getHexVolume(*ijk)
-
-    def getDivisions(self, dim):
-        """Get the mesh divisions on a given dimension
-
-        Given a dimension 'x', 'y', or 'z', return a list of the mesh vertices
-        along that dimension
+        Needed only if vertex coordinates are changed after the divisions
+        have been read; they are read again on next use.
         """
-        if len(dim) == 1 and dim in 'xyz':
-            idx = 'xyz'.find(dim)
-            return [self.imesh.getVtxCoords(i)[idx]
-                    for i in self.iterateVtx(dim)]
-        else:
-            raise ScdMeshError('Invalid dimension: '+str(dim))
+        self._divs = None
 
+    def sample_tag_at(self, points, tagname, fill=np.nan):
+        """Return the values of a hex tag at a set of points
 
-def _dimConvert(dims, ijk):
-    """Helper method fo getVtx and getHex
+        Parameters
+        ----------
+        points : array_like
+            Array of shape (N,3) of x, y, z coordinates.
+        tagname : string
+            Name of the tag to read.
+        fill : float, optional
+            Value returned for points outside of the mesh.  Default is NaN.
+
+        Returns
+        -------
+        values : ndarray
+            Array of shape (N,), or (N,G) for vector-valued tags, with the
+            value of the tag on the hex containing each point.
+        """
+        tag = self.imesh.getTagHandle(tagname)
+        _, flat, outside = self.locate(points)
+        return _sampleAt(flat, outside, tag.sizeValues, fill,
+                         lambda idx: tag[self._hexHandles()[idx]])
+
+    def get_tag_array(self, name, order='xyz', dtype=np.float64,
+                      group_axis=-1):
+        """Read a hex tag over the whole mesh into an ndarray
+
+        All values are fetched with a single bulk tag access.
 
-    For tuple (i,j,k), return the number N in the appropriate iterator.
+        Parameters
+        ----------
+        name : string
+            Name of the tag to read.
+        order : string, optional
+            A permutation of 'xyz' giving the axes of the returned array; the
+            rightmost letter changes fastest, as for iterateHex().  The
+            default 'xyz' returns an array indexed as [i,j,k].
+        dtype : numpy dtype, optional
+            Data type of the returned array.  Default is float64.
+        group_axis : int, optional
+            For vector-valued tags, the axis of the returned array along which
+            the tag's components lie.  Default is the last axis.
+
+        Returns
+        -------
+        array : ndarray
+            Array of shape (nx, ny, nz), permuted according to order, with an
+            extra group axis if the tag is vector-valued.
+        """
+        tag = self.imesh.getTagHandle(name)
+        values = np.asarray(tag[self._hexHandles()], dtype=dtype)
+        return _canonicalToOrder(values, self.dims, order, group_axis)
+
+    def set_tag_array(self, name, array, order='xyz', dtype=np.float64,
+                      group_axis=-1):
+        """Write an ndarray of values to a hex tag over the whole mesh
+
+        The tag is created if it does not exist yet, and all values are
+        written with a single bulk tag access.
+
+        Parameters
+        ----------
+        name : string
+            Name of the tag to write.
+        array : array_like
+            Values to write, shaped as returned by get_tag_array() with the
+            same order and group_axis arguments.  An extra group axis creates
+            or writes a vector-valued tag.
+        order : string, optional
+            A permutation of 'xyz' giving the axes of array.  Default 'xyz'.
+        dtype : numpy dtype, optional
+            Data type of the tag.  Default is float64.
+        group_axis : int, optional
+            For vector-valued tags, the axis of array along which the tag's
+            components lie.  Default is the last axis.
+        """
+        values = _orderToCanonical(np.asarray(array, dtype=dtype), self.dims,
+                                   order, group_axis)
+        size = values.shape[1] if values.ndim == 2 else 1
+        try:
+            tag = self.imesh.createTag(name, size, dtype)
+        except iBase.TagAlreadyExistsError:
+            tag = self.imesh.getTagHandle(name)
+        tag[self._hexHandles()] = values
+
+    def view(self, i=None, j=None, k=None):
+        """Return a view of the hexes in a box of i, j and k coordinates
+
+        Each argument is a slice or a (min, max) pair of mesh coordinates,
+        with max excluded as for Python ranges, or None to include the whole
+        dimension.  For example, sm.view((2, 4), None, slice(0, 1)) selects
+        the hexes with i-coordinate 2 or 3 and k-coordinate 0.  Note that,
+        as for getHex(), bounds are mesh coordinates, and negative values do
+        not count from the end.
+
+        The returned ScdMeshView shares the hexes, vertices and tags of this
+        mesh, so tags set through it change this mesh.  The arrays of the
+        view's hex and vertex handles are copies, gathered from those of
+        this mesh on first use.  See ScdMeshView.
+        """
+        return ScdMeshView(self, i, j, k)
+
+
+class ScdMeshView(ScdMesh):
+    """A box-shaped part of a structured mesh
+
+    A view supports the iteration, volume, location and tag array methods of
+    ScdMesh, restricted to its hexes; its dims keep the (i,j,k) numbering of
+    the parent mesh.  Views are created with ScdMesh.view(), and can be
+    nested.
+
+    Public member variables, in addition to those of ScdMesh::
+
+        self.parent -- the mesh or view this view was created from
     """
-    dim0 = [0] * 3
-    for i in xrange(0, 3):
-        if (dims[i] > ijk[i] or dims[i + 3] <= ijk[i]):
-            raise ScdMeshError(str(ijk) + ' is out of bounds')
-        dim0[i] = ijk[i] - dims[i]
-    i0, j0, k0 = dim0
-    n = (((dims[4] - dims[1]) * (dims[3] - dims[0]) * k0) +
-         ((dims[3] - dims[0]) * j0) +
-         i0)
-    return n
-
-
-def _stepIter(it, n):
-    """Helper method for getVtx and getHex
-
-    Return the nth item in the iterator"""
-    it.step(n)
-    r = it.next()
-    it.reset()
-    return r
-
-
-def _scdIterSetup(dims, order, **kw):
-    """Setup helper function for ScdMesh iterator functions
-
-    Given dims and the arguments to the iterator function, return
-    a list of three lists, each being a set of desired coordinates,
-    with fastest-changing coordinate in the last column),
-    and the ordmap used by _scdIter to reorder each coodinate to (i,j,k)
+
+    def __init__(self, parent, i=None, j=None, k=None):
+        self.parent = parent
+        self.imesh = parent.imesh
+        self.scdset = parent.scdset
+        extents = list(parent.dims)
+        for idx, bounds in enumerate((i, j, k)):
+            if bounds is None:
+                continue
+            if isinstance(bounds, slice):
+                if bounds.step not in (None, 1):
+                    raise ScdMeshError('Views cannot have a step: '
+                                       + str(bounds))
+                bounds = (bounds.start, bounds.stop)
+            lo, hi = bounds
+            lo = parent.dims[idx] if lo is None else lo
+            hi = parent.dims[idx + 3] if hi is None else hi
+            if not parent.dims[idx] <= lo < hi <= parent.dims[idx + 3]:
+                raise ScdMeshError('Invalid view bounds: {0}={1}'.format(
+                                   'ijk'[idx], bounds))
+            extents[idx], extents[idx + 3] = lo, hi
+        self.dims = ScdMesh.extents_tuple(*extents)
+        vdims_incr = list(self.dims[0:3]) + [x + 1 for x in self.dims[3:6]]
+        self.vdims = ScdMesh.extents_tuple(*vdims_incr)
+        self._hexes = None
+        self._vtxs = None
+
+    def _hexHandles(self):
+        """Return an array of the view's hex handles in canonical order"""
+        if self._hexes is None:
+            indices, ordmap = _scdIterSetup(self.dims, 'zyx')
+            n = _scdIndices(indices, ordmap, self.parent.dims)
+            self._hexes = self.parent._hexHandles()[n]
+        return self._hexes
+
+    def _vtxHandles(self):
+        """Return an array of the view's vertex handles in canonical order"""
+        if self._vtxs is None:
+            indices, ordmap = _scdIterSetup(self.vdims, 'zyx')
+            n = _scdIndices(indices, ordmap, self.parent.vdims)
+            self._vtxs = self.parent._vtxHandles()[n]
+        return self._vtxs
+
+    def iterateHex(self, order='zyx', **kw):
+        """Get an iterator over the hexahedra of the view
+
+        See ScdMesh.iterateHex().
+        """
+        if order == 'zyx' and not kw:
+            return iter(self._hexHandles())
+        return ScdMesh.iterateHex(self, order, **kw)
+
+    def iterateVtx(self, order='zyx', **kw):
+        """Get an iterator over the vertices of the view
+
+        See ScdMesh.iterateHex().
+        """
+        if order == 'zyx' and not kw:
+            return iter(self._vtxHandles())
+        return ScdMesh.iterateVtx(self, order, **kw)
+
+    def get_division_array(self, dim):
+        """Get the view's divisions on a given dimension
+
+        Returns a read-only slice of the parent's division array.
+        """
+        divs = self.parent.get_division_array(dim)
+        idx = 'xyz'.find(dim)
+        lo = self.dims[idx] - self.parent.dims[idx]
+        hi = self.dims[idx + 3] - self.parent.dims[idx]
+        return divs[lo:hi + 1]
+
+    def refresh_divisions(self):
+        """Discard the cached divisions of the parent mesh"""
+        self.parent.refresh_divisions()
+
+
+def _readDivisions(imesh, vtxs, vdims):
+    """Return read-only arrays of the x, y and z divisions of a mesh
+
+    vtxs is the array of vertex handles in canonical order.  The vertices
+    along the three edges through the (imin,jmin,kmin) corner are read with
+    one call to getVtxCoords.
     """
-    # a valid order has the letters 'x', 'y', and 'z'
-    # in any order without duplicates
-    if not (len(order) <= 3 and
-            len(set(order)) == len(order) and
-            all([a in 'xyz' for a in order])):
-        raise ScdMeshError('Invalid iteration order: ' + str(order))
-
-    # process kw for validity
-    spec = {}
-    for idx, d in enumerate('xyz'):
-        if d in kw:
-            spec[d] = kw[d]
-            if not isinstance(spec[d], Iterable):
-                spec[d] = [spec[d]]
-            if not all(x in range(dims[idx], dims[idx + 3])
-                    for x in spec[d]):
-                raise ScdMeshError( \
-                        'Invalid iterator kwarg: {0}={1}'.format(d, spec[d]))
-            if d not in order and len(spec[d]) > 1:
-                raise ScdMeshError('Cannot iterate over' + str(spec[d]) +
-                                   'without a proper iteration order')
-        if d not in order:
-            order = d + order
-            spec[d] = spec.get(d, [dims[idx]])
-
-    # get indices and ordmap
-    indices = []
-    for L in order:
-        idx = 'xyz'.find(L)
-        indices.append(spec.get(L, xrange(dims[idx], dims[idx + 3])))
-
-    ordmap = ['zyx'.find(L) for L in order]
-
-    return indices, ordmap
-
-
-def _scdIter(indices, ordmap, dims, it):
-    """Iterate over the indices lists, yielding _stepIter(it) for each"""
-    d = [0, 0, 1]
-    d[1] = (dims[3] - dims[0])
-    d[0] = (dims[4] - dims[1]) * d[1]
-    mins = [dims[2], dims[1], dims[0]]
-    offsets = ([(a - mins[ordmap[x]]) * d[ordmap[x]]
-                for a in indices[x]]
-                for x in range(3))
-    for ioff, joff, koff in itertools.product(*offsets):
-        yield _stepIter(it, (ioff + joff + koff))
+    ni, nj, nk = [vdims[3 + x] - vdims[x] for x in range(3)]
+    idx = np.concatenate((np.arange(ni), np.arange(nj) * ni,
+                          np.arange(nk) * ni * nj))
+    coords = np.asarray(imesh.getVtxCoords(vtxs[idx]), dtype=np.float64)
+    divs = (coords[:ni, 0], coords[ni:ni + nj, 1], coords[ni + nj:, 2])
+    for d in divs:
+        d.flags.writeable = False
+    return divs
+
+
+def _scdIter(indices, ordmap, dims, handles):
+    """Iterate over the indices lists, yielding the matching entries of handles"""
+    for n in _scdIndices(indices, ordmap, dims):
+        yield handles[n]
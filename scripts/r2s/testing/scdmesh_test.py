@@ -54,6 +54,21 @@ class ScdMeshTest(unittest.TestCase):
         self.assertRaises(ScdMeshError, sm.getHex, 0, 3, 0)
         self.assertRaises(ScdMeshError, sm.getHex, 0, 0, 2)
 
+    def test_random_access(self):
+        # getHex and getVtx should agree with the canonical iteration order,
+        # regardless of the order in which they are called
+        sm = ScdMesh( range(11,16), range(21,25), range(31,34) )
+        hexes = list(sm.iterateHex())
+        for n, (k, j, i) in reversed(list(enumerate(
+                itertools.product(range(2), range(3), range(4))))):
+            self.assertEqual( sm.getHex(i, j, k), hexes[n] )
+
+        vtxs = list(sm.iterateVtx())
+        self.assertEqual( sm.getVtx(4, 3, 2), vtxs[-1] )
+        self.assertEqual( sm.getVtx(1, 0, 0), vtxs[1] )
+        self.assertEqual( sm.getVtx(0, 1, 0), vtxs[5] )
+        self.assertEqual( sm.getVtx(0, 0, 1), vtxs[20] )
+
     def test_hex_volume(self):
 
         sm = ScdMesh( [0,1,3], [-3,-2,0], [12,13,15] )
@@ -68,6 +83,21 @@ class ScdMeshTest(unittest.TestCase):
         for V, ijk in itertools.izip_longest(sm.iterateHexVolumes(), ijk_all):
             self.assertEqual( V, sm.getHexVolume(*ijk) )
 
+    def test_hex_volumes(self):
+
+        sm = ScdMesh( [0,1,3,6], [-3,-2,0], [12,13,17] )
+        vols = sm.hex_volumes()
+        self.assertEqual( vols.shape, (3,2,2) )
+        for i, j, k in itertools.product(range(3), range(2), range(2)):
+            self.assertEqual( vols[i,j,k], sm.getHexVolume(i,j,k) )
+
+        self.assertEqual( sm.hex_volumes('zyx').ravel().tolist(),
+                          list(sm.iterateHexVolumes()) )
+        self.assertEqual( sm.hex_volumes('yzx').shape, (2,2,3) )
+        self.assertEqual( list(sm.iterateHexVolumes('zy', x=2)),
+                          [3, 6, 12, 24] )
+        self.assertRaises( ScdMeshError, sm.hex_volumes, 'xy' )
+
 
     def test_get_vtx(self):
         # mesh with valid i values 0-4, j values 0-3, k values 0-2
@@ -95,6 +125,137 @@ class ScdMeshTest(unittest.TestCase):
         self.assertEqual( sm.getDivisions('y'), y )
         self.assertEqual( sm.getDivisions('z'), z )
 
+    def test_division_array(self):
+        x = [1, 2.5, 4, 6.9]
+        y = [-12, -10, -.5]
+        z = [100, 200]
+
+        sm = ScdMesh( x, y, z )
+
+        xdivs = sm.get_division_array('x')
+        self.assertEqual( xdivs.tolist(), x )
+        self.assertEqual( sm.get_division_array('y').tolist(), y )
+        self.assertEqual( sm.get_division_array('z').tolist(), z )
+        self.assertTrue( sm.get_division_array('x') is xdivs )
+        self.assertRaises( ValueError, xdivs.__setitem__, 0, 0.0 )
+        self.assertRaises( ScdMeshError, sm.get_division_array, 'w' )
+
+        sm.refresh_divisions()
+        self.assertFalse( sm.get_division_array('x') is xdivs )
+        self.assertEqual( sm.get_division_array('x').tolist(), x )
+
+    def test_tag_array(self):
+        sm = ScdMesh( range(11,16), range(21,25), range(31,34), self.mesh )
+        vals = numpy.arange(24, dtype=numpy.float64).reshape(4,3,2)
+        sm.set_tag_array( 'test', vals )
+        tag = self.mesh.getTagHandle( 'test' )
+        for ijk in itertools.product(range(4), range(3), range(2)):
+            self.assertEqual( tag[sm.getHex(*ijk)], vals[ijk] )
+
+        self.assertTrue( (sm.get_tag_array('test') == vals).all() )
+        zyx = sm.get_tag_array( 'test', order='zyx' )
+        self.assertEqual( zyx.shape, (2,3,4) )
+        self.assertTrue( (zyx == vals.transpose()).all() )
+        # the flattened array should follow the matching iteration order
+        self.assertEqual( list(zyx.ravel()),
+                          [tag[h] for h in sm.iterateHex('zyx')] )
+
+        # vector-valued tags get an extra group axis
+        groups = numpy.arange(48, dtype=numpy.float64).reshape(4,3,2,2)
+        sm.set_tag_array( 'test_groups', groups )
+        self.assertTrue( (sm.get_tag_array('test_groups') == groups).all() )
+        front = sm.get_tag_array( 'test_groups', 'yxz', group_axis=0 )
+        self.assertEqual( front.shape, (2,3,4,2) )
+        self.assertTrue( (front[1,2,3] == groups[3,2,:,1]).all() )
+
+        self.assertRaises( ScdMeshError, sm.set_tag_array, 'test', vals.T )
+        self.assertRaises( ScdMeshError, sm.get_tag_array, 'test', 'xy' )
+
+    def test_locate(self):
+        sm = ScdMesh( [0,1,3], [-3,-2,0], [12,13,15,16] )
+        points = [[0.5, -2.5, 12.5],   # (0,0,0)
+                  [2.0, -1.0, 15.5],   # (1,1,2)
+                  [1.0, -2.0, 13.0],   # on interior faces: (1,1,1)
+                  [3.0, 0.0, 16.0],    # on the upper corner: (1,1,2)
+                  [-0.1, -2.5, 12.5],  # outside
+                  [0.5, -2.5, 16.1]]   # outside
+        ijk, flat, outside = sm.locate( points )
+        self.assertEqual( ijk.tolist(), [[0,0,0], [1,1,2], [1,1,1], [1,1,2],
+                                         [-1,-1,-1], [-1,-1,-1]] )
+        self.assertEqual( outside.tolist(), [False]*4 + [True]*2 )
+        hexes = list(sm.iterateHex())
+        for n in range(4):
+            self.assertEqual( hexes[flat[n]], sm.getHex(*ijk[n]) )
+        self.assertEqual( flat[4:].tolist(), [-1,-1] )
+
+    def test_sample_tag_at(self):
+        sm = ScdMesh( range(11,16), range(21,25), range(31,34), self.mesh )
+        vals = numpy.arange(24, dtype=numpy.float64).reshape(4,3,2)
+        sm.set_tag_array( 'test', vals )
+        samples = sm.sample_tag_at( [[11.5, 21.5, 31.5], [14.5, 23.5, 32.5],
+                                     [10, 22, 32]], 'test' )
+        self.assertEqual( samples[:2].tolist(), [vals[0,0,0], vals[3,2,1]] )
+        self.assertTrue( numpy.isnan(samples[2]) )
+
+class ScdMeshViewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mesh = iMesh.Mesh()
+        self.sm = ScdMesh( range(10,15), # i = 0,1,2,3
+                           [21,22,24,27], # j = 0,1,2
+                           range(31,34), # k = 0,1
+                           self.mesh )
+        self.view = self.sm.view( (1,3), slice(1,None), None )
+
+    def test_dims(self):
+        self.assertEqual( self.view.dims, (1,1,0,3,3,2) )
+        self.assertEqual( self.view.getDivisions('x'), [11,12,13] )
+        self.assertEqual( self.view.getDivisions('y'), [22,24,27] )
+        self.assertEqual( self.view.getDivisions('z'), [31,32,33] )
+        self.assertRaises( ScdMeshError, self.sm.view, (0,5) )
+        self.assertRaises( ScdMeshError, self.sm.view, None, (2,2) )
+        self.assertRaises( ScdMeshError, self.sm.view, slice(0,2,2) )
+
+    def test_iterate(self):
+        for order in ('zyx', 'xyz', 'yxz'):
+            self.assertEqual( list(self.view.iterateHex(order)),
+                              list(self.sm.iterateHex(order, x=[1,2],
+                                                      y=[1,2])) )
+        self.assertEqual( list(self.view.iterateHex('y', x=2)),
+                          list(self.sm.iterateHex('y', x=2, y=[1,2])) )
+        self.assertEqual( list(self.view.iterateVtx()),
+                          list(self.sm.iterateVtx('zyx', x=[1,2,3],
+                                                  y=[1,2,3])) )
+        self.assertEqual( self.view.getHex(2,1,1), self.sm.getHex(2,1,1) )
+        self.assertRaises( ScdMeshError, self.view.getHex, 0, 1, 1 )
+
+    def test_volumes(self):
+        self.assertEqual( self.view.hex_volumes('zyx').ravel().tolist(),
+                          list(self.sm.iterateHexVolumes('zyx', x=[1,2],
+                                                         y=[1,2])) )
+        self.assertEqual( self.view.getHexVolume(2,2,1), 3 )
+
+    def test_tags(self):
+        vals = numpy.arange(24, dtype=numpy.float64).reshape(4,3,2)
+        self.sm.set_tag_array( 'test', vals )
+        self.assertTrue( (self.view.get_tag_array('test') ==
+                          vals[1:3,1:3,:]).all() )
+        self.view.set_tag_array( 'test', numpy.zeros((2,2,2)) )
+        vals[1:3,1:3,:] = 0
+        self.assertTrue( (self.sm.get_tag_array('test') == vals).all() )
+
+    def test_nested(self):
+        inner = self.view.view( None, None, (1,2) )
+        self.assertEqual( inner.dims, (1,1,1,3,3,2) )
+        self.assertEqual( list(inner.iterateHex('xyz')),
+                          list(self.sm.iterateHex('xyz', x=[1,2], y=[1,2],
+                                                  z=1)) )
+        ijk, flat, outside = inner.locate( [[12.5, 25, 32.5], [10.5, 25, 32.5]] )
+        self.assertEqual( ijk[0].tolist(), [2,2,1] )
+        self.assertEqual( list(inner.iterateHex())[flat[0]],
+                          self.sm.getHex(2,2,1) )
+        self.assertTrue( outside[1] )
+
 class ScdMeshIterateTest(unittest.TestCase):
 
     def setUp(self):
@@ -0,0 +1,115 @@
+import numpy
+import unittest
+import itertools
+
+from r2s.scdgrid import ScdMeshError
+from r2s.arrayscdmesh import ArrayScdMesh
+
+try:
+    from r2s.scdmesh import ScdMesh
+except ImportError:
+    ScdMesh = None
+
+
+class ArrayScdMeshArraysTest(unittest.TestCase):
+    """ArrayScdMesh on its own, without itaps"""
+
+    def setUp(self):
+        self.am = ArrayScdMesh( [0, 1, 3], [0, 2], [0, 1, 4] )
+
+    def test_create(self):
+        self.assertEqual( self.am.dims, (0, 0, 0, 2, 1, 2) )
+        self.assertEqual( self.am.vdims, (0, 0, 0, 3, 2, 3) )
+        self.assertEqual( len(self.am), 4 )
+        self.assertEqual( list(self.am.iterateHex('xz')), [0, 2, 1, 3] )
+
+    def test_volumes(self):
+        self.assertEqual( list(self.am.iterateHexVolumes()), [2, 4, 6, 12] )
+        self.assertEqual( self.am.hex_volumes('xyz').tolist(),
+                          [[[2, 6]], [[4, 12]]] )
+        self.assertEqual( self.am.getHexVolume(1, 0, 1), 12 )
+
+    def test_locate(self):
+        ijk, flat, outside = self.am.locate( [[2, 1, 2], [.5, 1, 4],
+                                              [4, 1, 1]] )
+        self.assertEqual( ijk.tolist(), [[1, 0, 1], [0, 0, 1], [-1, -1, -1]] )
+        self.assertEqual( flat.tolist(), [3, 2, -1] )
+        self.assertEqual( outside.tolist(), [False, False, True] )
+
+    def test_get_tag_array_copy(self):
+        self.am.tags['test'] = numpy.arange(4, dtype=numpy.float64)
+        for order in ('zyx', 'xyz'):
+            arr = self.am.get_tag_array( 'test', order )
+            arr[...] = -1
+            self.assertEqual( self.am.tags['test'].tolist(), [0, 1, 2, 3] )
+
+
+class ArrayScdMeshTest(unittest.TestCase):
+
+    def setUp(self):
+        if ScdMesh is None:
+            raise unittest.SkipTest('itaps is not available')
+        self.x = [0, 1, 3, 6]
+        self.y = [-3, -2, 0]
+        self.z = [12, 13, 17]
+        self.am = ArrayScdMesh( self.x, self.y, self.z )
+        self.sm = ScdMesh( self.x, self.y, self.z )
+
+    def test_create(self):
+        self.assertEqual( self.am.dims, self.sm.dims )
+        self.assertEqual( self.am.vdims, self.sm.vdims )
+        self.assertEqual( len(self.am), 12 )
+        self.assertEqual( self.am.getDivisions('y'), self.y )
+
+        am = ArrayScdMesh( self.x, self.y, self.z, ijk_min=(1, 11, -5) )
+        self.assertEqual( am.dims, (1, 11, -5, 4, 13, -3) )
+        self.assertEqual( am.getHex(1, 11, -5), 0 )
+        self.assertRaises( ScdMeshError, am.getHex, 0, 0, 0 )
+
+    def test_iterate(self):
+        hexes = list(self.sm.iterateHex())
+        for order in ('zyx', 'xyz', 'yzx'):
+            self.assertEqual( [hexes[n] for n in self.am.iterateHex(order)],
+                              list(self.sm.iterateHex(order)) )
+        self.assertEqual( [hexes[n] for n in self.am.iterateHex('y', x=2)],
+                          list(self.sm.iterateHex('y', x=2)) )
+        for i, j, k in itertools.product(range(3), range(2), range(2)):
+            self.assertEqual( hexes[self.am.getHex(i, j, k)],
+                              self.sm.getHex(i, j, k) )
+
+    def test_volumes(self):
+        self.assertEqual( list(self.am.iterateHexVolumes('xyz')),
+                          list(self.sm.iterateHexVolumes('xyz')) )
+        self.assertTrue( (self.am.hex_volumes('zxy') ==
+                          self.sm.hex_volumes('zxy')).all() )
+        self.assertEqual( self.am.getHexVolume(2, 1, 1),
+                          self.sm.getHexVolume(2, 1, 1) )
+
+    def test_tags(self):
+        vals = numpy.arange(12, dtype=numpy.float64).reshape(3,2,2)
+        self.am.set_tag_array( 'test', vals )
+        self.assertTrue( (self.am.get_tag_array('test') == vals).all() )
+        for n, h in enumerate(self.am.iterateHex('xyz')):
+            self.assertEqual( self.am.tags['test'][h], n )
+        self.assertEqual( self.am.sample_tag_at([[5, -1, 13]], 'test')[0],
+                          vals[2,1,1] )
+        self.assertRaises( ScdMeshError, ArrayScdMesh, self.x, self.y, self.z,
+                           {'test': numpy.zeros(5)} )
+
+    def test_convert(self):
+        vals = numpy.arange(12, dtype=numpy.float64).reshape(3,2,2)
+        groups = numpy.arange(24, dtype=numpy.float64).reshape(3,2,2,2)
+        self.sm.set_tag_array( 'test', vals )
+        self.sm.set_tag_array( 'test_groups', groups )
+
+        am = ArrayScdMesh.fromScdMesh( self.sm )
+        self.assertTrue( 'test' in am.tags and 'test_groups' in am.tags )
+        self.assertTrue( (am.get_tag_array('test') == vals).all() )
+        self.assertTrue( (am.get_tag_array('test_groups') == groups).all() )
+
+        am.set_tag_array( 'test', 2 * vals )
+        sm = am.toScdMesh()
+        self.assertEqual( sm.dims, self.sm.dims )
+        self.assertEqual( sm.getDivisions('x'), self.x )
+        self.assertTrue( (sm.get_tag_array('test') == 2 * vals).all() )
+        self.assertTrue( (sm.get_tag_array('test_groups') == groups).all() )
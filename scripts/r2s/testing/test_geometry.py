@@ -0,0 +1,215 @@
+import pickle
+import unittest
+
+import numpy
+
+from r2s.arrayscdmesh import ArrayScdMesh
+from r2s import geometry
+from r2s.geometry import Box, Sphere, Cylinder, CSGGeometry
+from r2s import mmgrid
+
+try:
+    from itaps import iMesh
+except ImportError:
+    iMesh = None
+
+
+def make_geometry():
+    """A sphere in front of a half-space box and a cylinder"""
+    return CSGGeometry( Box([-5]*3, [5]*3),
+                        [(Sphere([0,0,0], 1), 1, -2.0),
+                         (Box([-5,-5,-5], [0,5,5]), 2, -8.0),
+                         (Cylinder([2,0,-4], [0,0,8], 1), 3, -1.0)] )
+
+
+class ShapeTest(unittest.TestCase):
+
+    def test_box(self):
+        box = Box([0,0,0], [1,2,3])
+        self.assertEqual( list(box.contains(numpy.array(
+                [[.5,1,1], [1,1,1], [0,0,0]]))), [True, False, True] )
+        near, far = box.intersect(numpy.array([[-1,1,1], [-1,5,1]]),
+                                  numpy.array([1.,0,0]))
+        self.assertEqual( list(near), [1, numpy.inf] )
+        self.assertEqual( list(far), [2, numpy.inf] )
+
+    def test_sphere(self):
+        sphere = Sphere([1,0,0], 2)
+        near, far = sphere.intersect(numpy.array([[-3,0,0], [1,0,0]]),
+                                     numpy.array([1.,0,0]))
+        self.assertEqual( list(near), [2, -2] )
+        self.assertEqual( list(far), [6, 2] )
+        lo, hi = sphere.bounds()
+        self.assertEqual( list(lo), [-1,-2,-2] )
+        self.assertEqual( list(hi), [3,2,2] )
+
+    def test_cylinder(self):
+        cyl = Cylinder([0,0,0], [0,0,2], 1)
+        self.assertEqual( list(cyl.contains(numpy.array(
+                [[.5,.5,1], [1,1,1], [0,0,2]]))), [True, False, False] )
+        # across the side, and along the axis through both caps
+        near, far = cyl.intersect(numpy.array([[-2,0,1]]),
+                                  numpy.array([1.,0,0]))
+        self.assertEqual( (near[0], far[0]), (1, 3) )
+        near, far = cyl.intersect(numpy.array([[.5,0,-1]]),
+                                  numpy.array([0,0,1.]))
+        self.assertEqual( (near[0], far[0]), (1, 3) )
+        lo, hi = Cylinder([0,0,0], [2,0,0], 1).bounds()
+        self.assertEqual( list(lo), [0,-1,-1] )
+        self.assertEqual( list(hi), [2,1,1] )
+
+
+class CSGGeometryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.geom = make_geometry()
+
+    def test_volumes(self):
+        geom = self.geom
+        self.assertEqual( geom.get_volume_list(), [1,2,3,4,5] )
+        self.assertEqual( geom.get_material_set(),
+                          set([(0,0.0), (1,-2.0), (2,-8.0), (3,-1.0)]) )
+        # the sphere takes precedence over the box it overlaps
+        self.assertEqual( list(geom.find_volumes(
+                [[-.5,0,0], [-3,0,0], [2,0,0], [3.5,0,0], [6,0,0]])),
+                [1, 2, 3, 4, 5] )
+        self.assertRaises( geometry.GeometryError, geom.volume_metadata, 6 )
+
+    def test_trace_rays(self):
+        segs = self.geom.trace_rays( [[-5,0,0], [-5,4,4], [-6,4,4]],
+                                     [1,0,0], 10 )
+        self.assertEqual( list(segs.rays), [0,0,0,0,1,1] )
+        self.assertEqual( list(segs.vols), [2,1,3,4,2,4] )
+        self.assertEqual( list(segs.starts), [0,4,6,8,0,5] )
+        self.assertEqual( list(segs.ends), [4,6,8,10,5,10] )
+
+    def test_missing_method(self):
+        class NoRays(geometry.GeometryProvider):
+            pass
+        self.assertRaises( geometry.GeometryError, NoRays().trace_rays,
+                           [[0,0,0]], [1,0,0], 1 )
+
+    def test_pickle(self):
+        geom = pickle.loads(pickle.dumps(self.geom, 2))
+        self.assertEqual( list(geom.find_volumes([[0,0,0], [2,0,0]])),
+                          [1, 3] )
+
+
+class CSGmmGridTest(unittest.TestCase):
+
+    def setUp(self):
+        self.geom = make_geometry()
+        mmgrid._quiet = True
+
+    def test_aligned_voxels(self):
+        """Voxels split by the box face at x=0 have exact fractions"""
+        geom = CSGGeometry( Box([-5]*3, [5]*3),
+                            [(Box([-5,-5,-5], [0,5,5]), 2, -8.0)] )
+        am = ArrayScdMesh( [-5,-1,1,5], [-5,5], [-5,5] )
+        grid = mmgrid.mmGrid( am, geometry=geom )
+        grid.generate( 2, 'grid' )
+        mat2 = grid.materials[(2,-8.0)][0]
+        void = grid.materials[(0,0.0)][0]
+        self.assertTrue( numpy.allclose(
+                grid.grid['mats'][:,0,0,mat2], [1, .5, 0] ) )
+        self.assertTrue( numpy.allclose(
+                grid.grid['mats'][:,0,0,void], [0, .5, 1] ) )
+
+    def test_sphere_volume(self):
+        """The sphere's volume is estimated within its errors"""
+        side = numpy.linspace(-2, 2, 5)
+        grid = mmgrid.mmGrid( ArrayScdMesh(side, side, side),
+                              geometry=self.geom )
+        grid.generate( 8, 'jitter', seed=2 )
+        mat1 = grid.materials[(1,-2.0)][0]
+        volume = grid.grid['mats'][...,mat1].sum()
+        error = numpy.sqrt((grid.grid['errs'][...,mat1]**2).sum())
+        self.assertTrue( abs(volume - 4 / 3. * numpy.pi) < 3 * error )
+
+    def test_adaptive(self):
+        """Adaptive sampling meets a relative error target"""
+        geom = CSGGeometry( Box([-5]*3, [5]*3),
+                            [(Sphere([0,0,0], 1), 1, -2.0)] )
+        side = numpy.linspace(-2, 2, 5)
+        grid = mmgrid.mmGrid( ArrayScdMesh(side, side, side), geometry=geom )
+        errs = grid.generate( 4, seed=1, target_err=0.1, max_rays=10**6 )
+        mats = grid.grid['mats']
+        self.assertTrue( (errs[mats > 0] <= 0.1 * mats[mats > 0]).all() )
+
+    def test_workers(self):
+        side = numpy.linspace(-5, 5, 6)
+        serial = mmgrid.mmGrid( ArrayScdMesh(side, side, side),
+                                geometry=self.geom )
+        serial.generate( 2, seed=3 )
+        parallel = mmgrid.mmGrid( ArrayScdMesh(side, side, side),
+                                  geometry=self.geom )
+        parallel.generate( 2, seed=3, workers=2 )
+        self.assertTrue( (serial.grid == parallel.grid).all() )
+
+    def test_homogeneous(self):
+        side = numpy.linspace(-5, 5, 11)
+        grid = mmgrid.mmGrid( ArrayScdMesh(side, side, side),
+                              geometry=self.geom )
+        hom = grid.find_homogeneous()
+        mat2 = grid.materials[(2,-8.0)][0]
+        # voxels of the box away from the sphere, but not those of the sphere
+        self.assertTrue( (hom[0:3] == mat2).all() )
+        self.assertTrue( (hom[4:6,4:6,4:6] == -1).all() )
+
+    def test_homogeneous_hidden_volume(self):
+        """A sphere inside one block, missed by its probe rays, keeps the
+        block from being homogeneous"""
+        geom = CSGGeometry( Box([-5]*3, [5]*3),
+                            [(Sphere([2,2,2], .5), 1, -2.0),
+                             (Box([-5]*3, [5]*3), 2, -8.0)] )
+        side = [-5, 0, 5]
+        grid = mmgrid.mmGrid( ArrayScdMesh(side, side, side), geometry=geom )
+        hom = grid.find_homogeneous()
+        mat2 = grid.materials[(2,-8.0)][0]
+        self.assertEqual( hom[1,1,1], -1 )
+        hom[1,1,1] = mat2
+        self.assertTrue( (hom == mat2).all() )
+
+
+@unittest.skipIf(iMesh is None, 'itaps is not available')
+class TetMatGridTest(unittest.TestCase):
+
+    def setUp(self):
+        mmgrid._quiet = True
+
+    def test_sample_tets(self):
+        corners = numpy.array([[[0,0,0], [1,0,0], [0,1,0], [0,0,1]],
+                               [[1,1,1], [3,1,1], [1,3,1], [1,1,3]]],
+                              dtype=float)
+        points = mmgrid._sample_tets( corners, 20000,
+                                      numpy.random.RandomState(1) )
+        self.assertEqual( points.shape, (2, 20000, 3) )
+        # all points inside, with the tets' centroids as mean
+        rel = (points - corners[:,numpy.newaxis,0]) / \
+              (corners[:,1,0] - corners[:,0,0])[:,numpy.newaxis,numpy.newaxis]
+        self.assertTrue( (rel >= 0).all() and (rel.sum(axis=-1) <= 1).all() )
+        self.assertTrue( numpy.allclose( points.mean(axis=1),
+                                         corners.mean(axis=1), atol=.02 ) )
+
+    def test_tet_fractions(self):
+        geom = CSGGeometry( Box([-5]*3, [5]*3),
+                            [(Box([-5,-5,-5], [0,5,5]), 2, -8.0)] )
+        mesh = iMesh.Mesh()
+        tets = []
+        for vertices in ([[-1,0,0], [1,0,0], [0,1,0], [0,0,1]],
+                         [[-3,0,0], [-2,0,0], [-3,1,0], [-3,0,1]]):
+            tet, status = mesh.createEnt( iMesh.Topology.tetrahedron,
+                                          mesh.createVtx(vertices) )
+            tets.append(tet)
+        grid = mmgrid.TetMatGrid( mesh, geometry=geom )
+        grid.generate( 4000, seed=1 )
+        mat2 = grid.materials[(2,-8.0)][0]
+        # the first tet is split in half by the box, the second inside it
+        self.assertTrue( abs(grid.fracs[0,mat2] - .5) < 4 * grid.errs[0,mat2] )
+        self.assertEqual( grid.fracs[1,mat2], 1 )
+        self.assertEqual( grid.errs[1,mat2], 0 )
+        self.assertTrue( numpy.allclose( grid.fracs.sum(axis=1), 1 ) )
+
+        grid.create_tags()
+        tag = mesh.getTagHandle( 'mat2_rho-8.0' )
+        self.assertEqual( list(tag[tets]), list(grid.fracs[:,mat2]) )
@@ -37,6 +37,24 @@ class mmGridHelperTest( unittest.TestCase) :
             self.assertTrue( all(pt[x] > 0 and pt[x] < 1.0 
                                  for x in (0,1)) )
 
+    def test_jitter_square(self):
+        f = mmgrid._jitter_square( 4 )
+        pts = list(f( 0.0, 1.0, -2.0, 2.0 ))
+        self.assertEqual( len(pts), 16 )
+        # one point in each cell
+        cells = set( (int(a*4), int((b+2.0))) for a,b in pts )
+        self.assertEqual( len(cells), 16 )
+
+    def test_quasirandom_squares(self):
+        for sampler in (mmgrid._halton_square, mmgrid._sobol_square):
+            f = sampler( 16 )
+            pts = list(f( 0.0, 1.0, 0.0, 1.0 ))
+            self.assertEqual( len(pts), 16 )
+            self.assertTrue( all(0.0 <= x < 1.0 for pt in pts for x in pt) )
+            # the first coordinates of both sequences place one point in
+            # each sixteenth of the square, whatever the random shift
+            self.assertEqual( sorted(int(a*16) for a,b in pts), range(16) )
+
 
 class mmGridTest( unittest.TestCase ):
     
@@ -58,6 +76,12 @@ class mmGridTest( unittest.TestCase ):
         self.assertEqual( 1, mmgrid.get_mat_id(matdict,2) )
         self.assertEqual( 2, mmgrid.get_mat_id(matdict,4) )
 
+    def test_volume_materials(self):
+        matdict = mmgrid.prepare_materials()
+        vol_mats = mmgrid.get_volume_materials(matdict)
+        for vol in pydagmc.dagmc.get_volume_list():
+            self.assertEqual( mmgrid.get_mat_id(matdict,vol), vol_mats[vol] )
+
     def test_rayframes(self):
 
         # a mesh with divisions at -1, 0, and 1 for all three dimensions
@@ -95,7 +119,9 @@ class mmGridTest( unittest.TestCase ):
         grid_side = [-5,-3.75,-2.5,-1.25,0,1.25,2.5,3.75,5]
         sm = ScdMesh( *([grid_side]*3) )
         grid = mmgrid.mmGrid( sm )
-        grid.generate(2, True)
+        errs = grid.generate(2, True)
+        self.assertEqual( errs.shape, (8,8,8,3) )
+        self.assertEqual( grid.max_err, errs.max() )
 
         for ijk, x in numpy.ndenumerate(grid.grid):
             self.assertAlmostEqual( 
@@ -119,3 +145,187 @@ class mmGridTest( unittest.TestCase ):
                     msg='Normality at ijk={0}:\n'
                         '    sum({1}) = {2} != 1.0'.format(ijk, x['mats'], sum(x['mats'])))
 
+
+
+    def test_generate_workers(self):
+        """Test that a seeded grid does not depend on the number of workers"""
+        grid_side = [-3,0,.1,.2,3]
+        grids = []
+        for workers in (1, 2):
+            sm = ScdMesh( *([grid_side]*3) )
+            grid = mmgrid.mmGrid( sm )
+            grid.generate(3, workers=workers, seed=1234)
+            grids.append(grid.grid)
+
+        self.assertTrue( (grids[0]['mats'] == grids[1]['mats']).all() )
+        self.assertTrue( (grids[0]['errs'] == grids[1]['errs']).all() )
+
+    def test_generate_sparse(self):
+        """Test that a sparse grid holds the nonzero fractions of a dense one"""
+        grid_side = [-3,0,.1,.2,3]
+        dense = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+        dense.generate(2, True)
+        grid = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ), sparse=True )
+        grid.generate(2, True)
+        self.assertEqual( grid.grid, None )
+
+        sp = grid.sparse
+        mats = dense.grid['mats'].reshape(-1, len(grid.materials))
+        errs = dense.grid['errs'].reshape(-1, len(grid.materials))
+        self.assertEqual( len(sp.voxels), numpy.count_nonzero(mats) )
+        self.assertTrue( (mats[sp.voxels, sp.materials] == sp.mats).all() )
+        self.assertTrue( (errs[sp.voxels, sp.materials] == sp.errs).all() )
+
+        grid.create_tags()
+        for (mat, rho), (matnum, matname) in grid.materials.iteritems():
+            self.assertTrue( (grid.scdmesh.get_tag_array(matname) == 
+                              dense.grid['mats'][...,matnum]).all() )
+
+    def test_generate_adaptive(self):
+        """Test that adaptive sampling meets its target error"""
+        grid_side = [-3,0,.1,.2,3]
+        sm = ScdMesh( *([grid_side]*3) )
+        grid = mmgrid.mmGrid( sm )
+        errs = grid.generate(2, seed=42, target_err=0.05, max_rays=10**5)
+        mats = grid.grid['mats']
+        self.assertTrue( (errs[mats > 0] <= 0.05 * mats[mats > 0]).all() )
+
+        for ijk, x in numpy.ndenumerate(grid.grid):
+            self.assertAlmostEqual( sum(x['mats']), 1.0 )
+
+        self.assertRaises( mmgrid.mmGridError, grid.generate, 2, True,
+                           target_err=0.05 )
+
+    def test_generate_resume(self):
+        """Test that resuming from a checkpoint gives the same results"""
+        grid_side = [-3,0,.1,.2,3]
+        checkpoint = 'test_mmgrid.ckpt'
+        ref = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+        ref.generate(2, seed=7)
+
+        # interrupt a run after a few chunks
+        grid = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+        fire_chunk = grid._fire_chunk
+        def interrupted(chunk, *args):
+            if chunk == (1, 2):
+                raise KeyboardInterrupt
+            return fire_chunk(chunk, *args)
+        grid._fire_chunk = interrupted
+        try:
+            self.assertRaises( KeyboardInterrupt, grid.generate, 2, seed=7,
+                               checkpoint=checkpoint, checkpoint_interval=0 )
+
+            # adaptive settings must match those of the interrupted run
+            grid = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+            self.assertRaises( mmgrid.mmGridError, grid.generate, 2,
+                               checkpoint=checkpoint, resume=True,
+                               target_err=0.05 )
+
+            grid = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+            grid.generate(2, checkpoint=checkpoint, resume=True)
+        finally:
+            os.remove(checkpoint)
+        self.assertTrue( (grid.grid['mats'] == ref.grid['mats']).all() )
+        self.assertTrue( (grid.grid['errs'] == ref.grid['errs']).all() )
+
+    def test_results_cache(self):
+        """Test saving and restoring the results of generate()"""
+        grid_side = [-3,0,.1,.2,3]
+        grid = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+        grid.generate(2, seed=3)
+        grid.save_results('test_mmgrid_results.npz')
+        try:
+            loaded = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+            loaded.load_results('test_mmgrid_results.npz')
+            self.assertTrue( (loaded.grid == grid.grid).all() )
+            self.assertEqual( loaded.max_err, grid.max_err )
+
+            other = mmgrid.mmGrid( ScdMesh( *([grid_side[1:]]*3) ) )
+            self.assertRaises( mmgrid.mmGridError, other.load_results,
+                               'test_mmgrid_results.npz' )
+        finally:
+            os.remove('test_mmgrid_results.npz')
+
+        path = os.path.join( os.path.dirname( __file__ ), 'h5m_files/hemispheres.h5m' )
+        key = mmgrid.cache_key(path, grid.scdmesh, 2)
+        self.assertEqual( key, mmgrid.cache_key(path, grid.scdmesh, 2) )
+        self.assertNotEqual( key, mmgrid.cache_key(path, grid.scdmesh, 3) )
+        self.assertNotEqual( key, mmgrid.cache_key(path, other.scdmesh, 2) )
+
+    def test_update(self):
+        """Test updating the voxels of a box, dense, sparse and from tags"""
+        grid_side = [-3,0,.1,.2,3]
+        full = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+        full.generate(2, True)
+        box = (-.5, -.5, -.5, .05, .05, .05)
+        block = (slice(0,2),)*3
+
+        grid = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+        grid.grid = full.grid.copy()
+        grid.grid[block] = 0
+        self.assertEqual( grid.update(2, True, box=box), block )
+        self.assertTrue( numpy.allclose( grid.grid['mats'], full.grid['mats'] ) )
+        self.assertTrue( numpy.allclose( grid.grid['errs'], full.grid['errs'] ) )
+        self.assertEqual( grid.update(2, True, box=(4,4,4,5,5,5)), None )
+
+        full.create_tags()
+        grid = mmgrid.mmGrid( full.scdmesh, sparse=True )
+        grid.load_tags()
+        self.assertEqual( len(grid.sparse.voxels),
+                          numpy.count_nonzero(full.grid['mats']) )
+        grid.update(2, True, box=box)
+        sp = grid.sparse
+        mats = full.grid['mats'].reshape(-1, len(grid.materials))
+        self.assertEqual( len(sp.voxels), numpy.count_nonzero(mats) )
+        self.assertTrue( numpy.allclose( mats[sp.voxels, sp.materials], sp.mats ) )
+
+    def test_homogeneous(self):
+        """Test finding homogeneous voxels and skipping their rays"""
+        grid_side = [-3,-.1,.1,.2,3]
+        grid = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+        hom = grid.find_homogeneous()
+        self.assertTrue( (hom[1] == -1).all() )
+        self.assertTrue( (hom[0] == grid.vol_mats[1]).all() )
+        self.assertTrue( (hom[2:] == grid.vol_mats[2]).all() )
+
+        grid.generate(2, True, homogeneous=True)
+        full = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+        full.generate(2, True)
+        self.assertTrue( numpy.allclose( grid.grid['mats'], full.grid['mats'] ) )
+        self.assertTrue( numpy.allclose( grid.grid['errs'], full.grid['errs'] ) )
+
+        sparse = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ), sparse=True )
+        sparse.generate(2, True, homogeneous=True)
+        mats = full.grid['mats'].reshape(-1, len(grid.materials))
+        sp = sparse.sparse
+        self.assertEqual( len(sp.voxels), numpy.count_nonzero(mats) )
+        self.assertTrue( numpy.allclose( mats[sp.voxels, sp.materials], sp.mats ) )
+
+    def test_grid_fragments(self):
+        """Test splitting ray segments into the voxels they cross"""
+        grid = mmgrid.mmGrid( ScdMesh( *([[-3,0,3]]*3) ) )
+        divs = numpy.array([0.,1.,2.,4.,5.])
+        widths = numpy.diff(divs)
+        segments, voxels, ratios = grid._grid_fragments( divs, widths,
+                numpy.array([0.5, 1.0, 4.5, 5.0, 2.0]),
+                numpy.array([4.5, 3.0, 9.0, 6.0, 2.0]) )
+        self.assertEqual( list(segments), [0,0,0,0,1,1,2] )
+        self.assertEqual( list(voxels), [0,1,2,3,1,2,3] )
+        self.assertEqual( list(ratios), [.5,1,1,.5,1,.5,.5] )
+
+    def test_vox_centers(self):
+        sm = ScdMesh( [0,1,3], [0,2], [-1,0] )
+        voxels = list(sm.iterateHex('xyz'))
+        centers = mmgrid.get_vox_centers( sm.imesh, voxels )
+        self.assertTrue( (centers == [[.5,1,-.5], [2,1,-.5]]).all() )
+        self.assertEqual( mmgrid.get_vox_centers( sm.imesh, [] ).shape, (0,3) )
+
+    def test_point_materials(self):
+        """Test that volume hints do not change the materials found"""
+        matdict = mmgrid.prepare_materials()
+        vol_mats = mmgrid.get_volume_materials(matdict)
+        points = [[x,y,z] for x in (-2,-.5,.5,2) for y in (-1,1)
+                  for z in (-1,.5,3)]
+        points += points[::-1]
+        expected = [vol_mats[pydagmc.dagmc.find_volume(p)] for p in points]
+        self.assertEqual( mmgrid.get_point_materials(matdict, points), expected )
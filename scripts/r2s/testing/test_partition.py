@@ -0,0 +1,92 @@
+import pickle
+import itertools
+import unittest
+
+import numpy
+
+from r2s.scdgrid import ScdMeshError
+from r2s.arrayscdmesh import ArrayScdMesh
+from r2s import partition
+
+try:
+    from itaps import iMesh
+    from r2s.scdmesh import ScdMesh
+except ImportError:
+    ScdMesh = None
+
+
+class PartitionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = ArrayScdMesh( range(0,9), [0,1,3,6,10], range(-3,0) )
+
+    def check_cover(self, blocks, dims):
+        count = numpy.zeros([dims[x + 3] - dims[x] for x in range(3)])
+        for block in blocks:
+            count[block.slices(dims)] += 1
+        self.assertTrue( (count == 1).all() )
+
+    def test_voxel_count(self):
+        for k in (1, 2, 3, 5, 8):
+            blocks = partition.partition( self.sm, k )
+            self.assertEqual( len(blocks), k )
+            self.assertEqual( [b.index for b in blocks], range(k) )
+            self.check_cover( blocks, self.sm.dims )
+            sizes = [numpy.prod(b.shape) for b in blocks]
+            self.assertTrue( max(sizes) <= 2 * min(sizes) )
+
+    def test_cost(self):
+        cost = numpy.zeros((8,4,2))
+        cost[:2] = 1
+        blocks = partition.partition( self.sm, 2, cost )
+        self.check_cover( blocks, self.sm.dims )
+        costs = [cost[b.slices(self.sm.dims)].sum() for b in blocks]
+        self.assertEqual( costs, [8, 8] )
+
+        self.sm.set_tag_array( 'cost', cost )
+        tagblocks = partition.partition( self.sm, 2, 'cost' )
+        self.assertEqual( [b.dims for b in tagblocks],
+                          [b.dims for b in blocks] )
+
+        self.assertRaises( ScdMeshError, partition.partition, self.sm, 2,
+                           numpy.ones((2,2,2)) )
+        self.assertRaises( ScdMeshError, partition.partition, self.sm, 65 )
+
+    def test_tiny(self):
+        am = ArrayScdMesh( range(4), range(4), range(2), ijk_min=(2,0,-1) )
+        blocks = partition.partition( am, 9 )
+        self.check_cover( blocks, am.dims )
+        self.assertTrue( all(numpy.prod(b.shape) == 1 for b in blocks) )
+
+
+class PartitionScdMeshTest(unittest.TestCase):
+    """Partitions of a ScdMesh, and their views"""
+
+    def setUp(self):
+        if ScdMesh is None:
+            raise unittest.SkipTest('itaps is not available')
+        self.sm = ScdMesh( range(0,9), [0,1,3,6,10], range(-3,0), iMesh.Mesh() )
+
+    def test_divisions(self):
+        blocks = partition.partition( self.sm, 4 )
+        for block in blocks:
+            view = block.view( self.sm )
+            self.assertEqual( view.dims, block.dims )
+            for x, dim in enumerate('xyz'):
+                self.assertEqual( block.divisions[x].tolist(),
+                                  view.getDivisions(dim) )
+
+    def test_pickle_and_merge(self):
+        vals = numpy.arange(64, dtype=numpy.float64).reshape(8,4,2)
+        self.sm.set_tag_array( 'vals', vals )
+        blocks = partition.partition( self.sm, 3 )
+        blocks = pickle.loads( pickle.dumps(blocks, pickle.HIGHEST_PROTOCOL) )
+        arrays = [2 * b.view(self.sm).get_tag_array('vals') for b in blocks]
+        partition.merge_tag( self.sm, blocks, arrays, 'doubled' )
+        self.assertTrue( (self.sm.get_tag_array('doubled') == 2 * vals).all() )
+
+        groups = [numpy.ones(b.shape + (3,)) * b.index for b in blocks]
+        merged = partition.merge_arrays( self.sm.dims, blocks, groups )
+        self.assertEqual( merged.shape, (8,4,2,3) )
+        for b in blocks:
+            self.assertTrue( (merged[b.slices(self.sm.dims)] == b.index).all() )
@@ -1,4 +1,5 @@
 from r2s.io import read_alara_phtn
+from r2s import grouptags
 from r2s.scdmesh import ScdMesh, ScdMeshError
 import os
 import os.path
@@ -116,6 +117,34 @@ class TestPhtnTotalsRetagging(unittest.TestCase):
         self.assertEqual(read_alara_phtn.read_to_h5m(inputfile, self.sm, retag=True, totals=True), 1)
 
 
+class TestPhtnVectorTags(unittest.TestCase):
+    """Tag a mesh with a single 'phtn_src' vector tag, and compare it with the
+    per-group tags.
+    """
+
+    def setUp(self):
+        os.system("cp " + meshfile_orig + " " + meshfile)
+        self.sm = ScdMesh.fromFile(meshfile)
+
+    def tearDown(self):
+        os.system("rm " + meshfile)
+
+    def test_vector_matches_groups(self):
+        voxels = list(self.sm.iterateHex('xyz'))
+        self.assertEqual(read_alara_phtn.read_to_h5m(inputfile, self.sm), 1)
+        groupdata = grouptags.read_group_data(self.sm.imesh, voxels, \
+                "phtn_src")
+        self.assertEqual(read_alara_phtn.read_to_h5m(inputfile, self.sm, \
+                retag=True, totals=True, vector_tags=True), 1)
+        self.assertEqual(self.sm.imesh.getTagHandle("phtn_src").sizeValues, 42)
+        self.assertRaises(iBase.TagNotFoundError, \
+                self.sm.imesh.getTagHandle, "phtn_src_group_001")
+        vectordata = grouptags.read_group_data(self.sm.imesh, voxels, \
+                "phtn_src")
+        self.assertEqual(vectordata.tolist(), groupdata.tolist())
+        self.assertEqual(grouptags.count_groups(self.sm.imesh, "phtn_src"), 42)
+
+
 class TestGetCoolingStepName(unittest.TestCase):
     """We test the get_cooling_step_name() method with direct calls
     """
@@ -0,0 +1,84 @@
+import unittest
+
+import numpy
+
+from r2s.scdgrid import ScdMeshError
+from r2s.arrayscdmesh import ArrayScdMesh
+from r2s import remap
+
+try:
+    from itaps import iMesh
+    from r2s.scdmesh import ScdMesh
+except ImportError:
+    ScdMesh = None
+
+
+class RemapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.am = ArrayScdMesh( [0,1,3,4], [0,2,3], [0,1] )
+        self.vals = numpy.array([[[1.], [2.]],
+                                 [[3.], [4.]],
+                                 [[5.], [0.]]])
+        self.am.set_tag_array( 'n_group_total', self.vals )
+        self.am.set_tag_array( 'n_group_total_error',
+                               numpy.ones((3,2,1)) * 0.1 )
+
+    def test_weights(self):
+        w = remap.overlap_weights( [0,1,3,4], [0,2,4] )
+        self.assertEqual( w.tolist(), [[0.5, 0.5, 0], [0, 0.5, 0.5]] )
+        self.assertRaises( ScdMeshError, remap.overlap_weights, [0,1], [0,2] )
+        self.assertRaises( ScdMeshError, remap.overlap_weights, [0,1], [1,0] )
+
+    def test_conservative(self):
+        new = remap.remap( self.am, [0,2,4], [0,3], [0,1] )
+        vals = new.get_tag_array( 'n_group_total' )
+        self.assertEqual( vals.shape, (2,1,1) )
+        # value * volume is conserved
+        self.assertAlmostEqual( (vals * new.hex_volumes()).sum(),
+                                (self.vals * self.am.hex_volumes()).sum() )
+        self.assertAlmostEqual( vals[0,0,0], (1*2 + 2*1 + 3*2 + 4*1) / 6. )
+
+    def test_errors(self):
+        new = remap.coarsen( self.am, (3,2,1) )
+        vols = self.am.hex_volumes()
+        w = vols / vols.sum()
+        val = (w * self.vals).sum()
+        sigma = numpy.sqrt(((w * self.vals * 0.1) ** 2).sum())
+        self.assertAlmostEqual( new.get_tag_array('n_group_total')[0,0,0],
+                                val )
+        self.assertAlmostEqual(
+                new.get_tag_array('n_group_total_error')[0,0,0],
+                sigma / val )
+
+        # absolute errors, as written by mmgrid
+        self.am.set_tag_array( 'mat1', numpy.ones((3,2,1)) )
+        self.am.set_tag_array( 'mat1_err', numpy.ones((3,2,1)) * 0.3 )
+        new = remap.coarsen( self.am, 3, tagnames=['mat1', 'mat1_err'] )
+        self.assertEqual( new.get_tag_array('mat1').shape, (1,1,1) )
+        self.assertAlmostEqual( new.get_tag_array('mat1')[0,0,0], 1 )
+        self.assertAlmostEqual( new.get_tag_array('mat1_err')[0,0,0],
+                                0.3 * numpy.sqrt((w ** 2).sum()) )
+        self.assertRaises( ScdMeshError, remap.coarsen, self.am, 3,
+                           ['mat1_err'] )
+
+    def test_refine(self):
+        new = remap.refine( self.am, (2,1,3) )
+        self.assertEqual( new.getDivisions('x'), [0,0.5,1,2,3,3.5,4] )
+        self.assertEqual( len(new.getDivisions('z')), 4 )
+        vals = new.get_tag_array( 'n_group_total' )
+        self.assertTrue( (vals[1::2,:,1] == self.vals[:,:,0]).all() )
+        self.assertTrue( numpy.allclose(
+                new.get_tag_array('n_group_total_error')[vals > 0], 0.1) )
+
+    @unittest.skipIf(ScdMesh is None, 'itaps is not available')
+    def test_scdmesh(self):
+        sm = self.am.toScdMesh( iMesh.Mesh() )
+        groups = numpy.arange(18, dtype=numpy.float64).reshape(3,2,1,3)
+        sm.set_tag_array( 'n_flux', groups )
+        new = remap.coarsen( sm, (1,2,1) )
+        self.assertTrue( isinstance(new, ScdMesh) )
+        self.assertEqual( new.dims, (0,0,0,3,1,1) )
+        expected = (2 * groups[:,0] + groups[:,1]) / 3.
+        self.assertTrue( numpy.allclose(new.get_tag_array('n_flux')[:,0],
+                                        expected) )
@@ -145,6 +145,30 @@ structuredmesh = True
 # also increase the runtime of r2s_step1.
 mmgrid_rays = 10
 
+# The number of processes among which mmgrid's rays are split.
+# Set this to the number of available cores to speed up r2s_step1.
+mmgrid_workers = 1
+
+# How mmgrid chooses ray starting points: random, grid, jitter, halton or
+# sobol.  The stratified methods (jitter, halton, sobol) reach a given
+# material error with several times fewer rays than random points.
+mmgrid_sampling = random
+
+# Seed of the random ray starting points of mmgrid.  By default a new seed
+# is drawn on each run.
+# mmgrid_seed = 1
+
+# To cache macromaterial grids, uncomment the following and set mmgrid_seed.
+# When the geometry, the mesh divisions, the ray settings and the seed are
+# unchanged since a previous run, r2s_step1.py reuses its results instead of
+# ray tracing again.
+# mmgrid_cache = mmgrid_cache
+
+# With an unstructured mesh of tetrahedra (structuredmesh = False), the
+# number of points sampled in each tet to estimate its material fractions.
+# Leave at 0 to give each tet the material at its center.
+tet_samples = 0
+
 # If gen_mmgrid is True, ray tracing is performed to generate the macromaterials
 #  grid during r2s_step1.py. If the macromaterial grid already exists, set this
 #  parameter to False to avoid re-running the ray tracing.
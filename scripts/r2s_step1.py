@@ -97,7 +97,8 @@ def load_config_params(config):
     Returns
     -------
     A list of the following values taken from the .cfg file:
-    gen_mmgrid, mmgrid_rays, opt_step2setup, isscd
+    gen_mmgrid, mmgrid_rays, opt_step2setup, isscd, mmgrid_workers,
+    mmgrid_sampling, mmgrid_cache, tet_samples, mmgrid_seed
     """
     # This list stores (1) parameter names as listed in r2s.cfg; 
     # (2) their defaults; (3) which 'get' function to use for the parameter
@@ -105,7 +106,12 @@ def load_config_params(config):
             [ 'gen_mmgrid',     True,  config.getboolean],
             [ 'mmgrid_rays',    10,    config.getint],
             [ 'step2setup',     False, config.getboolean],
-            [ 'structuredmesh', True,  config.getboolean]
+            [ 'structuredmesh', True,  config.getboolean],
+            [ 'mmgrid_workers', 1,     config.getint],
+            [ 'mmgrid_sampling', 'random', config.get],
+            [ 'mmgrid_cache',   '',    config.get],
+            [ 'tet_samples',    0,     config.getint],
+            [ 'mmgrid_seed',    None,  config.getint]
             ]
 
     param_list = list()
@@ -119,9 +125,12 @@ def load_config_params(config):
             # Use default
             param_list.append( param[1])
 
-    (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd) = param_list
+    (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd, mmgrid_workers,
+            mmgrid_sampling, mmgrid_cache, tet_samples, mmgrid_seed) = \
+            param_list
 
-    return (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd)
+    return (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd, mmgrid_workers,
+            mmgrid_sampling, mmgrid_cache, tet_samples, mmgrid_seed)
 
 
 ###########################
@@ -177,7 +186,9 @@ def handle_meshtal(meshtal_file, gen_mmgrid, datafile, isscd=True):
 
 
 def handle_mesh_materials(mesh, mcnp_geom, gen_mmgrid=False, mmgrid_rays=10, 
-                          isscd=True):
+                          isscd=True, mmgrid_workers=1,
+                          mmgrid_sampling='random', mmgrid_cache=None,
+                          tet_samples=0, mmgrid_seed=None):
     """Tag the mesh with materials
 
     Parameters
@@ -193,12 +204,36 @@ def handle_mesh_materials(mesh, mcnp_geom, gen_mmgrid=False, mmgrid_rays=10,
     isscd : boolean
         If True, handle geometry as a structured mesh. Otherwise mesh is
         assumed to be unstructured and materials are based on voxel centers.
+    mmgrid_workers : integer
+        Number of processes to run mmgrid's ray tracing in
+    mmgrid_sampling : string
+        Method of choosing mmgrid's ray starting points; see
+        mmgrid.RAY_SAMPLING
+    mmgrid_cache : string
+        Directory in which mmgrid results are cached, keyed on the geometry
+        file, mesh divisions, ray settings and seed, so that unchanged
+        problems skip the ray tracing.  No caching if None or empty, or if
+        mmgrid_seed is None.
+    tet_samples : integer
+        For unstructured meshes of tetrahedra, number of points sampled in
+        each tet to estimate its material fractions.  If 0, each tet takes
+        the material at its center.
+    mmgrid_seed : integer
+        Seed of mmgrid's random ray starting points.  If None, a random seed
+        is drawn, and results are not cached.
     """
 
     print "Loading geometry file `{0}'".format(mcnp_geom)
     mmgrid.load_geom(mcnp_geom)
 
-    if not isscd: # is unstructured
+    if not isscd and tet_samples > 0:
+        # Sample points in each tet for its material fractions
+        print "Will sample {0} points per tet".format(tet_samples)
+        grid = mmgrid.TetMatGrid(mesh)
+        grid.generate(tet_samples)
+        grid.create_tags()
+
+    elif not isscd: # is unstructured
         # Use non-structured mesh approach: tag material of voxel center points
         grid = mmgrid.SingleMatGrid(mesh)
         grid.generate()
@@ -209,7 +244,25 @@ def handle_mesh_materials(mesh, mcnp_geom, gen_mmgrid=False, mmgrid_rays=10,
         print "Will use {0} rays per mesh row".format(mmgrid_rays)
 
         grid = mmgrid.mmGrid( mesh )
-        grid.generate( mmgrid_rays, False )
+
+        cache_file = None
+        if mmgrid_cache and mmgrid_seed is None:
+            print "Not caching macromaterials: mmgrid_cache needs mmgrid_seed"
+        elif mmgrid_cache:
+            key = mmgrid.cache_key(mcnp_geom, mesh, mmgrid_rays,
+                                   mmgrid_sampling, mmgrid_seed)
+            cache_file = os.path.join(mmgrid_cache, key + '.npz')
+
+        if cache_file and os.path.exists(cache_file):
+            print "Using cached macromaterials from `{0}'".format(cache_file)
+            grid.load_results(cache_file)
+        else:
+            grid.generate( mmgrid_rays, mmgrid_sampling, mmgrid_workers,
+                           mmgrid_seed )
+            if cache_file:
+                if not os.path.isdir(mmgrid_cache):
+                    os.makedirs(mmgrid_cache)
+                grid.save_results(cache_file)
         grid.create_tags()
 
     else:
@@ -297,14 +350,16 @@ if __name__ == "__main__":
         (meshtal_file, mcnp_geom, alara_snippet, visfile, datafile, \
             fluxin, alara_geom, alara_matdict) = load_config_files(config)
 
-        (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd) = \
+        (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd, mmgrid_workers,
+                mmgrid_sampling, mmgrid_cache, tet_samples, mmgrid_seed) = \
                 load_config_params(config)
 
         # Do step 1
         mesh = handle_meshtal(meshtal_file, gen_mmgrid, datafile, isscd)
 
         handle_mesh_materials( \
-                mesh, mcnp_geom, gen_mmgrid, mmgrid_rays, isscd)
+                mesh, mcnp_geom, gen_mmgrid, mmgrid_rays, isscd, mmgrid_workers,
+                mmgrid_sampling, mmgrid_cache, tet_samples, mmgrid_seed)
 
         save_mesh(mesh, datafile, visfile)
 
@@ -5,7 +5,8 @@
 # ./get_value.py structured_mesh x_value y_value z_value tag_name
 #
 # Note, the x_value, y_value, and z_value are the indicies of the mesh, 
-# start at (0, 0, 0).
+# start at (0, 0, 0).  With the -c flag, they are instead the coordinates of
+# a point, and the value of the voxel containing the point is printed.
 #
 # The script will automatically search for a tag in the for tag_name+_error.
 # If it exists, the error value will be appended to the answer:
@@ -21,6 +22,19 @@ from r2s.scdmesh import ScdMesh
 
 def print_value(sm, x, y, z, tag_name):
     voxel=sm.getHex(x,y,z)
+    print_voxel_value(sm, voxel, tag_name)
+
+
+def print_value_at(sm, x, y, z, tag_name):
+    ijk, flat, outside = sm.locate([[x, y, z]])
+    if outside[0]:
+        print >>sys.stderr, 'Point ({0}, {1}, {2}) is outside of the mesh' \
+                .format(x, y, z)
+        sys.exit(1)
+    print_voxel_value(sm, sm.getHex(*ijk[0]), tag_name)
+
+
+def print_voxel_value(sm, voxel, tag_name):
     ans=str(sm.imesh.getTagHandle(tag_name)[voxel])
     
     try:
@@ -36,8 +50,9 @@ def main(arguments=None):
     parser = OptionParser\
              (usage='%prog structured_mesh x_value y_value z_value tag_name')
 
-    #parser.add_option('-o', dest='fluxin_name', default='ALARAflux.in',\
-    #    help='Name of ALARA fluxin output file, default=%default')
+    parser.add_option('-c', '--coords', action='store_true', dest='coords',\
+        default=False, help='Interpret x_value, y_value and z_value as ' \
+        'coordinates of a point instead of mesh indices. Default=%default')
 
     (opts, args) = parser.parse_args( arguments )
 
@@ -49,7 +64,11 @@ def main(arguments=None):
     #Load Structured mesh from file
     sm=ScdMesh.fromFile(args[1])
 
-    print_value(sm, int(args[2]), int(args[3]), int(args[4]), args[5])
+    if opts.coords:
+        print_value_at(sm, float(args[2]), float(args[3]), float(args[4]), \
+                args[5])
+    else:
+        print_value(sm, int(args[2]), int(args[3]), int(args[4]), args[5])
 
 if __name__ == '__main__':
     main(sys.argv)
@@ -4,6 +4,7 @@ import linecache
 from optparse import OptionParser
 import sys
 import datetime
+import numpy as np
 # itaps imports
 from itaps import iMesh
 from itaps import iBase
@@ -76,12 +77,8 @@ def find_max_fluxes(flux_mesh, e_group_names):
 
     max_fluxes = [0]*len(e_group_names)
     for i, e_group_name in enumerate(e_group_names):
-
-        for flux_voxel in flux_mesh.iterateHex('xyz'):
-            flux = flux_mesh.imesh.getTagHandle(e_group_name)[flux_voxel]
-
-            if flux > max_fluxes[i]:
-                max_fluxes[i] = flux
+        fluxes = flux_mesh.get_tag_array(e_group_name)
+        max_fluxes[i] = max(max_fluxes[i], fluxes.max())
 
     return max_fluxes
 
@@ -108,10 +105,9 @@ def create_ww_mesh(flux_mesh, e_group_names):
                        flux_mesh.getDivisions('z'))
 
     # create ww tags
+    zeros = np.zeros([ww_mesh.dims[3+i] - ww_mesh.dims[i] for i in range(3)])
     for e_group_name in e_group_names:
-            ww_tag = ww_mesh.imesh.createTag('ww_{0}'.format(e_group_name), 1, float)
-            for voxel in ww_mesh.iterateHex('xyz'):
-                ww_tag[voxel] = 0
+            ww_mesh.set_tag_array('ww_{0}'.format(e_group_name), zeros)
 
     # create e_upper_bound tags
     e_upper_bounds = \
@@ -188,25 +184,21 @@ def magic(flux_mesh, totals_bool, null_value, tolerance, ww_mesh=None):
         print "\tSupplied meshes confirmed to have same dimensions"
 
 
-    # iterate through all voxels and energy groups and apply MAGIC  
-    flux_voxels = flux_mesh.iterateHex('xyz')
-    ww_voxels = ww_mesh.iterateHex('xyz')
-
-    for (flux_voxel, ww_voxel) in zip(flux_voxels, ww_voxels):
+    # apply MAGIC to all voxels of each energy group at once
+    for i, e_group_name in enumerate(e_group_names):
 
-        for i, e_group_name in enumerate(e_group_names):
+        flux = flux_mesh.get_tag_array(e_group_name)
+        error = flux_mesh.get_tag_array(e_group_name + '_error')
+        ww = ww_mesh.get_tag_array('ww_{0}'.format(e_group_name))
 
-            flux = flux_mesh.imesh.getTagHandle(e_group_name)[flux_voxel]
-            error = flux_mesh.imesh.getTagHandle(e_group_name + '_error')[flux_voxel]
-            ww = ww_mesh.imesh.getTagHandle('ww_{0}'.format(e_group_name))[ww_voxel]
+        magic_vox = (error < tolerance) & (error != 0) & (ww != -1)
+        ww[magic_vox] = flux[magic_vox]/(2*max_fluxes[i]) # apply magic method
 
-            if error < tolerance and error != 0 and ww != -1:
-                ww_mesh.imesh.getTagHandle('ww_{0}'.format(e_group_name))[ww_voxel]\
-                     = flux/(2*max_fluxes[i]) # apply magic method
+        if ww_bool == False:
+            null_vox = ~magic_vox & ((error > tolerance) | (error == 0.0))
+            ww[null_vox] = null_value
 
-            elif ww_bool == False and (error > tolerance or error == 0.0):
-                ww_mesh.imesh.getTagHandle('ww_{0}'.format(e_group_name))[ww_voxel] \
-                    = null_value
+        ww_mesh.set_tag_array('ww_{0}'.format(e_group_name), ww)
 
     return ww_mesh
 
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+###############################################################################
+# Benchmark of the throughput and accuracy of mmgrid, without DagMC.
+#
+# The geometry is an analytic one from r2s.geometry: a sphere and a cylinder
+# in a box of void, whose material volumes are known exactly.  mmgrid is run
+# on a structured mesh over the box, and the script prints the number of
+# rays fired per second and the error of each material's total volume, the
+# sum over voxels of its fractions times the voxel volumes.  The sigma column
+# combines the voxels' errors as if they were independent; a ray samples a
+# whole row of voxels, so it underestimates the error of the total.
+###############################################################################
+
+import sys
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+from r2s import mmgrid
+from r2s.arrayscdmesh import ArrayScdMesh
+from r2s.geometry import Box, Sphere, Cylinder, CSGGeometry
+
+
+def benchmark_geometry():
+    """Return the benchmark geometry and the exact volume of each material
+    """
+    geom = CSGGeometry(Box([-10] * 3, [10] * 3),
+                       [(Sphere([-4, 0, 0], 3), 1, -1.0),
+                        (Cylinder([4, 0, -6], [0, 0, 12], 2), 2, -2.0)])
+    volumes = {(1, -1.0): 4 / 3. * np.pi * 3**3,
+               (2, -2.0): np.pi * 2**2 * 12}
+    return geom, volumes
+
+
+def main(arguments=None):
+
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-n', dest='numrays', default=10, type=int,
+        help='Set N.  N^2 rays fired per row.  Default N=%default')
+    parser.add_option('-d', dest='ndivs', default=20, type=int,
+        help='Number of mesh divisions per side, default=%default')
+    parser.add_option('-r', dest='sampling', default='random',
+        choices=sorted(mmgrid.RAY_SAMPLING),
+        help='Ray sampling method, default=%default')
+    parser.add_option('-w', dest='workers', default=1, type=int,
+        help='Number of processes firing rays, default=%default')
+    parser.add_option('-s', dest='seed', default=0, type=int,
+        help='Random seed, default=%default')
+
+    (opts, args) = parser.parse_args(arguments)
+
+    mmgrid._quiet = True
+    geom, volumes = benchmark_geometry()
+    side = np.linspace(-10, 10, opts.ndivs + 1)
+    grid = mmgrid.mmGrid(ArrayScdMesh(side, side, side), geometry=geom)
+
+    start = time.time()
+    grid.generate(opts.numrays, opts.sampling, opts.workers, opts.seed)
+    elapsed = time.time() - start
+    rays = 3 * opts.ndivs**2 * opts.numrays**2
+
+    print "{0} rays in {1:.2f} s: {2:.0f} rays/s".format(rays, elapsed,
+                                                        rays / elapsed)
+    voxel_volume = (20.0 / opts.ndivs)**3
+    print "{0:>16} {1:>12} {2:>12} {3:>12} {4:>12}".format('material',
+            'exact', 'estimate', 'error', 'sigma')
+    for key, exact in sorted(volumes.items()):
+        matnum, name = grid.materials[key]
+        estimate = grid.grid['mats'][..., matnum].sum() * voxel_volume
+        sigma = np.sqrt((grid.grid['errs'][..., matnum]**2).sum()) * \
+                voxel_volume
+        print "{0:>16} {1:12.4f} {2:12.4f} {3:12.4f} {4:12.4f}".format(name,
+                exact, estimate, estimate - exact, sigma)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+###############################################################################
+# Benchmark of the convergence of mmgrid's ray sampling methods.
+#
+# mmgrid estimates the volume fraction of a material in a voxel as the mean
+# fraction of the voxel's length covered by the material along rays fired
+# through it.  This script takes the analytic geometry of a sphere inside a
+# cubic voxel, where the chord length of each ray is known exactly, and
+# compares the RMS error of this estimate for each sampling method in
+# mmgrid.RAY_SAMPLING, as the number of rays N^2 grows.
+#
+# Random rays converge as 1/N (that is, 1/sqrt(rays)); the stratified methods
+# should converge faster.
+###############################################################################
+
+import random
+import sys
+from optparse import OptionParser
+
+import numpy as np
+
+from r2s import mmgrid
+
+
+def sphere_fraction_estimate(rays, center, radius):
+    """Estimate the volume fraction of a sphere in the unit cube from rays
+
+    Parameters
+    ----------
+    rays : generator
+        Generator of (a,b) ray origins on a face of the cube, as returned by
+        the functions in mmgrid.RAY_SAMPLING.
+    center : sequence of 3 floats
+        Center of the sphere; the first two coordinates are in the plane of
+        the ray origins.
+    radius : float
+        Radius of the sphere, which must lie inside the cube.
+    """
+    ab = np.array(list(rays(0.0, 1.0, 0.0, 1.0)))
+    r2 = (ab[:,0] - center[0])**2 + (ab[:,1] - center[1])**2
+    chords = 2 * np.sqrt(np.maximum(radius**2 - r2, 0.0))
+    return chords.mean()
+
+
+def convergence(sampling, ns, trials, center, radius, seed=0):
+    """Return the RMS errors of the estimates of a sampling method
+
+    Returns an array of the RMS error over trials estimates for each N in ns.
+    """
+    exact = 4.0 / 3.0 * np.pi * radius**3
+    rng = random.Random(seed)
+    errors = []
+    for n in ns:
+        estimates = [sphere_fraction_estimate(
+                            mmgrid.RAY_SAMPLING[sampling](n, rng),
+                            center, radius) for _ in xrange(trials)]
+        errors.append(np.sqrt(np.mean((np.array(estimates) - exact)**2)))
+    return np.array(errors)
+
+
+def main(arguments=None):
+
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-n', dest='max_n', default=32, type=int,
+        help='Largest N; N^2 rays are fired.  Default=%default')
+    parser.add_option('-t', dest='trials', default=200, type=int,
+        help='Number of estimates per N and method, default=%default')
+    parser.add_option('-r', dest='radius', default=0.3, type=float,
+        help='Radius of the sphere in the unit voxel, default=%default')
+
+    (opts, args) = parser.parse_args(arguments)
+
+    ns = [2**x for x in range(1, int(np.log2(opts.max_n)) + 1)]
+    center = (0.45, 0.55, 0.5)
+
+    print "RMS error of the volume fraction of a sphere of radius {0} " \
+          "({1} trials)".format(opts.radius, opts.trials)
+    print "{0:>8} ".format('rays') + \
+          ''.join('{0:>12}'.format(n**2) for n in ns) + '{0:>8}'.format('order')
+    for sampling in sorted(mmgrid.RAY_SAMPLING):
+        if sampling == 'grid':
+            # a grid has a single, deterministic error
+            errors = convergence(sampling, ns, 1, center, opts.radius)
+        else:
+            errors = convergence(sampling, ns, opts.trials, center,
+                                 opts.radius)
+        # fitted order of convergence in the number of rays
+        order = -np.polyfit(np.log(np.array(ns)**2),
+                            np.log(np.maximum(errors, 1e-300)), 1)[0]
+        print "{0:>8} ".format(sampling) + \
+              ''.join('{0:12.3e}'.format(e) for e in errors) + \
+              '{0:8.2f}'.format(order)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])